@@ -17,13 +17,25 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import sys
+
 from rpython.rlib.parsing.tree import RPythonVisitor, Symbol, Nonterminal
 
 from utils import dotview, LabelledGraph, preparer
-from graph import (Application, BuiltinNode, Lambda, Param, Cons, ConsNode,
+from graph import (Application, BuiltinNode, Lambda, Param, Cons, Constructor,
                    Typeswitch, Y)
-from builtin import default_context, IntPtr, CharPtr, StrPtr, unit
-from pyops import ASSOC, FIXITY
+from context import SimpleRecord, OperatorRecord, LazyRecord, symbols
+from builtin import make_type, default_context, IntPtr, CharPtr, StrPtr
+from pyops import ASSOC, FIXITY, MemoNode, OverloadNode, memo_registry
+from passes import pass_manager
+from cafs import caf_registry
+from soagraph import soa_options
+from closures import closure_options
+
+
+class PragmaError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
 
 
 class Expression(object):
@@ -44,39 +56,74 @@ class Expression(object):
     def __init__(self, eval, nodes):
         self.eval = eval
         self.elements = list(nodes)
+        # The record each element that is a name resolves to (None for other
+        # elements), and the binding power, associativity and fixity each
+        # element has as an operator, worked out once here rather than each
+        # time resolve examines the element.
+        n = len(self.elements)
+        self.records = [None] * n
+        self.precs = [0] * n
+        self.assocs = [ASSOC.LEFT] * n
+        self.fixities = [FIXITY.PREFIX] * n
+        for i in range(n):
+            record = self.resolve_name(self.elements[i])
+            self.records[i] = record
+            prec, assoc, fixity = self.get_binding_power_assoc_fixity(record)
+            self.precs[i] = prec
+            self.assocs[i] = assoc
+            self.fixities[i] = fixity
+        # index of the next element to resolve
+        self.pos = 0
 
     def __repr__(self):
         """
         NOT_RPYTHON:
         """
-        return 'Expression(<Eval>, %r)' % self.elements
+        return 'Expression(<Eval>, %r)' % self.elements[self.pos:]
 
-    def end(self):
-        return not self.elements
+    def resolve_name(self, node):
+        if node.symbol == 'IDENT':
+            assert isinstance(node, Symbol)
+            symbol = symbols.find(node.additional_info)
+            return self.eval.context.resolve(symbol)
+        return None
 
-    def peek(self):
-        return self.elements[0]
+    def end(self):
+        return self.pos >= len(self.elements)
 
     def advance(self):
-        return self.elements.pop(0)
+        """
+        Move past the next element, returning its index.
+        """
+        i = self.pos
+        self.pos = i + 1
+        return i
 
     def resolve(self, rbp=0):
         if self.end():
             return None
 
-        tmp = self.advance()
-        left = self.nud(tmp)
+        i = self.advance()
+        left = self.nud(self.elements[i], self.records[i])
 
-        while not self.end() and rbp < self.lbp(self.peek()):
-            tmp = self.advance()
-            left = self.led(tmp, left)
+        while not self.end() and rbp < self.precs[self.pos]:
+            i = self.advance()
+            left = self.led(i, left)
 
         return left
 
-    def nud(self, node):
+    def nud(self, node, record):
+        if record is not None:
+            graph = record.graph
+            node = graph.node
+            if isinstance(node, OverloadNode) and node.cache is None:
+                # each use of an overloaded name caches its own choices
+                return node.overload.use()
+            return graph
+        # not a name, or an unbound one (which visit_IDENT reports)
         return self.eval.dispatch(node)
 
-    def led(self, node, left):
+    def led(self, i, left):
         # When we call here, we need to check what kind of operator node is.
         # If infix, then we apply it to left (given) and right (call resolve
         # recursively to get it).
@@ -85,14 +132,16 @@ class Expression(object):
         # If prefix (remember that everything is a prefix operator unless
         # explicitly declared otherwise), we apply left to it and return that.
 
-        rbp, assoc, fix = self.get_binding_power_assoc_fixity(node)
+        rbp = self.precs[i]
+        assoc = self.assocs[i]
+        fix = self.fixities[i]
         # pass a value less than our binding power to the recursive call
         # to get right associativity
         if assoc is ASSOC.RIGHT:
             rbp = rbp -1
 
 
-        this = self.eval.dispatch(node)
+        this = self.nud(self.elements[i], self.records[i])
         if fix is FIXITY.PREFIX:
             applied = Application(left, this)
         elif fix is FIXITY.POSTFIX:
@@ -106,24 +155,90 @@ class Expression(object):
 
         return applied
 
-    def get_binding_power_assoc_fixity(self, node):
-        if node.symbol == 'IDENT':
-            assert isinstance(node, Symbol)
-            name = node.additional_info
-            if self.eval.context.is_operator(name):
-                prec = self.eval.context.get_prec(name)
-                assoc = self.eval.context.get_assoc(name)
-                fixity = self.eval.context.get_fixity(name)
-                return prec, assoc, fixity
+    def get_binding_power_assoc_fixity(self, record):
+        if isinstance(record, OperatorRecord):
+            return record.prec, record.assoc, record.fixity
 
         # Default precedence and associativity for function application, since
         # every term that is not explicitly a name for an operator is parsed
         # as if it were an ordinary function.
         return 10000, ASSOC.LEFT, FIXITY.PREFIX
 
-    def lbp(self, node):
-        lbp, _, _ = self.get_binding_power_assoc_fixity(node)
-        return lbp
+
+class DefinitionOptions(object):
+    """
+    Whether top level definitions are lazy: bound to a Definition that builds
+    the definition's graph when its name is first looked up, so that loading
+    a file costs little for the definitions that are never used.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lazy = False
+
+definition_options = DefinitionOptions()
+
+
+class Definition(LazyRecord):
+    """
+    A top level definition whose graph hasn't been built yet. number orders
+    the definitions made by eval; a definition can only use the ones before
+    it, as it could if it had been built straight away.
+    """
+    def __init__(self, eval, name, params, block, memo, number):
+        self.graph = None
+        self.eval = eval
+        self.name = name
+        self.params = params
+        self.block = block
+        self.memo = memo
+        self.number = number
+        self.record = None
+
+    def force(self):
+        if self.record is None:
+            eval = self.eval
+            if self.number > eval.building:
+                # it wouldn't have been bound yet
+                raise KeyError(self.name)
+            outer = eval.building
+            eval.building = self.number
+            try:
+                graph = eval.build(self.name, self.params, self.block,
+                                   self.memo)
+            finally:
+                eval.building = outer
+            self.record = SimpleRecord(graph)
+            # the name may have been rebound since; if so the new binding
+            # stays, and only whatever looked this definition up sees it
+            if eval.context.binds(self.name, self):
+                eval.context.bind_record(self.name, self.record)
+                if not self.params:
+                    caf_registry.add(self.name, graph)
+        return self.record
+
+    def mentions(self, name):
+        for param in self.params:
+            if _mentions(param, name):
+                return True
+        return _mentions(self.block, name)
+
+    def __repr__(self):
+        """
+        NOT_RPYTHON:
+        """
+        return '<definition of %s>' % self.name
+
+
+def _mentions(node, name):
+    if isinstance(node, Symbol):
+        return node.symbol == 'IDENT' and node.additional_info == name
+    assert isinstance(node, Nonterminal)
+    for child in node.children:
+        if _mentions(child, name):
+            return True
+    return False
 
 
 class Eval(RPythonVisitor):
@@ -134,12 +249,21 @@ class Eval(RPythonVisitor):
     that return a graph (see graph.py), and may not update self.context (but
     may refer to it for name resolution).
     """
-    def __init__(self, context=default_context):
+    def __init__(self, context=default_context, toplevel=True):
         """
-        context is the initial context to use; dictionary mapping strings to
-        graph nodes
+        context is the enclosing scope; names are bound in a new scope inside
+        it (see Context.child), so they don't affect it
+
+        toplevel should be False for the Evals used for the local scopes of
+        definitions.
         """
-        self.context = context.copy()
+        self.context = context.child()
+        self.toplevel = toplevel
+        # lazy definitions that haven't been built yet, the number of them
+        # made so far, and the number of the one being built (if any)
+        self.pending = []
+        self.ndefinitions = 0
+        self.building = sys.maxint
 
     def visit_program(self, node):
         for n in node.children:
@@ -148,9 +272,18 @@ class Eval(RPythonVisitor):
     def visit_print_statement(self, node):
         for n in node.children:
             graph = self.dispatch(n)
+            string = None
+            if soa_options.enabled:
+                string = soa_options.evaluate(graph)
+            elif closure_options.enabled:
+                string = closure_options.evaluate(graph)
+            if string is not None:
+                print string
+                continue
             graph.reduce_WHNF_inplace()
             # graph should now be a value node
             print graph.node.to_string()
+        caf_registry.enforce_budget()
 
     def visit_show_statement(self, node):
         # See the docstrings of the following two methods for explanation.
@@ -207,6 +340,28 @@ class Eval(RPythonVisitor):
 
 
     def visit_assign_statement(self, node):
+        self.assign(node, False)
+
+    def visit_pragma_statement(self, node):
+        memo = False
+        for i in range(len(node.children) - 1):
+            pragma = node.children[i].children[0]
+            assert isinstance(pragma, Symbol)
+            if pragma.additional_info == 'memo':
+                memo = True
+            else:
+                raise PragmaError('unknown pragma "@%s"'
+                                  % pragma.additional_info)
+        self.assign(node.children[-1], memo)
+
+    def assign(self, node, memo):
+        """
+        Bind the name defined by the assign_statement node. If memo is true,
+        the definition is a memoised function (see pyops.MemoNode).
+
+        When definitions are lazy (see DefinitionOptions), a top level name is
+        bound to a Definition, and its graph is built when it's first used.
+        """
         ident = node.children[0]
         block = node.children[-1]
 
@@ -219,8 +374,36 @@ class Eval(RPythonVisitor):
         assert isinstance(ident, Symbol)
         name = ident.additional_info
 
+        if memo:
+            # A memoised function keeps its table in a MemoNode that all the
+            # recursive calls must share, so it must not be copied by Y or by
+            # instantiating an enclosing function.
+            if not self.toplevel:
+                raise PragmaError('@memo can only be used on top level '
+                                  'definitions, not "%s"' % name)
+            if not params:
+                raise PragmaError('@memo can only be used on functions, '
+                                  'not "%s"' % name)
+
+        if self.toplevel and definition_options.lazy:
+            self.flush_if_bound(name)
+            self.ndefinitions += 1
+            definition = Definition(self, name, params, block, memo,
+                                    self.ndefinitions)
+            self.pending.append(definition)
+            self.context.bind_record(name, definition)
+        else:
+            graph = self.build(name, params, block, memo)
+            if self.toplevel and not params:
+                caf_registry.add(name, graph)
+            self.context.bind(name, graph)
+
+    def build(self, name, params, block, memo):
+        """
+        Return the graph for a definition of name.
+        """
         # create a scope for the function's parameters and local variables
-        local_scope = Eval(self.context)
+        local_scope = Eval(self.context, False)
 
         # Here we assume that the definition may be recursive; use Y to make
         # an equivalent non-recursive definition by factoring out the function
@@ -235,10 +418,36 @@ class Eval(RPythonVisitor):
 
         graph = local_scope.make_lambda_chain(params, block)
 
-        graph = Application(Y, Lambda(recursion_marker, graph))
+        if memo:
+            # Tie the knot directly instead of using Y: overwriting the
+            # marker makes every recursive reference point at the MemoNode.
+            recursion_marker.node = MemoNode(graph,
+                                             memo_registry.new_table(name),
+                                             len(params), [])
+            graph = recursion_marker
+        else:
+            graph = Application(Y, Lambda(recursion_marker, graph))
 
-        # bind the name in the original scope
-        self.context.bind(name, graph)
+        # give the optimisation passes a chance to transform the definition
+        return pass_manager.run(name, graph)
+
+    def flush_if_bound(self, name):
+        """
+        If name is about to be rebound, build the pending Definitions that
+        mention it, as they must see what it was bound to when they were
+        defined. Pending Definitions of name itself that nothing needed are
+        dropped, as nothing can look them up once name is rebound.
+        """
+        if self.pending and self.context.is_bound(name):
+            pending = self.pending
+            self.pending = []
+            for definition in pending:
+                if definition.record is not None:
+                    continue
+                if definition.mentions(name):
+                    definition.force()
+                elif definition.name != name:
+                    self.pending.append(definition)
 
     def make_lambda_chain(self, params, body):
         # Helper for visit_assign_statement. Dispatches each of params in order,
@@ -285,41 +494,28 @@ class Eval(RPythonVisitor):
         ident = node.children[0]
         assert isinstance(ident, Symbol)
         name = ident.additional_info
+        type_ptr = make_type(name)
 
-        # dispatch data constructors
-        constructors = [self.dispatch(node.children[i])
-                        for i in range(1, len(node.children))]
-
-        # type object is then a cons tree of the alternatives
-        type_node = ConsNode.make_tree(constructors)
+        # The type is bound first, so that a constructor with the same name
+        # as its type (as in data Pair = Pair a b) is what the name means.
+        self.flush_if_bound(name)
+        self.context.bind(name, type_ptr)
 
-        self.context.bind(name, type_node)
+        # bind the data constructors; each makes values of the new type
+        for i in range(1, len(node.children)):
+            self.make_constructor(node.children[i], type_ptr)
 
-    def visit_constructor(self, node):
+    def make_constructor(self, node, type_ptr):
         ident = node.children[0]
         assert isinstance(ident, Symbol)
         name = ident.additional_info
 
-        if len(node.children) == 1:
-            # no-argument constructor, just bind it to unit
-            constructor = unit
-        else:
-            # until record types are implemented, we don't actually care
-            # about the names of the constructor arguments, only the number
-            param_nodes = [Param() for i in range(1, len(node.children))]
-            body = ConsNode.make_tree(param_nodes)
-
-            # build the lambda nodes in reverse order, as each contains the next
-            param_nodes.reverse()
-            for param in param_nodes:
-                body = Lambda(param, body)
-
-            # now body is the top level lambda node
-            constructor = body
-
-        # now bind the name to the constructor
-        self.context.bind(name, constructor)
-        return constructor
+        # until record types are implemented, we don't actually care about
+        # the names of the constructor arguments, only the number
+        constructor = Constructor(name, len(node.children) - 1, type_ptr)
+
+        self.flush_if_bound(name)
+        self.context.bind(name, constructor.ptr)
 
     def visit_expr(self, node):
         return Expression(self, node.children).resolve()
@@ -0,0 +1,134 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NOT_RPYTHON: Measures how fast large generated programs are lexed and have
+their indentation processed, and the most memory it takes.
+
+Usage (from the directory with fundy.grammar in it):
+
+    python bench/lex_bench.py SIZE...
+
+where each SIZE is a program size in kilobytes. Each program is run through:
+
+    lists       the tokenize method of the lexer rpython.rlib.parsing builds
+                from the grammar, then list_process_indentation below
+                (which is how process_indentation worked before it was
+                rewritten as IndentationFilter), building a list of tokens
+                each time
+    filter      an IndentationFilter over LexerTokens (the same lexer), taking
+                one token at a time without keeping them
+    lexer       an IndentationFilter over the Lexer in lexing.py
+
+Each is measured in a process of its own (see measure.py).
+"""
+
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from synthetic import make_program
+from measure import peak_rss, in_child
+
+
+def list_process_indentation(tokens):
+    """
+    NOT_RPYTHON: process_indentation as it was before IndentationFilter.
+    """
+    from rpython.rlib.parsing.lexer import Token
+
+    stack = [0]
+    ret = []
+    begin_block = False
+    for tok in tokens:
+        if tok.name == 'BEGIN':
+            begin_block = True
+            ret.append(tok)
+        elif tok.name == 'LINEBREAK':
+            indentstr = tok.source.split('\n')[-1]
+            indent = len(indentstr) + indentstr.count('\t')*3
+            if indent <= stack[-1]:
+                ret.append(Token('TERM', tok.source, tok.source_pos))
+                if begin_block:
+                    ret.append(Token('TERM', tok.source, tok.source_pos))
+                while indent < stack[-1]:
+                    stack.pop()
+                    ret.append(Token('TERM', tok.source, tok.source_pos))
+            if indent > stack[-1]:
+                if begin_block:
+                    stack.append(indent)
+            begin_block = False
+        elif tok.name == 'EOF':
+            while stack:
+                stack.pop()
+                ret.append(Token('TERM', tok.source, tok.source_pos))
+            ret.append(tok)
+        else:
+            ret.append(tok)
+    return ret
+
+
+def measure(how, size):
+    """
+    Lex a program of size bytes, in this process, and return the seconds it
+    took, the number of tokens and the peak memory use in kilobytes.
+    """
+    from fundyparse import load_parser_tables, grammar_keywords
+    from lexing import Lexer, LexerTokens, IndentationFilter
+    lexer, rules, ToAST = load_parser_tables(False)
+    keywords = grammar_keywords(lexer)
+    source = make_program(size)
+    start = time.time()
+    if how == 'lists':
+        count = len(list_process_indentation(lexer.tokenize(source,
+                                                            eof=True)))
+    else:
+        if how == 'filter':
+            tokens = IndentationFilter(LexerTokens(lexer, source))
+        else:
+            tokens = IndentationFilter(Lexer(source, keywords))
+        count = 1
+        while tokens.next_token().name != 'EOF':
+            count += 1
+    return time.time() - start, count, peak_rss()
+
+
+def main(argv):
+    if argv[1:2] == ['--measure']:
+        print '%f %d %d' % measure(argv[2], int(argv[3]))
+        return 0
+
+    print '%-7s %8s %9s %9s %9s %11s' % ('how', 'size', 'tokens', 'seconds',
+                                         'MB/s', 'peak RSS')
+    for size in argv[1:]:
+        size = int(size) * 1024
+        for how in ['lists', 'filter', 'lexer']:
+            seconds, count, maxrss = in_child(__file__, [how, size])
+            print '%-7s %6dKB %9d %9.2f %9.3f %9dKB' % (
+                how, size / 1024, count, seconds,
+                size / seconds / (1024 * 1024), maxrss)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,51 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NOT_RPYTHON: Helpers for the benchmarks in this directory.
+
+Each measurement is run in a process of its own, so that the peak memory use
+reported for it (the maximum resident set size, which includes the
+interpreter and the program text) is for that measurement alone. A benchmark
+script runs itself with --measure and the measurement's arguments, and the
+child prints the results on one line for the parent to read back.
+"""
+
+import os
+import resource
+import subprocess
+import sys
+
+
+def peak_rss():
+    """
+    Return the peak memory use of this process so far, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def in_child(script, args):
+    """
+    Run script with --measure and args in a new process, and return the
+    numbers it prints.
+    """
+    output = subprocess.check_output(
+        [sys.executable, script, '--measure'] + [str(arg) for arg in args],
+        stderr=open(os.devnull, 'w'))
+    return [float(x) for x in output.split()]
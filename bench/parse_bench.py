@@ -0,0 +1,147 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NOT_RPYTHON: Measures how fast the parsers parse large generated programs,
+the most memory each uses doing it, and how many tree nodes each allocates
+compared to the number in the tree it returns.
+
+Usage (from the directory with fundy.grammar in it):
+
+    python bench/parse_bench.py [--packrat] SIZE...
+
+where each SIZE is a program size in kilobytes. Each program is parsed by the
+deterministic parser (llparse.py), and with --packrat also by the
+PackratParser generated from the grammar, which needs far more time and
+memory.
+
+Each parse is run in a process of its own (see measure.py). The times
+include lexing. The nodes are counted on a second parse of the program, as
+counting them slows the parser down. The PackratParser allocates a messy tree
+that ToAST then builds the tidy tree from, so it allocates more nodes than end
+up in the tree; the deterministic parser builds the tidy tree directly.
+"""
+
+import os
+import sys
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from rpython.rlib.parsing.tree import Symbol, Nonterminal
+
+from synthetic import make_program
+from measure import peak_rss, in_child
+
+
+def count_nodes(parse, source):
+    """
+    Parse source with parse, and return the number of Symbol and Nonterminal
+    nodes allocated, and the number in the tree it returned.
+    """
+    counts = [0]
+    def counting(init):
+        def __init__(self, *args):
+            counts[0] += 1
+            init(self, *args)
+        return __init__
+
+    inits = Symbol.__init__, Nonterminal.__init__
+    Symbol.__init__ = counting(Symbol.__init__.im_func)
+    Nonterminal.__init__ = counting(Nonterminal.__init__.im_func)
+    try:
+        tree = parse(source)
+    finally:
+        Symbol.__init__, Nonterminal.__init__ = inits
+    return counts[0], tree_size(tree)
+
+
+def tree_size(tree):
+    size = 0
+    work = [tree]
+    while work:
+        node = work.pop()
+        size += 1
+        if isinstance(node, Nonterminal):
+            work.extend(node.children)
+    return size
+
+
+def measure(parser, size):
+    """
+    Parse a program of size bytes with parser, in this process, and return
+    the seconds it took, the peak memory use in kilobytes, the number of
+    nodes allocated and the number in the tree.
+    """
+    import fundyparse
+    if parser == 'packrat':
+        parse = fundyparse.make_packrat_parse_function(False)
+    else:
+        parse = fundyparse.parse
+    source = make_program(size)
+    results = []
+    def timed_parse():
+        start = time.time()
+        parse(source)
+        seconds = time.time() - start
+        maxrss = peak_rss()
+        allocated, in_tree = count_nodes(parse, source)
+        results.append((seconds, maxrss, allocated, in_tree))
+
+    # The PackratParser recurses once for each statement in the program (the
+    # deterministic parser only as deep as the nesting of expressions), so it
+    # is given a huge stack to run on.
+    sys.setrecursionlimit(10 ** 7)
+    threading.stack_size(1024 * 1024 * 1024)
+    thread = threading.Thread(target=timed_parse)
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def main(argv):
+    if argv[1:2] == ['--measure']:
+        print ' '.join([str(x) for x in measure(argv[2], int(argv[3]))])
+        return 0
+
+    parsers = ['llparse']
+    sizes = argv[1:]
+    if '--packrat' in sizes:
+        sizes.remove('--packrat')
+        parsers.append('packrat')
+
+    print '%-8s %8s %9s %9s %11s %10s %10s' % (
+        'parser', 'size', 'seconds', 'MB/s', 'peak RSS', 'allocated',
+        'in tree')
+    for size in sizes:
+        size = int(size) * 1024
+        for parser in parsers:
+            seconds, maxrss, allocated, in_tree = in_child(__file__,
+                                                           [parser, size])
+            print '%-8s %6dKB %9.2f %9.3f %9dKB %10d %10d' % (
+                parser, size / 1024, seconds,
+                size / seconds / (1024 * 1024), maxrss, allocated, in_tree)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
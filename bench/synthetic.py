@@ -0,0 +1,77 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NOT_RPYTHON: Generates large Fundy programs for the benchmarks in this
+directory.
+
+The programs are made of copies of a chunk of code, with the names numbered
+so that each copy defines different things. CHUNK uses every kind of
+statement and expression in the grammar, for benchmarking the parser; but
+the interpreter can't evaluate lists, tuples or missing values yet, so
+RUNNABLE_CHUNK leaves them out, for programs that are to be run.
+"""
+
+CHUNK = '''\
+data Shape%(n)d = Circle%(n)d r | Rect%(n)d w h
+@memo
+def area%(n)d s:
+    half = 2
+    return typeswitch s:
+        case Circle%(n)d return 3 * (fst s) * (fst s)
+        case Rect%(n)d return (fst s) * (snd s) / half
+pair%(n)d x y = {x, y, ?todo, {%(n)d,}}
+values%(n)d = [area%(n)d (Rect%(n)d %(n)d 4), 7 : []]
+print area%(n)d (Circle%(n)d 2), values%(n)d, "chunk %(n)d", 'c'
+'''
+
+RUNNABLE_CHUNK = '''\
+data Shape%(n)d = Circle%(n)d r | Rect%(n)d w h
+@memo
+def area%(n)d s:
+    half = 2
+    return typeswitch s:
+        case Circle%(n)d return 3 * (fst s) * (fst s)
+        case Rect%(n)d return (fst s) * (snd s) / half
+total%(n)d = area%(n)d (Rect%(n)d %(n)d 4) + area%(n)d (Circle%(n)d 2)
+print total%(n)d, "chunk %(n)d", 'c'
+'''
+
+
+def make_program(size, chunk=CHUNK):
+    """
+    Return a program at least size bytes long, made of copies of chunk.
+    """
+    chunks = []
+    length = 0
+    n = 0
+    while length < size:
+        text = chunk % {'n': n}
+        chunks.append(text)
+        length += len(text)
+        n += 1
+    return ''.join(chunks)
+
+
+def write_program(path, size, chunk=CHUNK):
+    f = open(path, 'w')
+    try:
+        f.write(make_program(size, chunk))
+    finally:
+        f.close()
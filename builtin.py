@@ -33,9 +33,16 @@ _type = LabelledValue('type')
 _type.add_type(_type)
 default_context.bind('type', _type)
 
-def _make_primitive_type(name):
+def make_type(name):
+    """
+    Return a new type object called name, without binding it.
+    """
     tmp = LabelledValue(name)
     tmp.add_type(_type)
+    return tmp
+
+def _make_primitive_type(name):
+    tmp = make_type(name)
     default_context.bind(name, tmp)
     return tmp
 
@@ -60,7 +67,7 @@ bool_type, bool_false, bool_true = _make_enum_type('bool', 'false', 'true')
 class IntNode(PrimitiveNode):
     def __init__(self, value):
         PrimitiveNode.__init__(self)
-        self.types.add(int_type)
+        self.add_type(int_type)
         self.intval = value
 
     def to_string(self):
@@ -89,7 +96,7 @@ class CharNode(PrimitiveNode):
     def __init__(self, value):
         assert len(value) == 1
         PrimitiveNode.__init__(self)
-        self.types.add(char_type)
+        self.add_type(char_type)
         self.charval = value
 
     def to_string(self):
@@ -117,7 +124,7 @@ class CharNode(PrimitiveNode):
 class StringNode(PrimitiveNode):
     def __init__(self, value):
         PrimitiveNode.__init__(self)
-        self.types.add(str_type)
+        self.add_type(str_type)
         self.strval = value
 
     def to_string(self):
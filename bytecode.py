@@ -0,0 +1,281 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module compiles the functions in a graph to bytecode, for GraphStores
+(see soagraph.py) to run.
+
+Applying a function means making a copy of its body with the parameter
+replaced by the argument. Rather than walking the body each time to find what
+needs copying, a chain of lambdas (a function of several parameters) is
+compiled once into a Code object, whose instructions build the copy directly.
+
+Lambdas nested inside a body refer to the parameters of the lambdas around
+them. Those are lambda lifted: the inner lambda's Code takes its free
+variables as extra leading parameters, and the outer Code's instructions
+build a partial application of it to their values.
+
+Parts of a body that don't refer to any parameters are left as they are in
+the graph, as constants shared by all the copies, just as instantiating a
+graph shares them.
+"""
+
+from rpython.rlib.rweakref import RWeakKeyDictionary
+
+from graph import (ApplicationNode, LambdaNode, ParameterNode, ConsNode,
+                   IndirectionNode, TypeswitchNode)
+
+
+class Unsupported(Exception):
+    """
+    Raised when a graph contains nodes that can't be compiled or loaded into
+    a GraphStore, or compiled to Python code (see closures.py).
+    """
+    pass
+
+
+# Instructions are three ints: the opcode and two operands. Each instruction
+# makes one new node, which later operands can refer to.
+I_APP = 0           # an application of operand 1 to operand 2
+I_CONS = 1          # a cons of the operands
+I_FUNC = 2          # the function compiled to the code's inner code number
+                    # operand 1
+I_PARTIAL = 3       # a partial application of operand 1 to operand 2
+
+# Operands say where a node comes from in their low bits, and which one in the
+# rest.
+ARG = 0             # one of the arguments the code is run with
+REG = 1             # the node made by one of the code's instructions
+CONST = 2           # one of the code's constants
+
+def operand(kind, n):
+    return (n << 2) | kind
+
+def operand_kind(op):
+    return op & 3
+
+def operand_index(op):
+    return op >> 2
+
+
+class Code(object):
+    """
+    The compiled form of a chain of lambdas. arity is the number of arguments
+    it takes: first the free variables of the chain, then its parameters.
+
+    Running the code makes the nodes of its instructions in order, and then
+    result (an operand) is the value of the application.
+
+    consts are NodePtrs to graphs that don't depend on the arguments. A
+    GraphStore loads them when it loads the code; see bind. inner are the
+    Codes of the lambdas nested in the body, which I_FUNC instructions make
+    closures of.
+    """
+    _immutable_fields_ = ['name', 'arity', 'ops[*]', 'nregs', 'result',
+                          'consts[*]', 'inner[*]', 'free_vars[*]']
+
+    def __init__(self, name, arity, ops, result, consts, inner, free_vars):
+        self.name = name
+        self.arity = arity
+        # (copies, as the immutable lists must be different lists to the ones
+        # the compiler built up)
+        self.ops = ops[:]
+        self.nregs = len(ops) / 3
+        self.result = result
+        self.consts = consts[:]
+        self.inner = inner[:]
+        # the parameters of enclosing lambdas that are the first arguments
+        self.free_vars = free_vars[:]
+        # the store the code was last loaded into, its number there (see
+        # GraphStore.add_code), and the indices of the constants there
+        self.store = None
+        self.store_number = -1
+        self.const_indices = [0] * len(consts)
+
+    def bind(self, store):
+        """
+        Make sure the constants have been loaded into store, along with those
+        of the codes this one makes closures of. This raises Unsupported if
+        any of them can't be loaded, so it's done when the function is
+        loaded, not when it's run.
+        """
+        if self.store is not store:
+            # set first, in case the constants lead back here
+            self.store = store
+            self.store_number = store.add_code(self)
+            for i in range(len(self.consts)):
+                self.const_indices[i] = store.load(self.consts[i])
+            for code in self.inner:
+                code.bind(store)
+
+
+class CodeTable(object):
+    """
+    The Code compiled for each lambda node. The lambda nodes are only weakly
+    referenced, so a Code lives as long as the graph it was compiled from (and
+    any Code that makes closures of it), and then goes; a definition that is
+    still bound keeps its Code, so that (when running with the JIT) its
+    machine code can be reused by every expression that calls it.
+    """
+    def __init__(self):
+        self.compiled = RWeakKeyDictionary(LambdaNode, Code)
+
+code_table = CodeTable()
+
+
+def compile_lambda(ptr, name='<lambda>'):
+    """
+    Return the Code for the chain of lambdas starting at the lambda node under
+    ptr, compiling it if it hasn't been already.
+    """
+    lam = ptr.node
+    assert isinstance(lam, LambdaNode)
+    code = code_table.compiled.get(lam)
+    if code is None:
+        code = Compiler(name).compile(lam)
+        code_table.compiled.set(lam, code)
+    return code
+
+
+class Compiler(object):
+    def __init__(self, name):
+        self.name = name
+        self.free = {}          # parameters under each pointer seen so far
+        self.slots = {}         # argument number of each parameter
+        self.regs = {}          # register made for each pointer so far
+        self.ops = []
+        self.consts = []
+        self.inner = []
+
+    def compile(self, lam):
+        """
+        Compile the chain of lambdas starting at lam.
+        """
+        params = []
+        body = None
+        node = lam
+        while isinstance(node, LambdaNode):
+            params.append(node.parameter)
+            body = _follow(node.body)
+            node = body.node
+        assert body is not None
+
+        # The free variables are the parameters used in the body that don't
+        # belong to this chain. They come first, so that partially applying
+        # the code to them makes a closure.
+        free_vars = []
+        for param in self.free_params(body):
+            if param not in params:
+                free_vars.append(param)
+        slot_params = free_vars + params
+        for i in range(len(slot_params)):
+            self.slots[slot_params[i]] = i
+
+        result = self.emit(body)
+        return Code(self.name, len(slot_params), self.ops, result,
+                    self.consts, self.inner, free_vars)
+
+    def free_params(self, ptr):
+        """
+        Return a list of the parameters used in the graph under ptr that
+        aren't bound by lambdas inside it.
+        """
+        ptr = _follow(ptr)
+        result = self.free.get(ptr, None)
+        if result is not None:
+            return result
+
+        node = ptr.node
+        if isinstance(node, ParameterNode):
+            result = [ptr]
+        elif isinstance(node, ApplicationNode):
+            result = _union(self.free_params(node.functor),
+                            self.free_params(node.argument))
+        elif isinstance(node, ConsNode):
+            result = _union(self.free_params(node.a), self.free_params(node.b))
+        elif isinstance(node, LambdaNode):
+            result = []
+            for param in self.free_params(node.body):
+                if param is not node.parameter:
+                    result.append(param)
+        elif isinstance(node, TypeswitchNode):
+            raise Unsupported
+        else:
+            # leaves, and builtins (which are only ever applied to arguments
+            # by application nodes)
+            result = []
+        self.free[ptr] = result
+        return result
+
+    def emit(self, ptr):
+        """
+        Return an operand for the graph under ptr, emitting any instructions
+        needed to build it.
+        """
+        ptr = _follow(ptr)
+        slot = self.slots.get(ptr, -1)
+        if slot >= 0:
+            return operand(ARG, slot)
+        if not self.free_params(ptr):
+            self.consts.append(ptr)
+            return operand(CONST, len(self.consts) - 1)
+        reg = self.regs.get(ptr, -1)
+        if reg >= 0:
+            return operand(REG, reg)
+
+        node = ptr.node
+        if isinstance(node, ApplicationNode):
+            op = self.emit_op(I_APP, self.emit(node.functor),
+                              self.emit(node.argument))
+        elif isinstance(node, ConsNode):
+            op = self.emit_op(I_CONS, self.emit(node.a), self.emit(node.b))
+        elif isinstance(node, LambdaNode):
+            # a closure: the inner code applied to its free variables, which
+            # are all parameters of this code (or free variables of it)
+            inner = compile_lambda(ptr, self.name)
+            self.inner.append(inner)
+            op = self.emit_op(I_FUNC, len(self.inner) - 1, 0)
+            for param in inner.free_vars:
+                op = self.emit_op(I_PARTIAL, op, self.emit(param))
+        else:
+            # a parameter that doesn't belong to any lambda around it
+            raise Unsupported
+        self.regs[ptr] = operand_index(op)
+        return op
+
+    def emit_op(self, opcode, x, y):
+        self.ops.append(opcode)
+        self.ops.append(x)
+        self.ops.append(y)
+        return operand(REG, len(self.ops) / 3 - 1)
+
+
+def _follow(ptr):
+    if isinstance(ptr.node, IndirectionNode):
+        return ptr.follow()
+    return ptr
+
+def _union(xs, ys):
+    if not xs:
+        return ys
+    result = list(xs)
+    for y in ys:
+        if y not in result:
+            result.append(y)
+    return result
@@ -0,0 +1,156 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module bounds the memory held by the values of top level constant
+applicative forms (CAFs: definitions without parameters).
+
+A CAF's pointer is reduced in place when it's printed, so its value stays
+alive for as long as the name is bound, however big it is (a lazily built
+list that has been walked to the end, say). With a budget set, a copy of each
+CAF's unevaluated graph is kept, and after each print statement the CAFs that
+have been evaluated are measured; while the total is over the budget the
+largest is reverted to a fresh copy of its unevaluated graph, to be worked out
+again if it's used again.
+
+Sizes are counted in graph nodes (as graph.count_nodes counts them), which is
+only an estimate of the memory used. Nodes shared between CAFs are counted for
+each of them. A value with no unevaluated nodes left in it can't grow any
+more, so its size is counted once and remembered until it's reverted; only
+values that are still partly unevaluated are counted again after each print.
+
+Only the latest definition of each name is kept track of: when a name is
+rebound, the CAF it was bound to is dropped, so that a superseded value is
+neither kept alive by the registry nor counted against the budget.
+"""
+
+from graph import is_evaluated
+
+
+class CAF(object):
+    def __init__(self, name, ptr):
+        self.name = name
+        self.ptr = ptr
+        # Reducing the pointer may reduce the pointers under its node in
+        # place as well, so the pointer gets a copy and the original is kept
+        # unevaluated.
+        self.template = ptr.node
+        self.ptr.node = self.template.instantiate(None, None)
+        self.reversions = 0
+        self.final_size = -1    # the size, once it can no longer change
+
+    def size(self):
+        """
+        Return the number of nodes held by the CAF's value, or 0 if it hasn't
+        been evaluated (or was a value to begin with, so there's nothing to
+        revert to).
+        """
+        if self.final_size >= 0:
+            return self.final_size
+        if self.ptr.node is self.template or not is_evaluated(self.ptr):
+            return 0
+        size, final = measure(self.ptr)
+        if final:
+            self.final_size = size
+        return size
+
+    def revert(self):
+        self.ptr.node = self.template.instantiate(None, None)
+        self.final_size = -1
+        self.reversions += 1
+
+
+def measure(ptr):
+    """
+    Return the number of distinct nodes in the graph under ptr, as
+    graph.count_nodes does, and whether they are all evaluated.
+    """
+    seen = {}
+    stack = [ptr]
+    final = True
+    while stack:
+        ptr = stack.pop()
+        node = ptr.node
+        if node not in seen:
+            seen[node] = None
+            if not is_evaluated(ptr):
+                final = False
+            stack.extend(node.children())
+    return len(seen), final
+
+
+class CAFRegistry(object):
+    """
+    Keeps track of the top level CAFs, when there is a budget (in nodes) for
+    their values.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, budget=0):
+        self.budget = budget
+        self.measure = False
+        self.cafs = []
+        self.index = {}         # the index in cafs of each name's CAF
+        self.reversions = 0
+
+    def add(self, name, ptr):
+        """
+        Keep track of the CAF name is now bound to, in place of any it was
+        bound to before.
+        """
+        if self.budget > 0:
+            caf = CAF(name, ptr)
+            i = self.index.get(name, -1)
+            if i >= 0:
+                self.cafs[i] = caf
+            else:
+                self.index[name] = len(self.cafs)
+                self.cafs.append(caf)
+
+    def enforce_budget(self):
+        """
+        Revert the largest evaluated CAFs until the ones left fit the budget.
+        """
+        if self.budget <= 0:
+            return
+        sizes = [caf.size() for caf in self.cafs]
+        total = 0
+        for size in sizes:
+            total += size
+        while total > self.budget:
+            largest = 0
+            for i in range(1, len(sizes)):
+                if sizes[i] > sizes[largest]:
+                    largest = i
+            self.cafs[largest].revert()
+            self.reversions += 1
+            total -= sizes[largest]
+            sizes[largest] = 0
+
+    def report(self):
+        lines = ['CAFs (budget %d nodes): %d reversions'
+                 % (self.budget, self.reversions)]
+        for caf in self.cafs:
+            if caf.reversions:
+                lines.append('    %s: %d nodes now, reverted %d times'
+                             % (caf.name, caf.size(), caf.reversions))
+        return '\n'.join(lines) + '\n'
+
+caf_registry = CAFRegistry()
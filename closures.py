@@ -0,0 +1,764 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NOT_RPYTHON: This module compiles graphs to Python code, for running Fundy
+quickly on top of CPython. None of it can be translated; when preparing for
+translation the --graph=closures option is switched off (see
+ClosureOptions.prepare).
+
+Reducing the object graph on top of CPython costs several method calls per
+node copied by every application. Here each lambda is compiled once into a
+Python function (by generating its source and exec'ing it), so applying it is
+just a Python call.
+
+Values are represented by Python objects:
+    ints                    Python ints (or longs)
+    cons                    ConsValue objects
+    functions and builtins  Python functions of one argument
+    anything else           the NodePtr of the primitive value node, so bools
+                            are bool_true and bool_false
+
+Laziness is kept with Thunk objects: function arguments and the components of
+cons are Thunks, which are evaluated at most once, the first time their value
+is needed. A thunk being evaluated is black-holed, so a value that needs
+itself raises LoopError, as in the object graph.
+
+Sharing is kept as the object graph keeps it. Parts of a lambda's body that
+don't depend on its parameter are evaluated in the scope enclosing the lambda
+(so once for all the calls of a closure, rather than once per call), and
+closed parts are constants shared by everything that refers to them.
+
+Calls in tail position are returned as TailCall objects rather than made, and
+run in a loop by whoever needed the value, so recursion that doesn't need to
+keep a stack doesn't use up Python's.
+
+Only the core of the language can be compiled, as for GraphStores (see
+soagraph.py); anything else raises Unsupported, so that the caller can fall
+back to the object graph.
+"""
+
+import operator
+
+from graph import (NodePtr, ApplicationNode, LambdaNode, ParameterNode,
+                   FixfindNode, IndirectionNode, SelectorNode, ConsNode,
+                   ConstructorFunctionNode, PrimitiveNode, LoopError)
+from builtin import IntNode, StringNode, StrPtr, bool_true, bool_false
+from pyops import (UnaryBuiltinNode, BinaryBuiltinNode, TernaryBuiltinNode,
+                   OverloadNode, ops, signatures, plus, minus, mul, div, neg,
+                   bool_and, bool_or, boxed_eq, if_then_else, bad_argument,
+                   no_definition)
+from bytecode import Unsupported
+from utils import preparer
+
+
+#----------------------------------------------------------------------------#
+# Run time support for the generated code                                    #
+#----------------------------------------------------------------------------#
+
+def _blackhole():
+    raise LoopError
+
+
+class Thunk(object):
+    """
+    A value that is computed when it is first needed. run is the function
+    computing it, or None once value has been computed.
+    """
+    __slots__ = ['run', 'value']
+
+    def __init__(self, run, value=None):
+        self.run = run
+        self.value = value
+
+    def force(self):
+        run = self.run
+        if run is None:
+            return self.value
+        self.run = _blackhole
+        try:
+            value = run()
+            while value.__class__ is TailCall:
+                value = value.func(value.arg)
+        except:
+            self.run = run
+            raise
+        self.value = value
+        self.run = None
+        return value
+
+
+def ready(value):
+    return Thunk(None, value)
+
+
+class TailCall(object):
+    """
+    A call of func to arg that still has to be made.
+    """
+    __slots__ = ['func', 'arg']
+
+    def __init__(self, func, arg):
+        self.func = func
+        self.arg = arg
+
+
+class ConsValue(object):
+    __slots__ = ['a', 'b']
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+
+def call(func, arg):
+    value = func(arg)
+    while value.__class__ is TailCall:
+        value = value.func(value.arg)
+    return value
+
+
+def fix(f):
+    # The Y combinator. Rather than unfolding the definition a step at a time
+    # as the object graph does, the knot is tied: the argument f is applied to
+    # is the thunk of the result itself.
+    knot = Thunk(None)
+    knot.run = lambda: TailCall(f.force(), knot)
+    return knot.force()
+
+
+def box(b):
+    if b:
+        return bool_true
+    else:
+        return bool_false
+
+def unbox(value, name):
+    # name is the builtin the value is an argument of, for the error
+    if value is bool_true:
+        return True
+    elif value is bool_false:
+        return False
+    raise TypeError(bad_argument(name, 'bool'))
+
+def truth(value):
+    # if compares its condition with true, rather than requiring a bool
+    if value is bool_true:
+        return True
+    elif value is bool_false:
+        return False
+    return equal(value, bool_true)
+
+
+def eq(left, right):
+    # Like pyops.eq, on thunks.
+    if left is right:
+        return True
+    return equal(left.force(), right.force())
+
+def equal(left, right):
+    if left.__class__ is int and right.__class__ is int:
+        return left == right
+    elif isinstance(left, ConsValue):
+        if not isinstance(right, ConsValue):
+            raise TypeError("cannot compare values of different types for "
+                            "equality")
+        return eq(left.a, right.a) and eq(left.b, right.b)
+    elif isinstance(left, NodePtr):
+        if not isinstance(right, NodePtr) or \
+           not isinstance(right.node, type(left.node)):
+            raise TypeError("cannot compare values of different types for "
+                            "equality")
+        return left.node.eq(right.node)
+    elif isinstance(left, (int, long)):
+        if not isinstance(right, (int, long)):
+            raise TypeError("cannot compare values of different types for "
+                            "equality")
+        return left == right
+    else:
+        raise TypeError("Can't compare non-value types for equality")
+
+
+def select(value, field, name):
+    if not isinstance(value, ConsValue):
+        raise TypeError("%s can only be applied to a cons" % name)
+    if field == 0:
+        return value.a.force()
+    else:
+        return value.b.force()
+
+
+def curry(arity, func, args=()):
+    """
+    Return a Python function of one argument that collects arity arguments
+    (thunks) before calling func on them.
+    """
+    def apply(arg):
+        all_args = args + (arg,)
+        if len(all_args) == arity:
+            return func(*all_args)
+        return curry(arity, func, all_args)
+    return apply
+
+
+def to_string(value):
+    """
+    Return the string form of value, as the to_string of its node would.
+    """
+    if isinstance(value, (int, long)):
+        return str(value)
+    elif isinstance(value, NodePtr):
+        return value.node.to_string()
+    elif isinstance(value, ConsValue):
+        # ConsNode.to_string doesn't reduce its components either
+        if value.a.run is not None or value.b.run is not None:
+            raise NotImplementedError
+        return to_string(value.a.value) + " . " + to_string(value.b.value)
+    else:
+        raise NotImplementedError
+
+
+#----------------------------------------------------------------------------#
+# Builtins                                                                   #
+#----------------------------------------------------------------------------#
+
+class Builtin(object):
+    """
+    How to compile applications of a builtin to arity arguments: template is
+    a format string for the Python expression, taking the values of the
+    arguments (or the thunks, if strict is false). value is the builtin as a
+    Python function.
+    """
+    def __init__(self, arity, template, func, strict=True):
+        self.arity = arity
+        self.template = template
+        self.strict = strict
+        if strict:
+            self.value = curry(arity, lambda *args:
+                                    func(*[arg.force() for arg in args]))
+        else:
+            self.value = curry(arity, func)
+
+# The builtins check the types of their operands as the checked builtins of
+# the object graph do, raising TypeErrors with the same messages. Both
+# operands of and and or are unboxed before they're combined, so that a
+# non-bool one isn't skipped by Python's short-circuiting and/or.
+def _and(x, y):
+    x = unbox(x, 'and')
+    y = unbox(y, 'and')
+    return box(x and y)
+
+def _or(x, y):
+    x = unbox(x, 'or')
+    y = unbox(y, 'or')
+    return box(x or y)
+
+def _is_int(value):
+    # (bools are NodePtrs, not Python bools)
+    return isinstance(value, int)
+
+def _is_string(value):
+    return isinstance(value, NodePtr) and isinstance(value.node, StringNode)
+
+def _int_op(name, func):
+    def op(x, y):
+        if not _is_int(x) or not _is_int(y):
+            raise TypeError(bad_argument(name, 'int'))
+        return func(x, y)
+    return op
+
+def _neg(x):
+    if not _is_int(x):
+        raise TypeError(bad_argument('neg', 'int'))
+    return -x
+
+def _add(x, y):
+    # + is overloaded for ints and strings (which are kept as NodePtrs)
+    if _is_int(x) and _is_int(y):
+        return x + y
+    if _is_string(x) and _is_string(y):
+        return StrPtr(x.node.strval + y.node.strval)
+    raise TypeError(no_definition('+'))
+
+_plus = _int_op('+', operator.add)
+_minus = _int_op('-', operator.sub)
+_mul = _int_op('*', operator.mul)
+_div = _int_op('/', operator.floordiv)
+
+_arith = [(plus, Builtin(2, '_plus(%s, %s)', _plus)),
+          (minus, Builtin(2, '_minus(%s, %s)', _minus)),
+          (mul, Builtin(2, '_mul(%s, %s)', _mul)),
+          (div, Builtin(2, '_div(%s, %s)', _div)),
+          (neg, Builtin(1, '_neg(%s)', _neg)),
+          (bool_and, Builtin(2, '_and(%s, %s)', _and)),
+          (bool_or, Builtin(2, '_or(%s, %s)', _or))]
+
+_eq = Builtin(2, 'box(eq(%s, %s))', lambda x, y: box(eq(x, y)),
+              strict=False)
+_if = Builtin(3, '(%s if %s else %s)',
+              lambda c, a, b: a.force() if truth(c.force()) else b.force(),
+              strict=False)
+_selectors = [Builtin(1, 'select(%%s, %d, %r)' % (field, name),
+                      lambda v, field=field, name=name:
+                          select(v, field, name))
+              for field, name in [(0, 'fst'), (1, 'snd')]]
+_identity = Builtin(1, '%s', lambda v: v)
+
+# the Builtin for each overloaded name (see pyops.Overload)
+_overloads = {ops.overloads['+']: Builtin(2, '_add(%s, %s)', _add)}
+
+# the Builtin for each function of a builtin node (see soagraph._wrappers)
+_builtins = {boxed_eq: _eq, if_then_else: _if}
+for _ptr, _builtin in _arith:
+    for _variant in signatures[_ptr].variants:
+        _builtins[_variant.node.func] = _builtin
+
+
+def _builtin(node):
+    if isinstance(node, SelectorNode):
+        if node.field < 0:
+            return _identity
+        return _selectors[node.field]
+    elif isinstance(node, UnaryBuiltinNode):
+        if node.arg0 is None:
+            return _builtins.get(node.func, None)
+    elif isinstance(node, BinaryBuiltinNode):
+        if node.arg0 is None and node.arg1 is None:
+            return _builtins.get(node.func, None)
+    elif isinstance(node, TernaryBuiltinNode):
+        if node.arg0 is None and node.arg1 is None and node.arg2 is None:
+            return _builtins.get(node.func, None)
+    elif isinstance(node, OverloadNode):
+        if not node.args:
+            return _overloads.get(node.overload, None)
+    return None
+
+
+# names the generated code can use
+_runtime = {'Thunk': Thunk, 'ready': ready, 'TailCall': TailCall,
+            'ConsValue': ConsValue, 'call': call, 'box': box, 'eq': eq,
+            'truth': truth, 'select': select, '_and': _and, '_or': _or,
+            '_add': _add, '_plus': _plus, '_minus': _minus, '_mul': _mul,
+            '_div': _div, '_neg': _neg}
+
+
+#----------------------------------------------------------------------------#
+# The compiler                                                               #
+#----------------------------------------------------------------------------#
+
+def _follow(ptr):
+    # (constructor values are compiled as trees of cons cells)
+    if isinstance(ptr.node, IndirectionNode):
+        ptr = ptr.follow()
+    node = ptr.node
+    if isinstance(node, ConstructorFunctionNode) and not node.args:
+        return node.tag.lowered()
+    return ptr
+
+
+class _Scope(object):
+    """
+    The body of a lambda being compiled (or of a constant, which has no
+    parameter). Nodes used more than once, or by lambdas inside, are given
+    local variables holding their thunks.
+    """
+    def __init__(self, parent, param, depth):
+        self.parent = parent
+        self.param = param
+        self.depth = depth
+        self.lines = []
+        self.locals = {}
+
+
+class _Unit(object):
+    """
+    Compiles the constants needed to evaluate one graph into one Python
+    module. The Thunks of constants that were compiled successfully are kept
+    in the Backend's cache; if anything is unsupported, nothing is kept.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.namespace = dict(_runtime)
+        self.lines = []
+        self.thunks = {}        # new constants; only cached if all goes well
+        self.thunk_names = {}   # constant thunks already named
+        self.value_names = {}   # constant values already named
+        self.func_names = {}    # the function compiled for each closed lambda
+        self.funcs = []         # (thunk, name) of compiled closed functions
+        self.runs = []          # (thunk, name) of compiled constant graphs
+        self.free = {}
+        self.uses = {}
+        self.counter = 0
+
+    def fresh(self, prefix):
+        self.counter += 1
+        return '%s%d' % (prefix, self.counter)
+
+    def run(self):
+        exec '\n'.join(self.lines) in self.namespace
+        for thunk, name in self.funcs:
+            thunk.run = None
+            thunk.value = self.namespace[name]
+        for thunk, name in self.runs:
+            thunk.run = self.namespace[name]
+        self.backend.thunks.update(self.thunks)
+
+    # Finding out about the graph
+
+    def free_params(self, ptr):
+        """
+        Return the list of parameters used in the graph under ptr that aren't
+        bound by lambdas inside it.
+        """
+        result = self.free.get(ptr, None)
+        if result is not None:
+            return result
+        node = ptr.node
+        if isinstance(node, ParameterNode):
+            result = [ptr]
+        elif isinstance(node, ApplicationNode) or isinstance(node, ConsNode):
+            result = []
+            for child in node.children():
+                for param in self.free_params(_follow(child)):
+                    if param not in result:
+                        result.append(param)
+        elif isinstance(node, LambdaNode):
+            result = [param for param in self.free_params(_follow(node.body))
+                      if param is not node.parameter]
+        else:
+            result = []
+        self.free[ptr] = result
+        return result
+
+    def count_uses(self, root):
+        # Count the references to each node under the constant root, stopping
+        # at other constants.
+        todo = self.parts(root)
+        while todo:
+            ptr = todo.pop()
+            count = self.uses.get(ptr, 0)
+            self.uses[ptr] = count + 1
+            if count == 0 and self.free_params(ptr) and \
+               not isinstance(ptr.node, ParameterNode):
+                todo.extend(self.parts(ptr))
+
+    def parts(self, ptr):
+        node = ptr.node
+        if isinstance(node, LambdaNode):
+            return [_follow(node.body)]
+        return [_follow(child) for child in node.children()]
+
+    def home(self, ptr, scope):
+        """
+        Return the innermost scope whose parameter the graph under ptr uses.
+        """
+        params = self.free_params(ptr)
+        while scope.param is not None and scope.param not in params:
+            scope = scope.parent
+        return scope
+
+    def param_name(self, ptr, scope):
+        while scope is not None:
+            if scope.param is ptr:
+                return 'p%d' % scope.depth
+            scope = scope.parent
+        # a parameter of a lambda that isn't in the graph
+        raise Unsupported
+
+    # Constants
+
+    def constant(self, ptr):
+        """
+        Return the Thunk of the closed graph under ptr, compiling it if
+        necessary.
+        """
+        thunk = self.backend.thunks.get(ptr, None)
+        if thunk is None:
+            thunk = self.thunks.get(ptr, None)
+        if thunk is not None:
+            return thunk
+
+        node = ptr.node
+        thunk = Thunk(_blackhole)
+        self.thunks[ptr] = thunk
+        builtin = _builtin(node)
+        if builtin is not None:
+            thunk.run = None
+            thunk.value = builtin.value
+        elif isinstance(node, IntNode):
+            thunk.run = None
+            thunk.value = node.intval
+        elif isinstance(node, PrimitiveNode):
+            thunk.run = None
+            thunk.value = ptr
+        elif isinstance(node, FixfindNode):
+            thunk.run = None
+            thunk.value = fix
+        elif isinstance(node, LambdaNode):
+            self.count_uses(ptr)
+            name = self.function(ptr, None, self.lines)
+            self.func_names[thunk] = name
+            self.funcs.append((thunk, name))
+        elif isinstance(node, ApplicationNode) or isinstance(node, ConsNode):
+            self.count_uses(ptr)
+            name = self.fresh('run')
+            scope = _Scope(None, None, 0)
+            if isinstance(node, ApplicationNode):
+                result = self.application(ptr, scope, True)
+            else:
+                result = 'ConsValue(%s, %s)' % (self.thunk(node.a, scope),
+                                                self.thunk(node.b, scope))
+            self.lines.append('def %s():' % name)
+            self.lines.extend(['    ' + line for line in scope.lines])
+            self.lines.append('    return ' + result)
+            self.runs.append((thunk, name))
+        else:
+            raise Unsupported
+        return thunk
+
+    def constant_thunk(self, ptr):
+        thunk = self.constant(ptr)
+        name = self.thunk_names.get(thunk, None)
+        if name is None:
+            name = self.fresh('k')
+            self.thunk_names[thunk] = name
+            self.namespace[name] = thunk
+        return name
+
+    def constant_value(self, ptr):
+        if isinstance(ptr.node, IntNode):
+            return repr(ptr.node.intval)
+        thunk = self.constant(ptr)
+        if thunk.run is not None:
+            # not evaluated yet, or compiled in this unit
+            name = self.func_names.get(thunk, None)
+            if name is not None:
+                return name
+            return self.constant_thunk(ptr) + '.force()'
+        name = self.value_names.get(thunk.value, None)
+        if name is None:
+            name = self.fresh('v')
+            self.value_names[thunk.value] = name
+            self.namespace[name] = thunk.value
+        return name
+
+    # Code generation. These methods return Python expressions for the graph
+    # under ptr when it is in scope, adding any statements they need to the
+    # scopes.
+
+    def function(self, ptr, scope, lines):
+        """
+        Add the definition of a Python function for the lambda under ptr to
+        lines, and return its name.
+        """
+        node = ptr.node
+        if scope is None:
+            depth = 1
+        else:
+            depth = scope.depth + 1
+        inner = _Scope(scope, node.parameter, depth)
+        result = self.result(_follow(node.body), inner)
+        name = self.fresh('f')
+        lines.append('def %s(p%d):' % (name, depth))
+        lines.extend(['    ' + line for line in inner.lines])
+        lines.append('    return ' + result)
+        return name
+
+    def thunk(self, ptr, scope):
+        """
+        Return an expression for a Thunk of the graph under ptr.
+        """
+        ptr = _follow(ptr)
+        node = ptr.node
+        if isinstance(node, ParameterNode):
+            return self.param_name(ptr, scope)
+        if not self.free_params(ptr):
+            return self.constant_thunk(ptr)
+
+        if self.inline(ptr, scope):
+            return self.new_thunk(ptr, scope)
+        home = self.home(ptr, scope)
+        name = home.locals.get(ptr, None)
+        if name is None:
+            expr = self.new_thunk(ptr, home)
+            name = self.fresh('t')
+            home.lines.append('%s = %s' % (name, expr))
+            home.locals[ptr] = name
+        return name
+
+    def new_thunk(self, ptr, scope):
+        if isinstance(ptr.node, ApplicationNode):
+            return 'Thunk(lambda: %s)' % self.application(ptr, scope, True)
+        else:
+            return 'ready(%s)' % self.construct(ptr, scope)
+
+    def value(self, ptr, scope):
+        """
+        Return an expression for the value of the graph under ptr.
+        """
+        ptr = _follow(ptr)
+        node = ptr.node
+        if isinstance(node, ParameterNode):
+            return self.param_name(ptr, scope) + '.force()'
+        elif not self.free_params(ptr):
+            return self.constant_value(ptr)
+        elif not self.inline(ptr, scope):
+            return self.thunk(ptr, scope) + '.force()'
+        elif isinstance(node, ApplicationNode):
+            return self.application(ptr, scope, False)
+        else:
+            return self.construct(ptr, scope)
+
+    def construct(self, ptr, scope):
+        # the value of a cons or lambda
+        node = ptr.node
+        if isinstance(node, ConsNode):
+            return 'ConsValue(%s, %s)' % (self.thunk(node.a, scope),
+                                          self.thunk(node.b, scope))
+        else:
+            return self.function(ptr, scope, scope.lines)
+
+    def result(self, ptr, scope):
+        """
+        Return an expression for the value of the graph under ptr, or a
+        TailCall that will compute it.
+        """
+        ptr = _follow(ptr)
+        if isinstance(ptr.node, ApplicationNode) and self.inline(ptr, scope):
+            return self.application(ptr, scope, True)
+        return self.value(ptr, scope)
+
+    def inline(self, ptr, scope):
+        # whether the application under ptr can be compiled into the
+        # expression that uses it
+        return self.free_params(ptr) and self.uses.get(ptr, 0) <= 1 and \
+               self.home(ptr, scope) is scope
+
+    def spine(self, ptr, scope):
+        """
+        Return the head of the spine of applications under ptr, and the list
+        of arguments it is applied to. Partial applications used elsewhere
+        are left to be evaluated on their own, so that the closures they make
+        are shared, except for partial applications of builtins, which have
+        nothing to share.
+        """
+        args = [ptr.node.argument]
+        ptr = _follow(ptr.node.functor)
+        while isinstance(ptr.node, ApplicationNode) and \
+              (self.inline(ptr, scope) or self.partial_builtin(ptr)):
+            args.append(ptr.node.argument)
+            ptr = _follow(ptr.node.functor)
+        args.reverse()
+        return ptr, args
+
+    def partial_builtin(self, ptr):
+        n = 0
+        while isinstance(ptr.node, ApplicationNode):
+            n += 1
+            ptr = _follow(ptr.node.functor)
+        builtin = _builtin(ptr.node)
+        return builtin is not None and n < builtin.arity
+
+    def condition(self, ptr, scope):
+        """
+        Return a Python boolean expression saying whether the graph under ptr
+        is true, as if compares it.
+        """
+        ptr = _follow(ptr)
+        if isinstance(ptr.node, ApplicationNode) and self.inline(ptr, scope):
+            head, args = self.spine(ptr, scope)
+            if _builtin(head.node) is _eq and len(args) == 2:
+                return 'eq(%s, %s)' % (self.thunk(args[0], scope),
+                                       self.thunk(args[1], scope))
+        return 'truth(%s)' % self.value(ptr, scope)
+
+    def application(self, ptr, scope, tail):
+        ptr, args = self.spine(ptr, scope)
+
+        # saturated applications of builtins are done inline
+        builtin = _builtin(ptr.node)
+        if builtin is not None and len(args) >= builtin.arity:
+            n = builtin.arity
+            if builtin is _if:
+                if tail and len(args) == n:
+                    branch = self.result
+                else:
+                    branch = self.value
+                expr = _if.template % (branch(args[1], scope),
+                                       self.condition(args[0], scope),
+                                       branch(args[2], scope))
+            elif builtin.strict:
+                expr = builtin.template % tuple([self.value(arg, scope)
+                                                 for arg in args[:n]])
+            else:
+                expr = builtin.template % tuple([self.thunk(arg, scope)
+                                                 for arg in args[:n]])
+            args = args[n:]
+        else:
+            expr = self.value(ptr, scope)
+
+        for i in range(len(args)):
+            if tail and i == len(args) - 1:
+                expr = 'TailCall(%s, %s)' % (expr, self.thunk(args[i], scope))
+            else:
+                expr = 'call(%s, %s)' % (expr, self.thunk(args[i], scope))
+        return expr
+
+
+class ClosureOptions(object):
+    """
+    Whether print statements should evaluate their expressions by compiling
+    them to Python code, and the Thunks of the constants compiled so far.
+    """
+    def __init__(self):
+        self.available = True
+        self.reset()
+
+    def reset(self, enabled=False):
+        self.enabled = enabled
+        self.thunks = {}
+
+    def evaluate(self, graph):
+        """
+        Evaluate graph by compiling it to Python code, returning the string
+        form of its value, or None if it can't be compiled.
+        """
+        unit = _Unit(self)
+        try:
+            thunk = unit.constant(_follow(graph))
+        except Unsupported:
+            return None
+        unit.run()
+        return to_string(thunk.force())
+
+    def prepare(self, for_translation):
+        """
+        NOT_RPYTHON: Nothing here can be translated, so when preparing for
+        translation evaluate is replaced by a method that can.
+        """
+        if for_translation:
+            ClosureOptions.evaluate = lambda self, graph: None
+        else:
+            ClosureOptions.evaluate = ClosureOptions.__secret_backup
+        self.available = not for_translation
+
+    __secret_backup = evaluate
+
+closure_options = ClosureOptions()
+preparer.register(closure_options.prepare)
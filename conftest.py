@@ -64,11 +64,11 @@ class CPythonFuncarg(object):
         except Exception, e:
             return None, e, sys.exc_info()[2]
 
-    def run_code(self, code):
+    def run_code(self, code, args=()):
         tmpfile = self.tempdir.join('tmp.fy')
         tmpfile.write(code)
 
-        do_run = lambda: self.run([tmpfile.strpath])
+        do_run = lambda: self.run(list(args) + [tmpfile.strpath])
         result, out, err = py.io.StdCaptureFD.call(do_run)
 
         ret, exc, tb = result
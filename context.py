@@ -61,52 +61,166 @@ class OperatorRecord(SimpleRecord):
                                     self.graph)
 
 
-class Context(object):
+class LazyRecord(SimpleRecord):
+    """
+    Stands in for a definition whose graph hasn't been built yet. Resolving
+    its name builds the graph and replaces it with an ordinary record, which
+    force returns.
+    """
+    def force(self):
+        assert False
+
+
+class SymbolTable(object):
+    """
+    Interns names as symbols: small ints numbered in the order the names were
+    first bound. Scopes are keyed by symbols, so that resolving a name that
+    has already been interned doesn't hash and compare strings at every level
+    of the scope chain.
+    """
     def __init__(self):
-        self.graphs = {}
+        self.numbers = {}
+        self.names = []
+
+    def intern(self, name):
+        symbol = self.numbers.get(name, -1)
+        if symbol < 0:
+            symbol = len(self.names)
+            self.numbers[name] = symbol
+            self.names.append(name)
+        return symbol
+
+    def find(self, name):
+        """
+        Return the symbol for name, or -1 if nothing has ever been bound to it
+        (in which case it can't be bound in any scope).
+        """
+        return self.numbers.get(name, -1)
+
+    def name_of(self, symbol):
+        return self.names[symbol]
 
-    def copy(self):
-        other = Context()
-        other.graphs = self.graphs.copy()
-        return other
+symbols = SymbolTable()
+
+
+class Context(object):
+    """
+    Maps names to the records of what is bound to them. Names are stored as
+    symbols (see SymbolTable); resolve looks up a symbol directly.
+
+    Scopes are chained: a Context sees the names bound in its parent as well
+    as its own, unless it binds them itself. A new scope is made with child,
+    which takes constant time however many names are visible; making a scope
+    for each definition by copying every name in scope made loading a file
+    quadratic in the number of definitions.
+    """
+    def __init__(self, parent=None):
+        self.records = {}
+        self.parent = parent
+
+    def child(self):
+        """
+        Return a new scope inside this one. Names bound in the new scope don't
+        affect this one, but names bound here later are visible in it.
+        """
+        return Context(self)
 
     def bind(self, name, graph):
-        self.graphs[name] = SimpleRecord(graph)
+        self.records[symbols.intern(name)] = SimpleRecord(graph)
 
     def bind_operator(self, name, graph, assoc, prec, fixity):
-        # TODO: support overloaded names
-        self.graphs[name] = OperatorRecord(graph, assoc, prec, fixity)
+        # an overloaded name is bound once, to a graph that chooses between
+        # its definitions (see pyops.Overload)
+        self.records[symbols.intern(name)] = OperatorRecord(graph, assoc, prec,
+                                                            fixity)
+
+    def bind_record(self, name, record):
+        self.records[symbols.intern(name)] = record
+
+    def resolve(self, symbol):
+        """
+        Return the record bound to symbol, or None if it isn't bound here.
+        """
+        context = self
+        while context is not None:
+            record = context.records.get(symbol, None)
+            if record is not None:
+                if isinstance(record, LazyRecord):
+                    record = record.force()
+                return record
+            context = context.parent
+        return None
+
+    def is_bound(self, name):
+        """
+        Return whether anything is bound to name, without building it if it
+        is a LazyRecord.
+        """
+        symbol = symbols.find(name)
+        context = self
+        while context is not None:
+            if symbol in context.records:
+                return True
+            context = context.parent
+        return False
+
+    def binds(self, name, record):
+        """
+        Return whether name is bound to record in this scope (not a parent),
+        without building it if it is a LazyRecord.
+        """
+        return self.records.get(symbols.find(name), None) is record
+
+    def get_record(self, name):
+        record = self.resolve(symbols.find(name))
+        if record is None:
+            raise KeyError(name)
+        return record
 
     def lookup(self, name):
-        return self.graphs[name].graph
+        return self.get_record(name).graph
 
     def is_operator(self, name):
-        return isinstance(self.graphs[name], OperatorRecord)
+        return isinstance(self.get_record(name), OperatorRecord)
 
     def get_assoc(self, name):
-        return self.graphs[name].get_assoc()
+        return self.get_record(name).get_assoc()
 
     def get_prec(self, name):
-        return self.graphs[name].get_prec()
+        return self.get_record(name).get_prec()
 
     def get_fixity(self, name):
-        return self.graphs[name].get_fixity()
+        return self.get_record(name).get_fixity()
+
+    def names(self):
+        """
+        NOT_RPYTHON: Return the set of names visible here.
+        """
+        names = set(symbols.name_of(symbol) for symbol in self.records)
+        if self.parent is not None:
+            names.update(self.parent.names())
+        return names
 
     def items(self):
         """
         NOT_RPYTHON:
         """
-        for name in self.graphs:
+        for name in self.names():
             yield name, self.lookup(name)
 
     def update(self, other):
-        self.graphs.update(other.graphs)
+        """
+        Bind here everything visible in other.
+        """
+        if other.parent is not None:
+            self.update(other.parent)
+        for symbol, record in other.records.items():
+            self.records[symbol] = record
 
     def __repr__(self):
         """
         NOT_RPYTHON:
         """
-        names = sorted(self.graphs.keys())
-        lines = ['%s -> %r' % (name, self.graphs[name])
-                 for name in sorted(self.graphs.keys())]
+        lines = ['%s -> %r' % (name, self.get_record(name))
+                 for name in sorted(self.names())]
         return '\n'.join(lines)
@@ -17,20 +17,26 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import imp
+import os
 import py
 import sys
+from hashlib import sha1
 
 from rpython.rlib.parsing.ebnfparse import parse_ebnf, check_for_missing_names
 from rpython.rlib.parsing.parsing import PackratParser, ParseError
-from rpython.rlib.parsing.lexer import Lexer, Token, SourcePos
+from rpython.rlib.parsing.lexer import Lexer
 
 from utils import preparer
+from llparse import parse_tokens
+from lexing import (Lexer as FundyLexer, IndentationFilter, InputTracker,
+                    process_indentation)
 
 
-def get_grammar(for_translation):
+def read_grammar(for_translation):
     """
-    NOT_RPYTHON: This function is only called to process the grammarfile, which
-    occurs before translation, so it does not need to be RPython.
+    NOT_RPYTHON: Return the text of the grammar file, with the lines in false
+    #!if sections removed, and the path it was read from.
 
     The for_translation argument should be True if the grammar should be built
     for translating the Fundy interpreter to low level code, or False for
@@ -54,8 +60,22 @@ def get_grammar(for_translation):
         lines.append(line)
     # end for
 
-    grammar = '\n'.join(lines)
+    return '\n'.join(lines), grammarfile
+
+
+def get_grammar(for_translation):
+    """
+    NOT_RPYTHON: This function is only called to process the grammarfile, which
+    occurs before translation, so it does not need to be RPython.
+    """
+    grammar, grammarfile = read_grammar(for_translation)
+    return parse_grammar(grammar, grammarfile)
+
 
+def parse_grammar(grammar, grammarfile):
+    """
+    NOT_RPYTHON:
+    """
     try:
         regexes, rules, ToAST = parse_ebnf(grammar)
     except ParseError, e:
@@ -65,11 +85,97 @@ def get_grammar(for_translation):
     return regexes, rules, ToAST
 
 
+def make_lexer(regexes, rules):
+    """
+    NOT_RPYTHON: Build the lexer for the token regexes of a grammar, checking
+    that the grammar's rules don't use any names it doesn't define.
+    """
+    names, regexes = zip(*regexes)
+    if "IGNORE" in names:
+        ignore = ["IGNORE"]
+    else:
+        ignore = []
+    check_for_missing_names(names, regexes, rules)
+    return Lexer(list(regexes), list(names), ignore=ignore)
+
+
+# Building the lexer's automaton takes far longer than anything else about the
+# parser (most of a second on top of CPython), so the lexer, rules and ToAST
+# class built from the grammar are cached on disk, as a Python module that
+# builds them directly. The cache is keyed by a hash of the grammar text (after
+# the #!if sections have been dealt with), so changing the grammar just makes
+# a new cache file. The cache is only an optimisation; if it can't be read or
+# written, the tables are built from the grammar as before.
+CACHE_DIR = '.grammar-cache'
+CACHE_FORMAT = 1
+
+def load_parser_tables(for_translation):
+    """
+    NOT_RPYTHON: Return the lexer, rules and ToAST class for the grammar,
+    from the cache if possible.
+    """
+    grammar, grammarfile = read_grammar(for_translation)
+    key = sha1('%d\n%s' % (CACHE_FORMAT, grammar)).hexdigest()
+    cachefile = py.path.local().join(CACHE_DIR, 'grammar_%s.py' % key)
+    if cachefile.check():
+        try:
+            module = imp.load_source('fundy_grammar_%s' % key, str(cachefile))
+            return module.lexer, module.rules, module.ToAST
+        except Exception:
+            pass    # a broken cache file is rebuilt below
+
+    regexes, rules, ToAST = parse_grammar(grammar, grammarfile)
+    lexer = make_lexer(regexes, rules)
+    try:
+        write_parser_tables(cachefile, lexer, rules, ToAST)
+    except EnvironmentError:
+        pass
+    return lexer, rules, ToAST
+
+
+def write_parser_tables(cachefile, lexer, rules, ToAST):
+    """
+    NOT_RPYTHON: Write a module to cachefile that rebuilds lexer, rules and
+    ToAST when imported.
+    """
+    automaton = lexer.automaton
+    frags = ['# generated from fundy.grammar by fundyparse.py; do not edit',
+             'import py',
+             'from rpython.rlib.objectmodel import we_are_translated',
+             'from rpython.rlib.parsing.deterministic import DFA, LexerError',
+             'from rpython.rlib.parsing.lexer import DummyLexer',
+             'from rpython.rlib.parsing.parsing import Rule',
+             'from rpython.rlib.parsing.tree import RPythonVisitor, '
+                 'Nonterminal',
+             '',
+             automaton.generate_lexing_code(),
+             '',
+             'automaton = DFA(0, %r, %r, %r, %r)' % (
+                automaton.transitions, automaton.final_states,
+                automaton.unmergeable_states, automaton.names),
+             'automaton.num_states = %d' % automaton.num_states,
+             'lexer = DummyLexer(recognize, automaton, %r)' % lexer.ignore,
+             'rules = %r' % (rules,),
+             '',
+             ToAST.source,
+             'ToAST.__module__ = %r' % ToAST.__module__,
+             'ToAST.source = %r' % ToAST.source,
+             'ToAST.changes = %r' % (ToAST.changes,),
+             '']
+
+    # written under another name and renamed, so that another process
+    # starting at the same time never sees half a file
+    cachefile.dirpath().ensure(dir=True)
+    tmpfile = cachefile.new(basename='%s.%d.tmp' % (cachefile.basename,
+                                                    os.getpid()))
+    tmpfile.write('\n'.join(frags))
+    tmpfile.rename(cachefile)
+
+
 # Similar to ebnfparse.make_parse_function, but accepts a function to
 # run the lexer's token stream through before passing it to the parser,
-# and a list of extra names that are added by the post-processing stage.
-def make_messy_parse_function(regexes, rules, eof=False, post_lexer=None,
-                              extra_names=()):
+# and a lexer that has already been built.
+def make_messy_parse_function(lexer, rules, eof=False, post_lexer=None):
     """
     NOT_RPYTHON: This function is only called to process the grammarfile, which
     occurs before translation, so it does not need to be RPython.
@@ -77,13 +183,6 @@ def make_messy_parse_function(regexes, rules, eof=False, post_lexer=None,
     The parse function it returns parses Fundy code into a "messy" AST, which
     can be cleaned up using the ToAST object obtained from parse_ebnf(grammar).
     """
-    names, regexes = zip(*regexes)
-    if "IGNORE" in names:
-        ignore = ["IGNORE"]
-    else:
-        ignore = []
-    check_for_missing_names(names + extra_names, regexes, rules)
-    lexer = Lexer(list(regexes), list(names), ignore=ignore)
     parser = PackratParser(rules, rules[0].nonterminal)
     def parse(s):
         tokens = lexer.tokenize(s, eof=eof)
@@ -95,93 +194,113 @@ def make_messy_parse_function(regexes, rules, eof=False, post_lexer=None,
     return parse
 
 
-def process_indentation(tokens):
+class StatementReader(object):
     """
-    Remove LINEBREAK tokens from a token stream, inserting TERM where needed.
-
-    A LINEBREAK token is assumed to be produced for every sequence of whitespace
-    containing one or more newlines. It is also assumed that it is impossible
-    for two LINEBREAK tokens to appear consecutively, since they would be read
-    as one multi-line LINEBREAK.
-
-    All whitespace up to and including the last newline is ignored, and the
-    length of the remaining text (plus 3 times the numeber of tabs to bring the
-    indent level for tabs to 4 spaces) is taken as the indent level of the line.
-
-    The current indentation level is the top value in the indentation stack.
-
-    When a line is indented more than the current indentation level, the
-    LINEBREAK token is simply removed.
-
-    When a line is indented equal to the current indentation level, a TERM token
-    is inserted into the token stream.
+    Reads a script from a stream in chunks of whole top level statements, so
+    that each chunk can be parsed and run before the rest of the script is
+    read.
+
+    A line that starts with anything but whitespace is indented at level 0,
+    so the LINEBREAK before it makes process_indentation end every open block
+    and the statement around them; the chunk is usually cut there. There are
+    two ways for such a line not to start a statement: if the newline before
+    it is a backslash continuation, or if the line before it is a pragma (the
+    TERM after a pragma is optional, so that it can go on the line before the
+    definition it applies to). So the chunk isn't cut after a line ending with
+    a backslash or starting with "@" (even if the backslash is in a comment,
+    or the "@" starts an operator name; joining statements into one chunk
+    doesn't change how they parse).
+
+    Cutting the source at these points gives the parser the same tokens for
+    each statement as parsing the whole script, but only one chunk has to be
+    in memory at a time.
+
+    NOTE: this class is used at runtime, so it must be RPython.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.next_line = ''     # the first line of the next chunk
+        self.lineno = 0         # the line number the next chunk starts at
+        self.chunk_lineno = 0   # the line number the last chunk started at
 
-    When a BEGIN token is encountered, if the next line is indented more than
-    the current indentation level, its indentation level is pushed onto the
-    indentation stack.
+    def read_chunk(self):
+        """
+        Return the source of the next chunk of statements, or None at the end
+        of the stream.
+        """
+        lines = []
+        started = False
+        continued = False
+        line = self.next_line
+        self.next_line = ''
+        if not line:
+            line = self.stream.readline()
+        while line:
+            if starts_statement(line):
+                if started and not continued:
+                    self.next_line = line
+                    break
+                started = True
+            lines.append(line)
+            continued = line.endswith('\\\n') or line[0] == '@'
+            line = self.stream.readline()
+
+        if not lines:
+            return None
+        self.chunk_lineno = self.lineno
+        self.lineno += len(lines)
+        return ''.join(lines)
+
+
+def starts_statement(line):
+    return line[0] != ' ' and line[0] != '\t' and line[0] != '\n'
 
-    When a line is indented less than the current indentation level, the
-    indentation stack is popped until the current indentation level is less than
-    the indentation of the line. For each value popped, a TERM token is inserted
-    into the token stream, plus one additional TERM. i.e. one TERM for not being
-    indented, as normal, plus one for each dedent.
 
-    NOTE: this function is called at runtime, so it must be RPython.
+def make_parse_function(for_translation):
     """
-    stack = [0]
-    ret = []
-    begin_block = False
-    for tok in tokens:
-        if tok.name == 'BEGIN':
-            begin_block = True
-            ret.append(tok)
-
-        elif tok.name == 'LINEBREAK':
-            indentstr = tok.source.split('\n')[-1]
-            indent = len(indentstr) + indentstr.count('\t')*3
-
-            if indent <= stack[-1]:
-                ret.append(Token('TERM', tok.source, tok.source_pos))
-                if begin_block:
-                    # If we were supposed to begin a block but there was no
-                    # indent, then the block finished on the same line as it
-                    # started, so we need to emit an extra TERM to complete it.
-                    ret.append(Token('TERM', tok.source, tok.source_pos))
-                while indent < stack[-1]:
-                    stack.pop()
-                    ret.append(Token('TERM', tok.source, tok.source_pos))
+    Convenience function. Goes the whole way from reading the grammar file to
+    building a function that parses Fundy code into the sort of AST that the
+    asteval module expects. Not called at runtime, so it does not need to be
+    RPython, but the function it returns is.
 
-            if indent > stack[-1]:
-                if begin_block:
-                    stack.append(indent)
+    The code is lexed by the lexer in lexing.py, and the tokens are parsed by
+    the deterministic parser in llparse.py, which builds the tidy tree
+    directly; see make_packrat_parse_function for the lexer and parser
+    generated from the grammar.
+    """
+    lexer, rules, ToAST = load_parser_tables(for_translation)
+    keywords = grammar_keywords(lexer)
 
-            # Regardless of the indentation level, after processing a newline
-            # we're no longer looking to start a new block.
-            begin_block = False
+    def parse(code):
+        return parse_tokens(IndentationFilter(FundyLexer(code, keywords)))
 
-        elif tok.name == 'EOF':
-            while stack:
-                stack.pop()
-                ret.append(Token('TERM', tok.source, tok.source_pos))
-            ret.append(tok)
+    return parse
 
-        else:
-            ret.append(tok)
-    # end for tok in tokens
 
-    return ret
-# end def process_indentation
+def grammar_keywords(lexer):
+    """
+    NOT_RPYTHON: Return a dict of the keywords of the grammar that lexer was
+    built from. The lexer names the keyword tokens with a number and the
+    keyword, like "__4_=".
+    """
+    keywords = {}
+    for name in lexer.automaton.names:
+        if name.startswith('__'):
+            keywords[name[2:].split('_', 1)[1]] = True
+    return keywords
 
 
-def make_parse_function(for_translation):
+def make_packrat_parse_function(for_translation):
     """
-    Convenience function. Goes the whole way from reading the grammar file to
-    building a function that parses Fundy code into the sort of AST that the
-    asteval module expects. Not called at runtime, so it does not need to be
-    RPython, but the function it returns is.
+    NOT_RPYTHON: Build a function that parses Fundy code with the
+    PackratParser generated from the grammar and tidies the result with ToAST,
+    which is how Fundy code was parsed before llparse.py. It gives the same
+    trees as parse (and is kept to check that it does), but backtracks and
+    memoises every rule it tries at every token, so it takes far more time and
+    memory on large programs.
     """
-    regexes, rules, ToAST = get_grammar(for_translation)
-    messy_parse = make_messy_parse_function(regexes, rules, eof=True,
+    lexer, rules, ToAST = load_parser_tables(for_translation)
+    messy_parse = make_messy_parse_function(lexer, rules, eof=True,
                                             post_lexer=process_indentation)
     tidyer = ToAST()
 
@@ -222,11 +341,15 @@ class __SecretParser(object):
         self.for_translation = for_translation
         if for_translation:
             attr = 'translated_parse'
+            keywords_attr = 'translated_keywords'
         else:
             attr = 'untranslated_parse'
+            keywords_attr = 'untranslated_keywords'
 
         if getattr(self, attr, None) is None:
             setattr(self, attr, make_parse_function(for_translation))
+            lexer, rules, ToAST = load_parser_tables(for_translation)
+            setattr(self, keywords_attr, grammar_keywords(lexer))
 
     def parse(self, code):
         if self.for_translation:
@@ -234,6 +357,12 @@ class __SecretParser(object):
         else:
             return self.untranslated_parse(code)
 
+    def keywords(self):
+        if self.for_translation:
+            return self.translated_keywords
+        else:
+            return self.untranslated_keywords
+
 
 __secret_parser_state = __SecretParser()
 preparer.register(__secret_parser_state.setup)
@@ -244,6 +373,14 @@ def parse(code):
     return __secret_parser_state.parse(code)
 
 
+def input_tracker():
+    """
+    Return a new InputTracker, for the console to tell when the lines typed
+    so far are ready to parse.
+    """
+    return InputTracker(__secret_parser_state.keywords())
+
+
 def show_parse(code):
     """
     NOT_RPYTHON: For testing/debugging use
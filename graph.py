@@ -17,6 +17,9 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from rpython.rlib.rweakref import RWeakKeyDictionary
+import weakref
+
 from utils import dot_node, dot_link, rset
 
 class NodePtr(object):
@@ -33,6 +36,10 @@ class NodePtr(object):
     should be able to replace the original node with its reduction in-place, or
     other references to the same node would have to reduce it again.
     """
+    # True if there are selector thunks waiting for this pointer to be
+    # reduced; see SelectorNode.
+    watched = False
+
     def __init__(self, node):
         self.node = node
 
@@ -63,8 +70,135 @@ class NodePtr(object):
         """
         Replace the pointed at node with the result of reducing that node
         to weak head normal form.
+
+        While the reduction is in progress this pointer is black-holed; it
+        points at a node that raises LoopError if anything tries to reduce it
+        again, since a value that needs itself to be evaluated first can never
+        be evaluated. This also means the pointer doesn't keep the nodes it
+        used to point to alive while the reduction continues.
+        """
+        node = self.node
+        if isinstance(node, ApplicationNode):
+            self.reduce_application(node)
+        elif isinstance(node, IndirectionNode):
+            target = self.follow()
+            target.reduce_WHNF_inplace()
+            self.node = target.node
+        elif isinstance(node, BlackholeNode):
+            raise LoopError
+        # anything else is already in weak head normal form
+
+    def reduce_application(self, node):
+        # Reduction is done one step at a time in this loop, rather than by
+        # recursing, so nothing refers to the nodes passed through on the way
+        # to the result, and reductions that result in another application
+        # don't use more stack.
+        self.node = blackhole
+
+        # Pointers whose reduction has been taken over by this one, because
+        # this one reduced to an indirection to them. They all end up with
+        # the same value.
+        others = None
+
+        # A recursive definition unfolds to a fresh application of Y every
+        # time it refers to itself, so black-holing can't catch definitions
+        # like x = x + 1; instead, catch the second unfolding of the same
+        # definition before the first has finished.
+        fixes = None
+        fix = node.enter_fixpoint()
+        if fix is not None:
+            fixes = [fix]
+
+        try:
+            while True:
+                if isinstance(node, ApplicationNode):
+                    next = node.step()
+                elif isinstance(node, IndirectionNode):
+                    target = node.target.follow()
+                    next = target.node
+                    if isinstance(next, ApplicationNode):
+                        target.node = blackhole
+                        if others is None:
+                            others = [target]
+                        else:
+                            others.append(target)
+                        fix = next.enter_fixpoint()
+                        if fix is not None:
+                            if fixes is None:
+                                fixes = [fix]
+                            else:
+                                fixes.append(fix)
+                else:
+                    break
+
+                if isinstance(next, BlackholeNode):
+                    # reduced to a value that is itself still being reduced
+                    raise LoopError
+                node = next
+        finally:
+            # If an exception was raised, node is the last node the reduction
+            # reached, which is just as good as the original; unless it's an
+            # indirection to something black-holed, in which case the value
+            # really is a loop and can stay black-holed.
+            if isinstance(node, IndirectionNode):
+                node = blackhole
+            self.node = node
+            if others is not None:
+                for ptr in others:
+                    ptr.node = node
+            if fixes is not None:
+                fixfinder = Y.node
+                assert isinstance(fixfinder, FixfindNode)
+                for fix in fixes:
+                    fixfinder.leave(fix)
+
+        if self.watched:
+            self.watched = False
+            SelectorNode.fire_watchers(self)
+        if others is not None:
+            for ptr in others:
+                if ptr.watched:
+                    ptr.watched = False
+                    SelectorNode.fire_watchers(ptr)
+
+    def follow(self):
+        """
+        Return the pointer at the end of the chain of indirections starting
+        at this pointer (which is this pointer if it doesn't point to an
+        indirection). The indirections along the way are all changed to point
+        straight to the end of the chain.
+        """
+        target = self
+        node = target.node
+        while isinstance(node, IndirectionNode):
+            target = node.target
+            node = target.node
+
+        node = self.node
+        while isinstance(node, IndirectionNode):
+            next = node.target
+            node.target = target
+            node = next.node
+        return target
+
+    def share(self):
+        """
+        Return a node with the same value as this pointer, to be the result of
+        reducing some other pointer. If this pointer hasn't been reduced yet,
+        that's an indirection to this pointer, so that the reduction is only
+        done once, and both pointers get the result.
         """
-        self.node = self.node.reduce_WHNF()
+        node = self.node
+        if isinstance(node, ApplicationNode) or \
+           isinstance(node, BlackholeNode):
+            return IndirectionNode(self)
+        return node
+
+    def children(self):
+        """
+        Return a list of the NodePtrs directly under the pointed at node.
+        """
+        return self.node.children()
 
     def get_applied_node(self, argument_ptr):
         """
@@ -124,6 +258,12 @@ class NodePtr(object):
             yield dot
 
 
+# Most nodes never have any types, so rather than allocating an empty set for
+# each of them, they all share this one. Node.add_type gives a node its own set
+# before adding anything, so this one is never modified.
+no_types = rset(NodePtr.eq, NodePtr.hash)
+
+
 class Node(object):
     """
     Base class for the different kinds of node.
@@ -133,7 +273,7 @@ class Node(object):
     Nodes should have NodePtr data members, not refer directly to other Nodes.
     """
     def __init__(self):
-        self.types = rset(NodePtr.eq, NodePtr.hash)
+        self.types = no_types
 
     def nodeid(self):
         """
@@ -141,13 +281,6 @@ class Node(object):
         """
         return id(self)
 
-    def reduce_WHNF(self):
-        """
-        Return a Node that is the result of reducing this Node to weak head
-        normal form. Either returns a new Node, or self.
-        """
-        return self     # by default reduction doesn't change nodes
-
     def instantiate(self, replace_this_ptr, with_this_ptr):
         """
         Instantiate a node, returning a node that is the result of replacing
@@ -167,7 +300,16 @@ class Node(object):
     def to_string(self):
         raise NotImplementedError
 
+    def children(self):
+        """
+        Return a list of the NodePtrs directly under this node (not including
+        its types). Leaf nodes have no children.
+        """
+        return []
+
     def add_type(self, typeptr):
+        if self.types is no_types:
+            self.types = rset(NodePtr.eq, NodePtr.hash)
         self.types.add(typeptr)
 
     def __repr__(self, toplevel=True):
@@ -347,13 +489,34 @@ class ApplicationNode(Node):
         Node.__init__(self)
         self.functor = functor
         self.argument = argument
+        selector = functor.node
+        if isinstance(selector, SelectorNode):
+            selector.watch(self)
 
-    def reduce_WHNF(self):
+    def step(self):
+        """
+        Return the node this application reduces to in one step (which may be
+        another application; see NodePtr.reduce_WHNF_inplace).
+        """
         self.functor.reduce_WHNF_inplace()
         # self.functor should now be a lambda node or a builtin node
-        new_node = self.functor.get_applied_node(self.argument)
-        # now try to reduce the result, in case it returned another application
-        return new_node.reduce_WHNF()
+        return self.functor.get_applied_node(self.argument)
+
+    def enter_fixpoint(self):
+        """
+        If this is an application of Y, record that the fixpoint of its
+        argument is being reduced (see FixfindNode) and return the argument.
+        Otherwise return None.
+        """
+        if self.functor is not Y:
+            return None
+        fixfinder = Y.node
+        assert isinstance(fixfinder, FixfindNode)
+        fixfinder.enter(self.argument)
+        return self.argument
+
+    def children(self):
+        return [self.functor, self.argument]
 
     def __repr__(self, toplevel=True):
         """
@@ -375,7 +538,7 @@ class LambdaNode(Node):
 
     def apply(self, argument):
         if self.body is self.parameter:     # if the body is just the param
-            return argument.node            # just return the arg node now
+            return argument.share()         # just return the arg now
         return self.body.get_instantiated_node(self.parameter, argument)
 
     def instantiate(self, replace_this_ptr, with_this_ptr):
@@ -408,6 +571,9 @@ class LambdaNode(Node):
                                                           new_param)
             return LambdaNode(new_param, new_body)
 
+    def children(self):
+        return [self.parameter, self.body]
+
     def __repr__(self, toplevel=True):
         """
         NOT_RPYTHON:
@@ -448,6 +614,19 @@ class FixfindNode(Node):
     """
     This implements the Y combinator, which finds the fixpoint of lambda terms.
     """
+    def __init__(self):
+        Node.__init__(self)
+        # arguments whose fixpoint is currently being reduced
+        self.unfolding = {}
+
+    def enter(self, argument):
+        if argument in self.unfolding:
+            raise LoopError
+        self.unfolding[argument] = None
+
+    def leave(self, argument):
+        del self.unfolding[argument]
+
     def apply(self, argument):
         return ApplicationNode(argument.get_instantiated_node_ptr(None, None),
                                Application(Y, argument))
@@ -462,6 +641,64 @@ class FixfindNode(Node):
 FixfindNode.add_dot_fn(dict(shape='ellipse', label='Y', color='green'))
 
 
+class IndirectionNode(Node):
+    """
+    Stands for the value of another pointer, target. Reducing a pointer to an
+    indirection reduces the target (if it hasn't been already) and then
+    copies its value; see NodePtr.reduce_WHNF_inplace and NodePtr.share.
+    """
+    def __init__(self, target):
+        Node.__init__(self)
+        self.target = target
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        # copies never need to go through more than one indirection
+        target = self.target.follow()
+        new_target = target.get_instantiated_node_ptr(replace_this_ptr,
+                                                      with_this_ptr)
+        if new_target is self.target:
+            return self
+        return IndirectionNode(new_target)
+
+    def children(self):
+        return [self.target]
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return 'INDIRECT %s' % self.target.__repr__(False)
+
+IndirectionNode.add_dot_fn(dict(shape='point'),
+                           target=dict(color='black', style='dashed'))
+
+
+class LoopError(Exception):
+    """
+    Raised when the value of a node depends on itself.
+    """
+    pass
+
+
+class BlackholeNode(Node):
+    """
+    Stands in for a node that is being reduced. See
+    NodePtr.reduce_WHNF_inplace.
+    """
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        # Only closed graphs are ever reduced (lambda bodies are copied before
+        # being reduced), so there's nothing under this node to replace.
+        return self
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return "BLACKHOLE"
+
+BlackholeNode.add_dot_fn(dict(shape='box', label='<<loop>>', color='black'))
+
+
 class BuiltinNode(Node):
     def __init__(self):
         Node.__init__(self)
@@ -492,29 +729,51 @@ class BuiltinNode(Node):
 
 
 class TypeswitchNode(Node):
-    def __init__(self, cases):
+    def __init__(self, cases, table=None):
+        Node.__init__(self)
         self.cases = cases
+        if table is None:
+            table = DispatchTable()
+        self.table = table
 
     def apply(self, argument):
         argument.reduce_WHNF_inplace()
-        for c in self.cases:
-            assert isinstance(c.node, ConsNode)
-            case_type = c.node.a
-            case_ret = c.node.b
-            case_type.reduce_WHNF_inplace()
-            if argument.node.types.contains(case_type):
-                return case_ret.node
-        raise TypeError("typeswitch found no match")
+        node = argument.node
+        if isinstance(node, ConstructorNode):
+            i = self.table.lookup_tag(self.cases, node.tag)
+        else:
+            i = self.table.lookup(self.cases, node.types)
+        if i < 0:
+            raise TypeError("typeswitch found no match")
+        c = self.cases[i]
+        assert isinstance(c.node, ConsNode)
+        return c.node.b.share()
 
     def instantiate(self, replace_this_ptr, with_this_ptr):
         new_cases = []
+        nochange = True
+        same_types = True
         for c in self.cases:
             if c is replace_this_ptr:
-                new_cases.append(with_this_ptr)
+                new_c = with_this_ptr
             else:
-                new_cases.append(c.get_instantiated_node_ptr(replace_this_ptr,
-                                                             with_this_ptr))
-        return TypeswitchNode(new_cases)
+                new_c = c.get_instantiated_node_ptr(replace_this_ptr,
+                                                    with_this_ptr)
+            nochange = nochange and new_c is c
+            same_types = same_types and new_c.node.a is c.node.a
+            new_cases.append(new_c)
+
+        if nochange and replace_this_ptr is not None:
+            return self
+        elif same_types:
+            # the case types are the same pointers, so whatever has been
+            # worked out about them can be shared with the new typeswitch
+            return TypeswitchNode(new_cases, self.table)
+        else:
+            return TypeswitchNode(new_cases)
+
+    def children(self):
+        return list(self.cases)
 
     def __repr__(self, toplevel=True):
         """
@@ -541,6 +800,63 @@ class TypeswitchNode(Node):
                     yield thing
 
 
+class DispatchTable(object):
+    """
+    Maps the types matched by the cases of a typeswitch to the index of the
+    first case matching each one.
+
+    Case types are resolved lazily and in order, the first time a lookup
+    can't be answered from the cases resolved so far, so a case type is never
+    evaluated unless the linear search through the cases would have evaluated
+    it. The table is shared by all the instantiations of a typeswitch that
+    have the same case types.
+    """
+    def __init__(self):
+        self.index = {}
+        self.resolved = 0
+        self.tags = {}
+
+    def lookup_tag(self, cases, tag):
+        """
+        Like lookup, for the values made by the Constructor tag. The answer
+        for each constructor is remembered, so after the first time it's a
+        single dictionary lookup.
+        """
+        i = self.tags.get(tag, -2)
+        if i == -2:
+            i = self.lookup(cases, tag.types)
+            self.tags[tag] = i
+        return i
+
+    def lookup(self, cases, types):
+        """
+        Return the index of the first case in cases matching any of the types
+        in the rset types, or -1 if there is none.
+        """
+        if types.length() == 1:
+            # fast path; nearly everything has exactly one type
+            i = self.index.get(types.any().node, -1)
+        else:
+            i = -1
+            for t in types.list():
+                j = self.index.get(t.node, -1)
+                if j >= 0 and (i < 0 or j < i):
+                    i = j
+
+        while i < 0 and self.resolved < len(cases):
+            c = cases[self.resolved]
+            assert isinstance(c.node, ConsNode)
+            case_type = c.node.a
+            case_type.reduce_WHNF_inplace()
+            if case_type.node not in self.index:
+                self.index[case_type.node] = self.resolved
+            if types.contains(case_type):
+                i = self.resolved
+            self.resolved += 1
+
+        return i
+
+
 class ValueNode(Node):
     """
     Base class for nodes containing values.
@@ -560,6 +876,9 @@ class ConsNode(ValueNode):
     def to_string(self):
         return self.a.node.to_string() + " . " + self.b.node.to_string()
 
+    def children(self):
+        return [self.a, self.b]
+
     def __repr__(self, toplevel=True):
         """
         NOT_RPYTHON:
@@ -590,6 +909,357 @@ ConsNode.add_dot_fn(dict(shape='box', color='maroon', label='cons'),
                     b=dict(color='maroon', label='b'))
 
 
+class Constructor(object):
+    """
+    A data constructor, defined by a type statement: its name, how many fields
+    the values it makes have, and their types, which all of its values share.
+    The types are the constructor itself (so that a typeswitch case can match
+    it) and its data type. ptr is the constructor function, or for a
+    constructor without fields, its only value.
+    """
+    def __init__(self, name, arity, type_ptr):
+        self.name = name
+        self.arity = arity
+        if arity == 0:
+            self.ptr = LabelledValue(name)
+        else:
+            self.ptr = NodePtr(ConstructorFunctionNode(self, []))
+        self.types = rset(NodePtr.eq, NodePtr.hash)
+        self.types.add(self.ptr)
+        self.types.add(type_ptr)
+        if arity == 0:
+            self.ptr.node.types = self.types
+        self.lowered_ptr = None
+
+    def lowered(self):
+        """
+        Return a pointer to the constructor as a chain of lambdas making a
+        tree of cons cells, which is how the graph stores and code generators
+        that don't know about constructors represent their values.
+        """
+        if self.lowered_ptr is None:
+            if self.arity == 0:
+                self.lowered_ptr = self.ptr
+            else:
+                params = [Param() for i in range(self.arity)]
+                if self.arity == 1:
+                    # so that fst and snd both give the field, as they do for
+                    # a ConstructorNode with one field
+                    body = Cons(params[0], params[0])
+                else:
+                    body = ConsNode.make_tree(params)
+                params.reverse()
+                for param in params:
+                    body = Lambda(param, body)
+                self.lowered_ptr = body
+        return self.lowered_ptr
+
+
+class ConstructorFunctionNode(Node):
+    """
+    A data constructor applied to fewer arguments than it has fields. Applying
+    it to the last one makes the ConstructorNode in one step.
+    """
+    def __init__(self, tag, args):
+        Node.__init__(self)
+        self.tag = tag
+        self.args = args
+
+    def apply(self, argument):
+        args = self.args + [argument]
+        if len(args) < self.tag.arity:
+            return ConstructorFunctionNode(self.tag, args)
+        return ConstructorNode(self.tag, args)
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        if not self.args:
+            # the constructor itself, which typeswitch cases match by identity
+            return self
+        new_args = _instantiate_ptrs(self.args, replace_this_ptr,
+                                     with_this_ptr)
+        if new_args is None and replace_this_ptr is not None:
+            return self
+        if new_args is None:
+            new_args = list(self.args)
+        return ConstructorFunctionNode(self.tag, new_args)
+
+    def children(self):
+        return list(self.args)
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return 'CONSTRUCTOR %s %r' % (self.tag.name, self.args)
+
+    def dot(self, already_seen=None):
+        """
+        NOT_RPYTHON:
+        """
+        return _dot_ptrs(self, already_seen, 'octagon',
+                         'constructor %s' % self.tag.name, self.args)
+
+
+class ConstructorNode(ValueNode):
+    """
+    A value made by a data constructor: tag is the Constructor, and its
+    fields are the pointers fields[start:stop], in order. The fields list is
+    never changed once made, so the parts of a value that fst and snd split
+    it into (see half) share it with the whole value, rather than copying
+    their fields out of it.
+    """
+    def __init__(self, tag, fields, start=0, stop=-1):
+        Node.__init__(self)
+        if stop < 0:
+            stop = len(fields)
+        self.tag = tag
+        self.fields = fields
+        self.start = start
+        self.stop = stop
+        self.types = tag.types
+
+    def add_type(self, typeptr):
+        # the types are shared with the other values of the constructor
+        assert False
+
+    def length(self):
+        return self.stop - self.start
+
+    def get_field(self, i):
+        return self.fields[self.start + i]
+
+    def get_fields(self):
+        start = self.start
+        assert start >= 0
+        return self.fields[start:self.stop]
+
+    def half(self, which):
+        """
+        Return the first (which is 0) or second (which is 1) half of the
+        fields, as fst and snd see them: the fields are split in the middle,
+        down to single fields, as if they were a tree of cons cells. Both
+        halves of a value with one field are that field. A half with more
+        than one field is a view of the same fields list, so taking it takes
+        constant time however many fields there are.
+        """
+        n = self.length()
+        if n == 1:
+            return self.fields[self.start]
+        pivot = self.start + n / 2
+        if which == 0:
+            start, stop = self.start, pivot
+        else:
+            start, stop = pivot, self.stop
+        if stop - start == 1:
+            return self.fields[start]
+        return NodePtr(ConstructorNode(self.tag, self.fields, start, stop))
+
+    def to_string(self):
+        return ' . '.join([field.node.to_string()
+                           for field in self.get_fields()])
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        fields = self.get_fields()
+        new_fields = _instantiate_ptrs(fields, replace_this_ptr,
+                                       with_this_ptr)
+        if new_fields is None and replace_this_ptr is not None:
+            return self
+        if new_fields is None:
+            new_fields = fields
+        return ConstructorNode(self.tag, new_fields)
+
+    def children(self):
+        return self.get_fields()
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return '%s %r' % (self.tag.name, self.get_fields())
+
+    def dot(self, already_seen=None):
+        """
+        NOT_RPYTHON:
+        """
+        return _dot_ptrs(self, already_seen, 'box', self.tag.name,
+                         self.get_fields())
+
+
+def _instantiate_ptrs(ptrs, replace_this_ptr, with_this_ptr):
+    """
+    Instantiate each of the list of pointers ptrs, returning the list of new
+    pointers, or None if none of them changed.
+    """
+    new_ptrs = []
+    nochange = True
+    for ptr in ptrs:
+        if ptr is replace_this_ptr:
+            new_ptr = with_this_ptr
+        else:
+            new_ptr = ptr.get_instantiated_node_ptr(replace_this_ptr,
+                                                    with_this_ptr)
+        nochange = nochange and new_ptr is ptr
+        new_ptrs.append(new_ptr)
+    if nochange:
+        return None
+    return new_ptrs
+
+def _dot_ptrs(node, already_seen, shape, label, ptrs):
+    """
+    NOT_RPYTHON: Yield a description of node, which has the list of pointers
+    ptrs under it.
+    """
+    if already_seen is None:
+        already_seen = set()
+
+    if node not in already_seen:
+        already_seen.add(node)
+        yield dot_node(node.nodeid(), shape=shape, color='maroon',
+                       label=label)
+        for i in range(len(ptrs)):
+            yield dot_link(node.nodeid(), ptrs[i].nodeid(), color='maroon',
+                           label=str(i))
+            for dot in ptrs[i].dot(already_seen):
+                yield dot
+        for dot in node.dot_types(already_seen):
+            yield dot
+
+
+class _SelectorWatchers(object):
+    def __init__(self):
+        self.apps = []
+
+
+class SelectorNode(Node):
+    """
+    A builtin function projecting one component out of a cons (field 0 for
+    the a component, field 1 for b), or the identity function (field -1).
+    Constructor values are projected as if their fields were a tree of cons
+    cells; see ConstructorNode.half.
+
+    An unevaluated projection would keep the whole cons alive just to get at
+    one component of it. So when a projection is applied to a cons that is
+    already evaluated, the application node is immediately changed into an
+    application of the identity function to the component. When it is applied
+    to something that hasn't been evaluated yet, it waits for that to be
+    reduced and then does the same. Nothing else needs to be done to find
+    projections; they look after themselves from the moment the application
+    node is made.
+    """
+    # Maps pointers to the projections waiting for them to be reduced. The
+    # pointers and the application nodes are both only weakly referenced,
+    # so waiting never keeps anything alive.
+    watchers = RWeakKeyDictionary(NodePtr, _SelectorWatchers)
+
+    def __init__(self, field, name):
+        Node.__init__(self)
+        self.field = field
+        self.name = name
+
+    def apply(self, argument):
+        if self.field < 0:
+            return argument.share()
+
+        argument.reduce_WHNF_inplace()
+        record = argument.node
+        if not _is_record(record):
+            raise TypeError("%s can only be applied to a cons" % self.name)
+        return self.select(record).share()
+
+    def select(self, record):
+        if isinstance(record, ConstructorNode):
+            return record.half(self.field)
+        assert isinstance(record, ConsNode)
+        if self.field == 0:
+            return record.a
+        else:
+            return record.b
+
+    def watch(self, app):
+        """
+        Called when the application node app applying this selector is made.
+        """
+        if self.field < 0:
+            return
+        record = SelectorNode.resolve(app.argument)
+        node = record.node
+        if _is_record(node):
+            app.functor = identity
+            app.argument = self.select(node)
+        elif isinstance(node, ApplicationNode) or \
+             isinstance(node, BlackholeNode):
+            watchers = SelectorNode.watchers.get(record)
+            if watchers is None:
+                watchers = _SelectorWatchers()
+                SelectorNode.watchers.set(record, watchers)
+            watchers.apps.append(weakref.ref(app))
+            record.watched = True
+
+    @staticmethod
+    def resolve(ptr):
+        """
+        Skip over the projections and identities at the top of the graph under
+        ptr that can already be done. If that reaches a cons, return a pointer
+        to it (which has the same value as ptr). Otherwise return a pointer to
+        the first unevaluated thing in the way; once that has been reduced,
+        resolving ptr again will get further.
+        """
+        while True:
+            node = ptr.node
+            if not isinstance(node, ApplicationNode):
+                return ptr
+            selector = node.functor.node
+            if not isinstance(selector, SelectorNode):
+                return ptr
+            if selector.field < 0:
+                ptr = node.argument
+            else:
+                inner = SelectorNode.resolve(node.argument)
+                record = inner.node
+                if not _is_record(record):
+                    return inner
+                ptr = selector.select(record)
+
+    @staticmethod
+    def fire_watchers(ptr):
+        """
+        Called when ptr, which some projections are waiting for, has been
+        reduced.
+        """
+        watchers = SelectorNode.watchers.get(ptr)
+        if watchers is None:
+            return
+        SelectorNode.watchers.set(ptr, None)
+        # Projections waiting on other projections wait on the same pointer,
+        # but after them, so by the time they're looked at here the thing
+        # they're projecting from may already be available.
+        for ref in watchers.apps:
+            app = ref()
+            if app is None:
+                continue
+            selector = app.functor.node
+            # (applications that have already been rewritten to apply the
+            # identity are ignored by watch)
+            if isinstance(selector, SelectorNode):
+                selector.watch(app)
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        return self
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return 'SELECT %s' % self.name
+
+SelectorNode.add_dot_fn(dict(shape='octagon', color='green',
+                             label=lambda self: self.name))
+
+def _is_record(node):
+    # whether fst and snd can project out of node
+    return isinstance(node, ConsNode) or isinstance(node, ConstructorNode)
+
+
 class PrimitiveNode(ValueNode):
     def __init__(self):
         Node.__init__(self)
@@ -661,5 +1331,37 @@ def LabelledValue(name=None):
     """
     return NodePtr(LabelledValueNode(name))
 
+def count_nodes(ptr):
+    """
+    Return the number of distinct nodes in the graph under ptr (not following
+    links to types). Shared subgraphs are only counted once.
+    """
+    seen = {}
+    stack = [ptr]
+    while stack:
+        node = stack.pop().node
+        if node not in seen:
+            seen[node] = None
+            stack.extend(node.children())
+    return len(seen)
+
+def is_evaluated(ptr):
+    """
+    Return whether the graph under ptr is in weak head normal form.
+    """
+    node = ptr.node
+    return not (isinstance(node, ApplicationNode) or
+                isinstance(node, IndirectionNode) or
+                isinstance(node, BlackholeNode))
+
 # define the Y combinator; don't really need a function to make new ones!
 Y = NodePtr(FixfindNode())
+
+# all black-holed pointers point to this one node
+blackhole = BlackholeNode()
+
+# the projections out of a cons, and what they turn into once the cons has
+# been evaluated
+first = NodePtr(SelectorNode(0, 'fst'))
+second = NodePtr(SelectorNode(1, 'snd'))
+identity = NodePtr(SelectorNode(-1, 'id'))
@@ -21,10 +21,18 @@ import sys
 
 from rpython.rlib.parsing.parsing import ParseError
 from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.lexer import SourcePos
 from rpython.rlib.streamio import open_file_as_stream, fdopen_as_stream
 
-from asteval import Eval
-from fundyparse import parse
+from asteval import Eval, PragmaError, definition_options
+from fundyparse import parse, input_tracker, StatementReader
+from graph import LoopError
+from passes import pass_manager, DEFAULT_LEVEL, MAX_LEVEL
+from pyops import memo_registry, overload_registry
+from cafs import caf_registry
+from session import Session
+from soagraph import soa_options
+from closures import closure_options
 from version import version_numbers
 
 # Use __stdin__ etc rather than stdin so it works in IDLE too, although you
@@ -39,13 +47,20 @@ class FundyConsole(object):
     def __init__(self, filename="<console>"):
         self.filename = filename
         self.asteval = Eval()
+        # keep track of the top level bindings, so that redefinitions remake
+        # the bindings depending on them (only when interacting; a script's
+        # definitions each see what came before them)
+        self.session = Session()
+        self.tracking = False
         self.stdin = stdin_stream
         self.stdout = stdout_stream
         self.stderr = stderr_stream
+        self.tracker = input_tracker()
         self.resetbuffer()
 
     def resetbuffer(self):
         self.buffer= []
+        self.tracker.reset()
 
     def interact(self, banner=None, prompt='|> ', continue_prompt='.. '):
         if banner is None:
@@ -53,6 +68,7 @@ class FundyConsole(object):
         else:
             self.write(banner + '\n')
 
+        self.tracking = True
         more = 0
         while True:
             try:
@@ -71,12 +87,21 @@ class FundyConsole(object):
         return 0
 
     def push(self, line):
+        """
+        Add a line of input, and run the input so far if it's complete.
+        Return whether more input is needed.
+
+        Whether the input is complete is worked out a line at a time by the
+        InputTracker (see lexing.py), so the input is only parsed once, when
+        all of it has been typed.
+        """
         self.buffer.append(line)
+        if self.tracker.add_line(line):
+            return True
         source = "\n".join(self.buffer)
-        more = self.runsource(source)
-        if not more:
-            self.resetbuffer()
-        return more
+        self.resetbuffer()
+        self.runsource(source)
+        return False
 
     def raw_input(self, prompt=""):
         #try:
@@ -93,70 +118,215 @@ class FundyConsole(object):
     def write(self, s):
         self.stderr.write(s)
 
-    def compile(self, source):
-        try:
-            tree = parse(source + '\n')
-        except ParseError, e:
-            # HACK: If there are more def's than returns, or more open
-            # parentheses than closed, then presume the parse error is because
-            # of that and return None signalling that more input is required.
-            # This allows such constructs to naturally be entered over several
-            # lines interactively.
-            if source.count('def') > source.count('return') or      \
-               source.count('(') > source.count(')'):
-                return None
-            else:
-                raise
-
-        # no exception
-        return tree
-
     def runsource(self, source):
+        if source.strip() == ':stats':
+            self.write(self.session.report())
+            return
+
         try:
-            tree = self.compile(source)
+            tree = parse(source + '\n')
         except LexerError, e:
             self.write(e.nice_error_message(filename=self.filename) + '\n')
         except ParseError, e:
             self.write(e.nice_error_message(filename=self.filename,
                                             source=source) + '\n')
         else:
-            if tree is None:
-                return True     # incomplete input
-            else:
-                self.runcode(tree)
+            self.runtree(tree)
+
+    def runscript(self, stream):
+        """
+        Run the script read from stream, parsing and running a chunk of
+        statements at a time (see StatementReader), so that the first
+        statements run before the rest are read and only one chunk's tree has
+        to be kept. As when running a script in one go, an error ends it.
+        """
+        reader = StatementReader(stream)
+        while True:
+            source = reader.read_chunk()
+            if source is None:
+                break
+
+            # Errors are reported at their line in the whole script, by
+            # padding the chunk with the lines before it.
+            try:
+                tree = parse(source)
+            except LexerError, e:
+                e.input = '\n' * reader.chunk_lineno + e.input
+                e.source_pos = _shift_lines(e.source_pos, reader.chunk_lineno)
+                self.write(e.nice_error_message(filename=self.filename) + '\n')
+                break
+            except ParseError, e:
+                source = '\n' * reader.chunk_lineno + source
+                e.source_pos = _shift_lines(e.source_pos, reader.chunk_lineno)
+                self.write(e.nice_error_message(filename=self.filename,
+                                                source=source) + '\n')
+                break
+
+            if not self.runtree(tree):
+                break
 
-        # compile error or successfully ran
+    def runtree(self, tree):
+        """
+        Run the statements of tree, reporting any error that stops them.
+        Return whether they all ran.
+        """
+        try:
+            self.runcode(tree)
+        except PragmaError, e:
+            self.write('Error: %s\n' % e.msg)
+        except LoopError:
+            self.write('Error: <<loop>>\n')
+        else:
+            return True
         return False
 
     def runcode(self, tree):
-        self.asteval.dispatch(tree)
+        if self.tracking:
+            self.session.run(self.asteval, tree)
+        else:
+            self.asteval.dispatch(tree)
+
+
+
+def _shift_lines(source_pos, lines):
+    return SourcePos(source_pos.i, source_pos.lineno + lines,
+                     source_pos.columnno)
+
+
+class UsageError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
 
+def parse_options(argv):
+    """
+    Apply the command line options in argv to the interpreter's global
+    settings, returning the name of the script to run (or None to run
+    interactively), or raise UsageError.
 
+    Options:
+        -O0, -O1, -O2       optimisation level (default -O1)
+        -fNAME, -fno-NAME   enable or disable the optimisation pass NAME
+        --pass-stats        print timing and node counts for each pass on exit
+        --memo-size=N       memoised functions remember at most N calls
+        --memo-stats        print hits and misses for each memo table on exit
+        --caf-budget=N      revert the values of the biggest top level
+                            constants to unevaluated when they hold more than N
+                            graph nodes between them
+        --caf-stats         print how often constants were reverted on exit
+        --dispatch-stats    print how often the choices of definitions of
+                            overloaded names were cached, on exit
+        --lazy-defs         build each top level definition's graph when its
+                            name is first used, rather than when it's defined
+        --graph=KIND        evaluate printed expressions in the object graph
+                            (KIND=objects, the default), in arrays (soa), or
+                            by compiling them to Python code (closures; only
+                            when running on top of CPython)
+    """
+    pass_manager.reset(DEFAULT_LEVEL)
+    memo_registry.reset()
+    caf_registry.reset()
+    overload_registry.reset()
+    soa_options.reset()
+    closure_options.reset()
+    definition_options.reset()
+    scriptname = None
+
+    # argv[0] is the executable name
+    for i in range(1, len(argv)):
+        arg = argv[i]
+        if arg.startswith('-O'):
+            level = arg[2:]
+            if len(level) != 1 or not level.isdigit() or \
+               int(level) > MAX_LEVEL:
+                raise UsageError('unknown optimisation level "%s"' % arg)
+            pass_manager.level = int(level)
+        elif arg.startswith('-fno-'):
+            name = arg[5:]
+            if not pass_manager.has_pass(name):
+                raise UsageError('unknown optimisation pass "%s"' % name)
+            pass_manager.disable(name)
+        elif arg.startswith('-f'):
+            name = arg[2:]
+            if not pass_manager.has_pass(name):
+                raise UsageError('unknown optimisation pass "%s"' % name)
+            pass_manager.enable(name)
+        elif arg == '--pass-stats':
+            pass_manager.measure = True
+        elif arg.startswith('--memo-size='):
+            size = arg[len('--memo-size='):]
+            if not size.isdigit() or int(size) == 0:
+                raise UsageError('bad memo table size "%s"' % size)
+            memo_registry.capacity = int(size)
+        elif arg == '--memo-stats':
+            memo_registry.measure = True
+        elif arg.startswith('--caf-budget='):
+            budget = arg[len('--caf-budget='):]
+            if not budget.isdigit() or int(budget) == 0:
+                raise UsageError('bad CAF budget "%s"' % budget)
+            caf_registry.budget = int(budget)
+        elif arg == '--caf-stats':
+            caf_registry.measure = True
+        elif arg == '--dispatch-stats':
+            overload_registry.measure = True
+        elif arg == '--lazy-defs':
+            definition_options.lazy = True
+        elif arg == '--graph=objects':
+            soa_options.enabled = False
+            closure_options.enabled = False
+        elif arg == '--graph=soa':
+            soa_options.enabled = True
+            closure_options.enabled = False
+        elif arg == '--graph=closures':
+            if not closure_options.available:
+                raise UsageError('--graph=closures is not available in the '
+                                 'translated interpreter')
+            soa_options.enabled = False
+            closure_options.enabled = True
+        elif arg.startswith('-'):
+            raise UsageError('unknown option "%s"' % arg)
+        elif scriptname is None:
+            scriptname = arg
+        else:
+            raise UsageError('only one script can be run')
+
+    return scriptname
 
 
 def main(argv):
-    if len(argv) > 1:
-        # argv[0] is the executable name
-        scriptname = argv[1]
+    try:
+        scriptname = parse_options(argv)
+    except UsageError, e:
+        stderr_stream.write('Error: %s\n' % e.msg)
+        return 2
 
+    if scriptname is not None:
+        interp = FundyConsole(scriptname)
         try:
             stream = open_file_as_stream(scriptname, mode="rU")
             try:
-                source = stream.readall()
+                interp.runscript(stream)
             finally:
                 stream.close()
         except OSError, e:
             stderr_stream.write('Error reading file "%s" (errno: %d)\n'
                                 % (scriptname, e.errno))
             return 1
-
-        interp = FundyConsole(scriptname)
-        interp.runsource(source)
-
-        return 0
+        status = 0
     else:
         interp = FundyConsole()
-        return interp.interact()
+        status = interp.interact()
+
+    if pass_manager.measure:
+        stderr_stream.write(pass_manager.report())
+    if memo_registry.measure:
+        stderr_stream.write(memo_registry.report())
+    if caf_registry.measure:
+        stderr_stream.write(caf_registry.report())
+    if overload_registry.measure:
+        stderr_stream.write(overload_registry.report())
+
+    return status
 
 
 if __name__ == '__main__':
@@ -0,0 +1,601 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module turns Fundy source code into the stream of tokens the parser
+reads.
+
+Lexer recognises the tokens defined in fundy.grammar, by running a
+deterministic automaton written out by hand: the class of the first
+character of a token (looked up in CHAR_CLASSES) picks which kind of token
+it can be, and a loop over a table of the characters that can continue that
+kind finds its end. The tokens are the same as those of the lexer that
+rpython.rlib.parsing builds from the regular expressions in the grammar (the
+longest match at each point, with keywords winning over IDENTs of the same
+length), but are lighter: a token records only its offset in the source,
+and the line and column are only worked out if there is an error to report.
+The names of identifiers are interned, so each distinct name is one string
+however many times it's used.
+
+The regular expressions in fundy.grammar are still what defines the tokens;
+if they change, Lexer has to be changed to match. test_fundyparse.py checks
+that the two lexers agree.
+
+Keyword tokens are named by their text (the grammar's lexer names them with
+a number as well, like "__4_="; see llparse.kind_of). Which words and
+symbols are keywords comes from the grammar, when the parse function is
+built.
+
+The tokens go through an IndentationFilter on their way to the parser, which
+turns the LINEBREAK tokens into TERM tokens according to the indentation.
+"""
+
+from rpython.rlib.parsing import lexer as rlexer
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.lexer import SourcePos
+
+
+class Token(object):
+    """
+    A token from a Lexer: its name (the grammar's name for the kind of token,
+    or the text of a keyword), its text, and its offset in the source.
+    """
+    def __init__(self, name, source, offset):
+        self.name = name
+        self.source = source
+        self.offset = offset
+
+    def __repr__(self):
+        """
+        NOT_RPYTHON:
+        """
+        return 'Token(%r, %r, %d)' % (self.name, self.source, self.offset)
+
+
+class TokenSource(object):
+    """
+    A stream of tokens, ending with an EOF token. Once the EOF token has been
+    returned, next_token keeps returning it.
+
+    NOTE: these classes are used at runtime, so they must be RPython.
+    """
+    def next_token(self):
+        raise NotImplementedError
+
+    def source_pos(self, token):
+        """
+        Return the SourcePos of one of the tokens from this source.
+        """
+        raise NotImplementedError
+
+    def make_term(self, token):
+        """
+        Return a TERM token at the same position as token.
+        """
+        raise NotImplementedError
+
+
+# the classes of the characters that can start a token
+C_ERROR = 0
+C_SPACE = 1         # spaces and tabs
+C_NEWLINE = 2
+C_BACKSLASH = 3     # a line continuation
+C_HASH = 4          # a comment
+C_DIGIT = 5
+C_LETTER = 6        # letters and underscore
+C_OPERATOR = 7      # the characters operator names are made of
+C_PUNCTUATION = 8   # characters that are tokens by themselves
+C_QUOTE = 9
+C_APOSTROPHE = 10
+C_QUESTION = 11
+C_SEMICOLON = 12
+C_COLON = 13
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+DIGITS = '0123456789'
+OPERATOR_CHARS = '.+-*/=!@$%^&|'
+MISSING_CHARS = LETTERS + DIGITS + '+-*/=!@$%&|?'
+# the characters allowed in string and character literals without escaping
+LITERAL_CHARS = (' ' + LETTERS + DIGITS + '!@#$%^&*()-=+|[]{};:,.<>/?`~')
+STRING_CHARS = LITERAL_CHARS + "'"
+CHAR_CHARS = LITERAL_CHARS + '"'
+# the characters that can follow a backslash in a literal (besides the quote)
+ESCAPE_CHARS = 'ntbv0\\'
+
+def _char_table(chars, value, default):
+    """
+    NOT_RPYTHON: Return a list of 256 items, value for the characters in chars
+    and default for the others.
+    """
+    table = [default] * 256
+    for c in chars:
+        table[ord(c)] = value
+    return table
+
+def _char_classes():
+    """
+    NOT_RPYTHON:
+    """
+    table = [C_ERROR] * 256
+    for chars, char_class in [(' \t', C_SPACE), ('\n', C_NEWLINE),
+                              ('\\', C_BACKSLASH), ('#', C_HASH),
+                              (DIGITS, C_DIGIT), (LETTERS, C_LETTER),
+                              (OPERATOR_CHARS, C_OPERATOR),
+                              ('(),[]{}', C_PUNCTUATION), ('"', C_QUOTE),
+                              ("'", C_APOSTROPHE), ('?', C_QUESTION),
+                              (';', C_SEMICOLON), (':', C_COLON)]:
+        for c in chars:
+            table[ord(c)] = char_class
+    return table
+
+CHAR_CLASSES = _char_classes()
+IS_WORD = _char_table(LETTERS + DIGITS, True, False)
+IS_DIGIT = _char_table(DIGITS, True, False)
+IS_OPERATOR = _char_table(OPERATOR_CHARS, True, False)
+IS_MISSING = _char_table(MISSING_CHARS, True, False)
+IS_SPACE = _char_table(' \t', True, False)
+IS_LINEBREAK = _char_table(' \t\n', True, False)
+IS_STRING = _char_table(STRING_CHARS, True, False)
+IS_CHAR = _char_table(CHAR_CHARS, True, False)
+IS_ESCAPE = _char_table(ESCAPE_CHARS, True, False)
+
+
+class Names(object):
+    """
+    The interned names of identifiers, shared by every Lexer so that the same
+    name in different chunks of a script is the same string.
+
+    (An object rather than a module level dict, so that the translator
+    doesn't treat it as a constant.)
+    """
+    def __init__(self):
+        self.names = {}
+
+    def intern(self, name):
+        result = self.names.get(name, None)
+        if result is None:
+            self.names[name] = name
+            result = name
+        return result
+
+names = Names()
+
+
+class Lexer(TokenSource):
+    """
+    The tokens of text, lexed one at a time as they are asked for. keywords
+    maps the text of each keyword to True.
+
+    Whitespace, line continuations and comments are skipped, as the grammar's
+    IGNORE says. The last token is EOF, which is returned again when asked
+    for more.
+    """
+    def __init__(self, text, keywords):
+        self.text = text
+        self.keywords = keywords
+        self.pos = 0
+
+    def next_token(self):
+        text = self.text
+        end = len(text)
+        while True:
+            start = self.pos
+            if start >= end:
+                return Token('EOF', 'EOF', end)
+
+            i = start + 1
+            char_class = CHAR_CLASSES[ord(text[start])]
+            if char_class == C_SPACE:
+                while i < end and IS_SPACE[ord(text[i])]:
+                    i += 1
+                self.pos = i
+                continue
+
+            elif char_class == C_BACKSLASH:
+                if i < end and text[i] == '\n':
+                    self.pos = i + 1
+                    continue
+
+            elif char_class == C_HASH:
+                while i < end and text[i] != '\n':
+                    i += 1
+                self.pos = i
+                continue
+
+            elif char_class == C_NEWLINE:
+                while i < end and IS_LINEBREAK[ord(text[i])]:
+                    i += 1
+                return self.token('LINEBREAK', text[start:i], i)
+
+            elif char_class == C_DIGIT:
+                while i < end and IS_DIGIT[ord(text[i])]:
+                    i += 1
+                return self.token('NUMBER', text[start:i], i)
+
+            elif char_class == C_LETTER:
+                while i < end and IS_WORD[ord(text[i])]:
+                    i += 1
+                return self.name(text[start:i], i)
+
+            elif char_class == C_OPERATOR:
+                while i < end and IS_OPERATOR[ord(text[i])]:
+                    i += 1
+                return self.name(text[start:i], i)
+
+            elif char_class == C_PUNCTUATION:
+                source = text[start:i]
+                if source in self.keywords:
+                    return self.token(source, source, i)
+
+            elif char_class == C_QUOTE:
+                i = self.literal(i, '"', IS_STRING)
+                if i > 0:
+                    return self.token('STRING', text[start:i], i)
+
+            elif char_class == C_APOSTROPHE:
+                i = self.literal(i, "'", IS_CHAR)
+                if i > 0:
+                    return self.token('CHAR', text[start:i], i)
+
+            elif char_class == C_QUESTION:
+                while i < end and IS_MISSING[ord(text[i])]:
+                    i += 1
+                if i > start + 1:
+                    return self.token('MISSING', text[start:i], i)
+
+            elif char_class == C_SEMICOLON:
+                return self.token('TERM', ';', i)
+
+            elif char_class == C_COLON:
+                return self.token('BEGIN', ':', i)
+
+            raise LexerError(text, 0, self.position(start))
+
+    def token(self, name, source, end):
+        token = Token(name, source, self.pos)
+        self.pos = end
+        return token
+
+    def name(self, source, end):
+        """
+        Return the token for a name, which is either a keyword or an IDENT.
+        """
+        if source in self.keywords:
+            return self.token(source, source, end)
+        return self.token('IDENT', names.intern(source), end)
+
+    def literal(self, i, quote, allowed):
+        """
+        Return the index just after a string or character literal (delimited
+        by quote) whose first character after the opening quote is at i, or
+        -1 if there's no valid literal there. A character literal must have
+        exactly one character (or escape).
+        """
+        text = self.text
+        end = len(text)
+        count = 0
+        while i < end:
+            c = text[i]
+            if c == quote:
+                if quote == "'" and count != 1:
+                    return -1
+                return i + 1
+            elif c == '\\':
+                if i + 1 < end and (text[i + 1] == quote or
+                                    IS_ESCAPE[ord(text[i + 1])]):
+                    i += 2
+                else:
+                    return -1
+            elif allowed[ord(c)]:
+                i += 1
+            else:
+                return -1
+            count += 1
+        return -1
+
+    def position(self, offset):
+        """
+        Return the SourcePos of an offset in the text.
+        """
+        lineno = 0
+        line_start = 0
+        i = 0
+        while i < offset:
+            if self.text[i] == '\n':
+                lineno += 1
+                line_start = i + 1
+            i += 1
+        return SourcePos(offset, lineno, offset - line_start)
+
+    def source_pos(self, token):
+        return self.position(token.offset)
+
+    def make_term(self, token):
+        return Token('TERM', token.source, token.offset)
+
+
+class LexerTokens(TokenSource):
+    """
+    NOT_RPYTHON: The tokens of text from a lexer built by rpython.rlib.parsing
+    from the grammar, lexed one at a time as they are asked for.
+    """
+    def __init__(self, lexer, text):
+        self.runner = lexer.get_runner(text, eof=True)
+        self.eof = None
+
+    def next_token(self):
+        if self.eof is not None:
+            return self.eof
+        token = self.runner.find_next_token()
+        if token.name == 'EOF':
+            self.eof = token
+        return token
+
+    def source_pos(self, token):
+        return token.source_pos
+
+    def make_term(self, token):
+        return rlexer.Token('TERM', token.source, token.source_pos)
+
+
+class ListTokens(TokenSource):
+    """
+    NOT_RPYTHON: The tokens in a list from a lexer built by
+    rpython.rlib.parsing, which must end with an EOF token.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def next_token(self):
+        token = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return token
+
+    def source_pos(self, token):
+        return token.source_pos
+
+    def make_term(self, token):
+        return rlexer.Token('TERM', token.source, token.source_pos)
+
+
+class IndentationFilter(TokenSource):
+    """
+    Removes LINEBREAK tokens from the token stream source, inserting TERM
+    where needed.
+
+    A LINEBREAK token is assumed to be produced for every sequence of whitespace
+    containing one or more newlines. It is also assumed that it is impossible
+    for two LINEBREAK tokens to appear consecutively, since they would be read
+    as one multi-line LINEBREAK.
+
+    All whitespace up to and including the last newline is ignored, and the
+    length of the remaining text (plus 3 times the numeber of tabs to bring the
+    indent level for tabs to 4 spaces) is taken as the indent level of the line.
+
+    The current indentation level is the top value in the indentation stack.
+
+    When a line is indented more than the current indentation level, the
+    LINEBREAK token is simply removed.
+
+    When a line is indented equal to the current indentation level, a TERM token
+    is inserted into the token stream.
+
+    When a BEGIN token is encountered, if the next line is indented more than
+    the current indentation level, its indentation level is pushed onto the
+    indentation stack.
+
+    When a line is indented less than the current indentation level, the
+    indentation stack is popped until the current indentation level is less than
+    the indentation of the line. For each value popped, a TERM token is inserted
+    into the token stream, plus one additional TERM. i.e. one TERM for not being
+    indented, as normal, plus one for each dedent.
+
+    The tokens are filtered as they are asked for, so the stream is never
+    held in a list. The TERMs inserted for a LINEBREAK all have its source
+    position, so they are all the same Token object.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.stack = [0]
+        self.begin_block = False
+        self.term = None        # the TERM token to insert
+        self.terms = 0          # how many more times to insert it
+        self.after = None       # the token to return after them, if any
+
+    def next_token(self):
+        while True:
+            if self.terms > 0:
+                self.terms -= 1
+                return self.term
+            if self.after is not None:
+                tok = self.after
+                self.after = None
+                return tok
+
+            tok = self.source.next_token()
+            if tok.name == 'BEGIN':
+                self.begin_block = True
+                return tok
+
+            elif tok.name == 'LINEBREAK':
+                indent = indent_level(tok.source)
+                stack = self.stack
+                if indent <= stack[-1]:
+                    terms = 1
+                    if self.begin_block:
+                        # If we were supposed to begin a block but there was
+                        # no indent, then the block finished on the same line
+                        # as it started, so we need to emit an extra TERM to
+                        # complete it.
+                        terms += 1
+                    while indent < stack[-1]:
+                        stack.pop()
+                        terms += 1
+                    self.insert_terms(tok, terms)
+
+                if indent > stack[-1]:
+                    if self.begin_block:
+                        stack.append(indent)
+
+                # Regardless of the indentation level, after processing a
+                # newline we're no longer looking to start a new block.
+                self.begin_block = False
+
+            elif tok.name == 'EOF':
+                if self.stack:
+                    self.insert_terms(tok, len(self.stack))
+                    self.stack = []
+                    self.after = tok
+                else:
+                    return tok
+
+            else:
+                return tok
+
+    def insert_terms(self, tok, n):
+        self.term = self.source.make_term(tok)
+        self.terms = n
+
+    def source_pos(self, token):
+        return self.source.source_pos(token)
+
+    def make_term(self, token):
+        return self.source.make_term(token)
+
+
+def indent_level(linebreak):
+    """
+    Return the indent level of the line after a LINEBREAK token's text: the
+    number of characters after the last newline, counting tabs as 4.
+    """
+    indent = 0
+    i = len(linebreak) - 1
+    while i >= 0 and linebreak[i] != '\n':
+        if linebreak[i] == '\t':
+            indent += 4
+        else:
+            indent += 1
+        i -= 1
+    return indent
+
+
+class InputTracker(object):
+    """
+    Follows the lines typed at the interactive console, to tell when they add
+    up to something to parse, without parsing (or lexing) them again for
+    every line.
+
+    Each line is lexed once, to keep count of the brackets left open and of
+    the indented blocks, as an IndentationFilter would: a line ending with
+    BEGIN starts a block if the line after it is indented more, and the block
+    lasts until a line is indented less. Input is ready to parse when there
+    are no brackets or blocks open, and the last line didn't end with a
+    backslash continuation or consist of a pragma (whose definition is on the
+    next line). A blank (or comment only) line ends the input whatever is
+    still open, as at the Python console, so that there is always a way to
+    finish a block; it's up to the parser to say what's wrong if it wasn't
+    complete.
+    """
+    def __init__(self, keywords):
+        self.keywords = keywords
+        self.reset()
+
+    def reset(self):
+        self.brackets = 0       # how many brackets are open
+        self.blocks = []        # the indent level of each open block
+        self.begin = False      # whether the last line ended with BEGIN
+        self.more = False       # whether the last line needs another
+
+    def add_line(self, line):
+        """
+        Follow another line, returning whether more lines are needed before
+        the input can be parsed.
+        """
+        lexer = Lexer(line + '\n', self.keywords)
+        first = True
+        last = None
+        continued = True
+        pragma = False
+        try:
+            while True:
+                token = lexer.next_token()
+                name = token.name
+                if name == 'EOF':
+                    break
+                elif name == 'LINEBREAK':
+                    if first:
+                        return self.blank_line()
+                    continued = False
+                    break
+                elif name == '(' or name == '[' or name == '{':
+                    self.brackets += 1
+                elif name == ')' or name == ']' or name == '}':
+                    self.brackets -= 1
+                elif name == '@' and first:
+                    pragma = True
+                first = False
+                last = name
+        except LexerError:
+            # let the parser report it
+            self.reset()
+            return False
+        if first:
+            # a continuation line with nothing else on it
+            return True
+
+        if not self.more and self.brackets == 0:
+            # a new line, rather than a continuation of the last one
+            i = 0
+            while i < len(line) and (line[i] == ' ' or line[i] == '\t'):
+                i += 1
+            indent = indent_level(line[:i])
+            if self.begin:
+                if self.blocks:
+                    outer = self.blocks[-1]
+                else:
+                    outer = 0
+                if indent > outer:
+                    self.blocks.append(indent)
+            while self.blocks and indent < self.blocks[-1]:
+                self.blocks.pop()
+
+        self.begin = last == 'BEGIN' and self.brackets == 0
+        self.more = continued or pragma
+        return self.more or self.begin or self.brackets > 0 or \
+            len(self.blocks) > 0
+
+    def blank_line(self):
+        self.reset()
+        return False
+
+
+def process_indentation(tokens):
+    """
+    NOT_RPYTHON: Return the list of tokens ending with EOF, after an
+    IndentationFilter.
+    """
+    source = IndentationFilter(ListTokens(tokens))
+    ret = []
+    while True:
+        tok = source.next_token()
+        ret.append(tok)
+        if tok.name == 'EOF':
+            return ret
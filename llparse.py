@@ -0,0 +1,325 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module parses the token stream made by the lexer (after it has been
+through an IndentationFilter) into the tidy AST that asteval.Eval walks.
+
+The grammar in fundy.grammar is deterministic enough to parse by looking at
+the next token. Each rule picks its alternative, or decides whether to go
+round a repetition again, by looking the next token up in one of the tables
+of first tokens below. The one exception is a top level statement starting
+with an IDENT, which is an assignment if the IDENTs are followed by "=", and
+an expression to print otherwise; that takes a scan ahead over the IDENTs.
+
+So unlike the PackratParser generated from the grammar, this parser never
+backtracks and never memoises anything; the only memory it uses besides the
+tree is its stack, which is as deep as the nesting of the program, and the
+tokens it has looked ahead at. It builds the tidy tree directly, with the
+same Nonterminal and Symbol shapes that running ToAST over the
+PackratParser's tree would give.
+Both are built from fundy.grammar, so if the grammar changes this module has
+to be changed along with it; test_fundyparse.py checks they agree.
+
+The lexer names the keyword tokens of the grammar with a number and the
+keyword (like "__4_="), and the numbers depend on what is in the grammar, so
+the parser refers to keyword tokens by their text instead, and to the other
+tokens by their names; see kind_of.
+"""
+
+from rpython.rlib.parsing.parsing import ParseError, ErrorInformation
+from rpython.rlib.parsing.tree import Symbol, Nonterminal
+
+
+# the tokens each rule can start with
+TERM_FIRST = {'IDENT': True, 'MISSING': True, 'NUMBER': True, '[': True,
+              '{': True, 'STRING': True, 'CHAR': True, '(': True,
+              'typeswitch': True}
+BIND_FIRST = {'IDENT': True, '@': True, 'def': True, 'data': True}
+SYMBOL_TERMS = {'IDENT': True, 'MISSING': True, 'NUMBER': True,
+                'STRING': True, 'CHAR': True}
+
+# what to say was expected when a rule can't start; in the same order as the
+# PackratParser would list them
+TERM_EXPECTED = ['IDENT', 'MISSING', 'NUMBER', '[', '{', 'STRING', 'CHAR', '(',
+                 'typeswitch']
+ASSIGN_EXPECTED = ['IDENT', 'def']
+
+
+def kind_of(token):
+    """
+    Return the text of a keyword token, or the name of any other token.
+    """
+    if token.name.startswith('__'):
+        return token.source
+    return token.name
+
+
+class Parser(object):
+    """
+    Parses the tokens from a TokenSource (see lexing.py) into a tidy AST.
+    Each parse_RULE method parses the rule of fundy.grammar it is named after,
+    starting at the current token, and returns its tree (or, for rules that
+    ToAST inlines into the rule using them, appends its trees to a list).
+
+    Tokens are taken from the source as they are needed; the ones that have
+    been looked ahead at but not yet parsed are kept in ahead.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.ahead = []
+        self.pos = 0            # index in ahead of the current token
+
+    def peek(self, n):
+        """
+        Return the token n tokens after the current one.
+        """
+        while self.pos + n >= len(self.ahead):
+            self.ahead.append(self.source.next_token())
+        return self.ahead[self.pos + n]
+
+    def kind(self):
+        return kind_of(self.peek(0))
+
+    def kind_at(self, n):
+        return kind_of(self.peek(n))
+
+    def advance(self):
+        token = self.peek(0)
+        self.pos += 1
+        if self.pos == len(self.ahead):
+            self.ahead = []
+            self.pos = 0
+        return token
+
+    def error(self, expected):
+        """
+        Return a ParseError saying the current token isn't one of expected.
+        """
+        source_pos = self.source.source_pos(self.peek(0))
+        return ParseError(source_pos, ErrorInformation(source_pos.i, expected))
+
+    def expect(self, kind):
+        if self.kind() != kind:
+            raise self.error([kind])
+        return self.advance()
+
+    def skip(self, kind):
+        if self.kind() == kind:
+            self.advance()
+            return True
+        return False
+
+    def symbol(self):
+        token = self.advance()
+        return Symbol(token.name, token.source, token)
+
+    def parse_program(self):
+        statements = []
+        while self.skip('TERM'):
+            pass
+        while self.kind() != 'EOF':
+            statements.append(self.parse_statement())
+            while self.skip('TERM'):
+                pass
+        self.expect('EOF')
+        return Nonterminal('program', statements)
+
+    def parse_statement(self):
+        kind = self.kind()
+        if kind == 'IDENT' and not self.starts_assignment():
+            return self.parse_print_statement()
+        if kind in BIND_FIRST:
+            return self.parse_bind_statement()
+        if kind == 'show':
+            return self.parse_show_statement()
+        return self.parse_print_statement()
+
+    def starts_assignment(self):
+        """
+        Return whether the IDENTs starting at the current token are followed
+        by "=".
+        """
+        n = 0
+        while self.kind_at(n) == 'IDENT':
+            n += 1
+        return self.kind_at(n) == '='
+
+    def parse_print_statement(self):
+        self.skip('print')
+        exprs = [self.parse_expr()]
+        while self.skip(','):
+            exprs.append(self.parse_expr())
+        if self.kind() != 'TERM':
+            raise self.error([',', 'TERM'])
+        self.advance()
+        return Nonterminal('print_statement', exprs)
+
+    def parse_show_statement(self):
+        self.expect('show')
+        exprs = []
+        if self.kind() in TERM_FIRST:
+            exprs.append(self.parse_expr())
+            while self.skip(','):
+                exprs.append(self.parse_expr())
+        self.expect('TERM')
+        return Nonterminal('show_statement', exprs)
+
+    def parse_bind_statement(self):
+        kind = self.kind()
+        if kind == '@':
+            return self.parse_pragma_statement()
+        if kind == 'data':
+            return self.parse_type_statement()
+        return self.parse_assign_statement()
+
+    def parse_pragma_statement(self):
+        children = []
+        while self.kind() == '@':
+            self.advance()
+            name = self.parse_ident()
+            self.skip('TERM')
+            children.append(Nonterminal('pragma', [name]))
+        children.append(self.parse_assign_statement())
+        return Nonterminal('pragma_statement', children)
+
+    def parse_assign_statement(self):
+        kind = self.kind()
+        if kind == 'def':
+            self.advance()
+            children = [self.parse_ident()]
+            self.parse_params(children)
+            children.append(self.parse_block())
+        elif kind == 'IDENT':
+            children = [self.symbol()]
+            self.parse_params(children)
+            self.expect('=')
+            children.append(self.parse_expr())
+        else:
+            raise self.error(ASSIGN_EXPECTED)
+        self.expect('TERM')
+        return Nonterminal('assign_statement', children)
+
+    def parse_params(self, children):
+        while self.kind() == 'IDENT':
+            children.append(Nonterminal('param', [self.symbol()]))
+
+    def parse_ident(self):
+        if self.kind() != 'IDENT':
+            raise self.error(['IDENT'])
+        return self.symbol()
+
+    def parse_block(self):
+        self.expect('BEGIN')
+        children = []
+        while self.kind() in BIND_FIRST:
+            children.append(self.parse_bind_statement())
+        self.expect('return')
+        children.append(self.parse_expr())
+        self.expect('TERM')
+        return Nonterminal('block', children)
+
+    def parse_type_statement(self):
+        self.expect('data')
+        children = [self.parse_ident()]
+        self.expect('=')
+        children.append(self.parse_constructor())
+        while self.skip('|'):
+            children.append(self.parse_constructor())
+        self.expect('TERM')
+        return Nonterminal('type_statement', children)
+
+    def parse_constructor(self):
+        children = [self.parse_ident()]
+        while self.kind() == 'IDENT':
+            children.append(self.symbol())
+        return Nonterminal('constructor', children)
+
+    def parse_expr(self):
+        if self.kind() not in TERM_FIRST:
+            raise self.error(TERM_EXPECTED)
+        terms = []
+        while self.kind() in TERM_FIRST:
+            terms.append(self.parse_term())
+        return Nonterminal('expr', terms)
+
+    def parse_term(self):
+        kind = self.kind()
+        if kind in SYMBOL_TERMS:
+            return self.symbol()
+        if kind == '(':
+            self.advance()
+            expr = self.parse_expr()
+            self.expect(')')
+            return expr
+        if kind == '[':
+            return self.parse_list()
+        if kind == '{':
+            return self.parse_tuple()
+        return self.parse_typeswitch()
+
+    def parse_typeswitch(self):
+        self.expect('typeswitch')
+        children = [self.parse_expr()]
+        self.expect('BEGIN')
+        children.append(self.parse_switchcase())
+        while self.kind() == 'case':
+            children.append(self.parse_switchcase())
+        return Nonterminal('typeswitch', children)
+
+    def parse_switchcase(self):
+        self.expect('case')
+        pattern = self.parse_expr()
+        self.expect('return')
+        result = self.parse_expr()
+        self.expect('TERM')
+        return Nonterminal('switchcase', [pattern, result])
+
+    def parse_list(self):
+        self.expect('[')
+        children = []
+        if self.kind() in TERM_FIRST:
+            children.append(self.parse_expr())
+            while self.skip(','):
+                children.append(self.parse_expr())
+            if self.skip('BEGIN'):
+                children.append(Nonterminal('tail', [self.parse_expr()]))
+        self.expect(']')
+        return Nonterminal('list', children)
+
+    def parse_tuple(self):
+        self.expect('{')
+        children = []
+        if not self.skip('}'):
+            # either {x,} or {x, y, ...}
+            children.append(self.parse_expr())
+            self.expect(',')
+            if not self.skip('}'):
+                children.append(self.parse_expr())
+                while self.skip(','):
+                    children.append(self.parse_expr())
+                self.expect('}')
+        return Nonterminal('tuple', children)
+
+
+def parse_tokens(source):
+    """
+    Parse the tokens from a TokenSource into the tree of a program.
+    """
+    return Parser(source).parse_program()
@@ -0,0 +1,190 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module defines the optimisation pass manager. Every definition goes
+through it after Eval has built its graph and before the graph is bound in
+the Context, so graph to graph transformations have a single place to hook in.
+"""
+
+import time
+
+# Importing rtime registers the RPython replacement for time.time(), so that
+# the timing done here still works in the translated interpreter.
+from rpython.rlib import rtime
+
+from graph import count_nodes
+from utils import preparer
+
+
+# The -O level used when none is given on the command line.
+DEFAULT_LEVEL = 1
+MAX_LEVEL = 2
+
+
+class Pass(object):
+    """
+    Base class for optimisation passes.
+
+    Subclasses should set name (used to enable or disable the pass by hand) and
+    level (the lowest -O level at which the pass is run by default), and
+    override run. Passes that are not RPython should set translatable to False;
+    they are never run when the interpreter is prepared for translation.
+    """
+    name = 'pass'
+    level = 1
+    translatable = True
+
+    def run(self, name, graph):
+        """
+        Return a graph equivalent to graph, which is the definition bound to
+        name. May return graph itself, possibly modified in place.
+        """
+        return graph
+
+    def reset(self):
+        """
+        Forget anything recorded about previous runs.
+        """
+        pass
+
+    def summary(self):
+        """
+        Return pass specific information to add to the pass manager's report.
+        """
+        return ''
+
+
+class PassStats(object):
+    """
+    Accumulated measurements for one pass.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.microseconds = 0
+        self.nodes_before = 0
+        self.nodes_after = 0
+
+    def record(self, seconds, nodes_before, nodes_after):
+        self.runs += 1
+        self.microseconds += int(seconds * 1000000)
+        self.nodes_before += nodes_before
+        self.nodes_after += nodes_after
+
+    def to_string(self):
+        return '%s: %d runs, %d us, %d -> %d nodes (%d)' % (
+                    self.name, self.runs, self.microseconds,
+                    self.nodes_before, self.nodes_after,
+                    self.nodes_after - self.nodes_before)
+
+
+class PassManager(object):
+    """
+    Holds the passes in the order they are run, decides which of them are
+    enabled, and (when asked to) measures each of them.
+    """
+    def __init__(self, level=DEFAULT_LEVEL):
+        self.passes = []
+        self.stats = {}
+        self.for_translation = False
+        self.reset(level)
+
+    def reset(self, level=DEFAULT_LEVEL):
+        """
+        Go back to the default settings for the given -O level, and forget any
+        measurements made so far.
+        """
+        self.level = level
+        self.overrides = {}
+        self.measure = False
+        for p in self.passes:
+            self.stats[p.name] = PassStats(p.name)
+            p.reset()
+
+    def add_pass(self, p):
+        """
+        Add a pass to be run after all the passes already added.
+        """
+        self.passes.append(p)
+        self.stats[p.name] = PassStats(p.name)
+
+    def has_pass(self, name):
+        return name in self.stats
+
+    def enable(self, name):
+        self.overrides[name] = True
+
+    def disable(self, name):
+        self.overrides[name] = False
+
+    def is_enabled(self, p):
+        if self.for_translation and not p.translatable:
+            return False
+        if p.name in self.overrides:
+            return self.overrides[p.name]
+        return p.level <= self.level
+
+    def run(self, name, graph):
+        """
+        Run all enabled passes over graph, the definition of name, returning
+        the final graph.
+        """
+        for p in self.passes:
+            if self.is_enabled(p):
+                if self.measure:
+                    graph = self.run_measured(p, name, graph)
+                else:
+                    graph = p.run(name, graph)
+        return graph
+
+    def run_measured(self, p, name, graph):
+        nodes_before = count_nodes(graph)
+        start = time.time()
+        graph = p.run(name, graph)
+        elapsed = time.time() - start
+        self.stats[p.name].record(elapsed, nodes_before, count_nodes(graph))
+        return graph
+
+    def report(self):
+        """
+        Return a description of the measurements made of each enabled pass.
+        """
+        lines = ['passes at -O%d:' % self.level]
+        for p in self.passes:
+            if self.is_enabled(p):
+                lines.append('    ' + self.stats[p.name].to_string() +
+                             p.summary())
+        return '\n'.join(lines) + '\n'
+
+    def prepare(self, for_translation):
+        """
+        NOT_RPYTHON: Switch between translated and untranslated modes.
+        """
+        self.for_translation = for_translation
+
+
+# Passes register themselves with this object, and Eval runs it over every
+# definition it builds.
+pass_manager = PassManager()
+preparer.register(pass_manager.prepare)
+
+
+# The passes themselves register with pass_manager when they are imported.
+import typeinfer
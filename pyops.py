@@ -21,8 +21,10 @@
 This module defines builtin Fundy functions that are defined using Python code.
 """
 
-from graph import BuiltinNode, PrimitiveNode, ConsNode, NodePtr
-from utils import Enum, dot_node, dot_link
+from graph import Node, BuiltinNode, PrimitiveNode, ConsNode, ConstructorNode, \
+                  LabelledValueNode, NodePtr, ApplicationNode, Application, \
+                  first, second
+from utils import Enum, LRUCache, dot_node, dot_link
 from builtin import IntNode, CharNode, StringNode, unit_type, unit, \
                     bool_type, bool_false, bool_true
 
@@ -88,6 +90,16 @@ class N_aryBuiltinMeta(type):
         exec '\n'.join(frags)
         dic['instantiate'] = instantiate
 
+        frags = []
+        frags.append('def children(self):')
+        frags.append('    ret = []')
+        for name in argnames:
+            frags.append('    if self.%s:' % name)
+            frags.append('        ret.append(self.%s)' % name)
+        frags.append('    return ret')
+        exec '\n'.join(frags)
+        dic['children'] = children
+
         dic['get_name'] = lambda self: self.func.func_name
         cls = type(classname, bases, dic)
 
@@ -117,8 +129,10 @@ class TypeTable(object):
         self.boxfuncs = {}
         self.extractfuncs = {}
         self.typecheckfuncs = {}
+        self.typeobjects = {}
 
     def add_simple_type(self, name, nodeclass):
+        self.typeobjects[name] = nodeclass.get_type()
         self.boxfuncs[name] = lambda v: nodeclass(v)
         getter = nodeclass.make_getter()
         self.extractfuncs[name] = lambda v: getter(v.node)
@@ -128,6 +142,7 @@ class TypeTable(object):
     def add_enum_type(self, name, fundytype, *values):
         py_to_fundy = {}
         fundy_to_py = {}
+        self.typeobjects[name] = fundytype
         for fundyval, pythonval in values:
             py_to_fundy[pythonval] = fundyval.node
             fundy_to_py[fundyval.node] = pythonval
@@ -144,6 +159,12 @@ class TypeTable(object):
     def get_typecheck_func(self, name):
         return self.typecheckfuncs[name]
 
+    def get_type_name(self, name):
+        """
+        NOT_RPYTHON: Return the Fundy level name of the type called name here.
+        """
+        return self.typeobjects[name].node.to_string()
+
 _type_info = TypeTable()
 _type_info.add_simple_type('int', IntNode)
 _type_info.add_simple_type('char', CharNode)
@@ -154,6 +175,379 @@ _type_info.add_enum_type('bool', bool_type,
 
 
 
+class Signature(object):
+    """
+    Describes the type of a builtin defined with OpTable.op. arg_types and
+    ret_type are Fundy type names.
+
+    variants[mask] is a pointer to a version of the builtin that only checks
+    the types of the arguments whose bit is set in mask; i.e. variants[-1] is
+    the normal fully checked builtin, and variants[0] checks nothing.
+    """
+    def __init__(self, arg_types, ret_type, variants):
+        self.arg_types = arg_types
+        self.ret_type = ret_type
+        self.variants = variants
+
+    def get_variant(self, mask):
+        return self.variants[mask]
+
+
+# Maps pointers to builtins defined with OpTable.op to their Signatures.
+signatures = {}
+
+
+def bad_argument(name, type_name):
+    """
+    Return the message of the TypeError raised when the builtin called name
+    is applied to an argument that isn't a type_name.
+    """
+    return '%s can only be applied to %ss' % (name, type_name)
+
+def no_definition(name):
+    """
+    Return the message of the TypeError raised when none of the definitions
+    of the overloaded name fit the types of its arguments.
+    """
+    return '%s has no definition for the types of its arguments' % name
+
+
+def make_unary_wrapper(func, name, box, argcheck, extract, check, message):
+    """
+    NOT_RPYTHON: Wrap func in code to unbox (and if check is true, typecheck)
+    its argument and box its return value. The returned function is RPython,
+    provided func is. message is the message of the TypeError raised if the
+    argument doesn't pass the typecheck.
+    """
+    def wrapper(x):
+        x.reduce_WHNF_inplace()
+        if check and not argcheck(x):
+            raise TypeError(message)
+        return box(func(extract(x)))
+    # end def wrapper
+
+    wrapper.func_name = name
+    return wrapper
+
+def make_binary_wrapper(func, name, box, argcheck1, argcheck2,
+                        extract1, extract2, check1, check2,
+                        message1, message2):
+    """
+    NOT_RPYTHON: Binary version of make_unary_wrapper.
+    """
+    def wrapper(arg1, arg2):
+        arg1.reduce_WHNF_inplace()
+        arg2.reduce_WHNF_inplace()
+        if check1 and not argcheck1(arg1):
+            raise TypeError(message1)
+        if check2 and not argcheck2(arg2):
+            raise TypeError(message2)
+        return box(func(extract1(arg1), extract2(arg2)))
+    # end def wrapper
+
+    wrapper.func_name = name
+    return wrapper
+
+
+# Overloading. A name defined more than once with OpTable.op, for different
+# argument types, is bound to an Overload, which calls the first definition
+# whose argument types match the arguments. Each use of the name in the
+# program gets its own OverloadNode, with an InlineCache of the definitions
+# chosen for the argument types it has seen; nearly every use only ever sees
+# one or two combinations of types, and after the first call of each it
+# doesn't need to search for the definition at all.
+
+# how many combinations of argument types an InlineCache remembers before it
+# gives up, and leaves the choice to the Overload's table
+POLYMORPHIC_LIMIT = 4
+
+def type_key(node):
+    """
+    Return a node standing for the types of the value node, for keying the
+    choices of overloaded definitions; or None if no one node stands for
+    them, in which case the choice can't be remembered.
+    """
+    if isinstance(node, ConstructorNode):
+        # the types of a constructor's values are shared with the constructor
+        return node.tag.ptr.node
+    if node.types.length() == 1:
+        return node.types.any().node
+    if isinstance(node, LabelledValueNode):
+        # bools, unit and nullary constructors have types of their own
+        return node
+    return None
+
+
+class DispatchLevel(object):
+    """
+    A level of an Overload's table, keyed on the type key of one argument.
+    At the last level, choice is the index of the definition to call.
+    """
+    def __init__(self):
+        self.next = {}
+        self.choice = -1
+
+
+class Overload(object):
+    """
+    The definitions of an overloaded name: builtins defined with OpTable.op
+    that all take arity arguments. arg_types[i] are pointers to the types
+    definition i accepts, and targets[i] is the version of it that doesn't
+    check them (the choice of definition already has).
+
+    table maps the type keys of the arguments to the definition chosen for
+    them, one argument at a time. Every use of the name can fall back on it,
+    so each combination of types is only searched for once.
+    """
+    def __init__(self, name, definitions):
+        """
+        NOT_RPYTHON:
+        """
+        types = {}
+        for ptr in _type_info.typeobjects.values():
+            types[ptr.node.to_string()] = ptr
+        self.name = name
+        self.signatures = [signatures[ptr] for ptr in definitions]
+        self.arity = len(self.signatures[0].arg_types)
+        self.arg_types = []
+        self.targets = []
+        for sig in self.signatures:
+            assert len(sig.arg_types) == self.arity
+            self.arg_types.append([types[t] for t in sig.arg_types])
+            self.targets.append(sig.get_variant(0))
+        self.ptr = NodePtr(OverloadNode(self, None, []))
+        self.reset()
+
+    def reset(self):
+        self.table = DispatchLevel()
+        self.caches = []
+        self.lookups = 0
+        self.searches = 0
+
+    def use(self):
+        """
+        Return a pointer to a new use of the name, with its own InlineCache.
+        The caches are only kept for reporting when they're being measured;
+        otherwise a long script would keep one for every use in it.
+        """
+        cache = InlineCache(self)
+        if overload_registry.measure:
+            self.caches.append(cache)
+        return NodePtr(OverloadNode(self, cache, []))
+
+    def choose(self, keys, args):
+        """
+        Return the index of the definition to call on args (already reduced),
+        whose type keys are keys.
+        """
+        self.lookups += 1
+        level = self.table
+        for key in keys:
+            if key is None:
+                return self.search(args)
+            next = level.next.get(key, None)
+            if next is None:
+                next = DispatchLevel()
+                level.next[key] = next
+            level = next
+        if level.choice < 0:
+            level.choice = self.search(args)
+        return level.choice
+
+    def search(self, args):
+        self.searches += 1
+        for i in range(len(self.arg_types)):
+            types = self.arg_types[i]
+            j = 0
+            while j < self.arity and args[j].node.types.contains(types[j]):
+                j += 1
+            if j == self.arity:
+                return i
+        raise TypeError(no_definition(self.name))
+
+    def to_string(self):
+        uses = 0
+        mono = 0
+        poly = 0
+        mega = 0
+        calls = 0
+        hits = 0
+        for cache in self.caches:
+            if cache.megamorphic:
+                mega += 1
+            elif len(cache.choices) == 1:
+                mono += 1
+            elif len(cache.choices) > 1:
+                poly += 1
+            else:
+                continue
+            uses += 1
+            calls += cache.hits + cache.misses + cache.megamorphic_calls
+            hits += cache.hits
+        if calls > 0:
+            rate = 100 * hits / calls
+        else:
+            rate = 0
+        return ('%s: %d calls at %d uses (%d monomorphic, %d polymorphic, '
+                '%d megamorphic), %d inline cache hits (%d%%), '
+                '%d table lookups, %d searches'
+                % (self.name, calls, uses, mono, poly, mega, hits, rate,
+                   self.lookups, self.searches))
+
+
+class InlineCache(object):
+    """
+    The definitions chosen at one use of an overloaded name. keys holds the
+    type keys of the arguments of up to POLYMORPHIC_LIMIT combinations of
+    types (arity keys for each), and choices the definition chosen for each.
+    A use that sees more combinations than that is megamorphic, and goes
+    straight to the Overload's table from then on.
+    """
+    def __init__(self, overload):
+        self.overload = overload
+        self.keys = []
+        self.choices = []
+        self.megamorphic = False
+        self.hits = 0
+        self.misses = 0
+        self.megamorphic_calls = 0
+
+    def choose(self, keys, args):
+        if self.megamorphic:
+            self.megamorphic_calls += 1
+            return self.overload.choose(keys, args)
+
+        n = len(keys)
+        for i in range(len(self.choices)):
+            j = 0
+            while j < n and self.keys[i * n + j] is keys[j]:
+                j += 1
+            if j == n:
+                self.hits += 1
+                return self.choices[i]
+
+        self.misses += 1
+        choice = self.overload.choose(keys, args)
+        for key in keys:
+            if key is None:
+                return choice
+        if len(self.choices) < POLYMORPHIC_LIMIT:
+            self.keys.extend(keys)
+            self.choices.append(choice)
+        else:
+            self.megamorphic = True
+            self.keys = []
+            self.choices = []
+        return choice
+
+
+class OverloadNode(Node):
+    """
+    An overloaded name, applied to the arguments in args so far. Once it has
+    all of them it calls the definition chosen for their types, remembering
+    the choice in cache (or, if cache is None, in the Overload's table only).
+
+    The cache is shared by every copy of the node made by instantiating the
+    graph it's in, so it is kept for the use of the name in the program, not
+    just for one call.
+    """
+    def __init__(self, overload, cache, args):
+        Node.__init__(self)
+        self.overload = overload
+        self.cache = cache
+        self.args = args
+
+    def apply(self, argument):
+        args = self.args + [argument]
+        if len(args) < self.overload.arity:
+            return OverloadNode(self.overload, self.cache, args)
+
+        keys = []
+        for arg in args:
+            arg.reduce_WHNF_inplace()
+            keys.append(type_key(arg.node))
+        if self.cache is None:
+            choice = self.overload.choose(keys, args)
+        else:
+            choice = self.cache.choose(keys, args)
+
+        node = self.overload.targets[choice].node
+        for arg in args:
+            node = node.apply(arg)
+        return node
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        if not self.args:
+            # (the whole point is that copies share the cache)
+            return self
+        nochange = True
+        new_args = []
+        for arg in self.args:
+            if arg is replace_this_ptr:
+                new_arg = with_this_ptr
+            else:
+                new_arg = arg.get_instantiated_node_ptr(replace_this_ptr,
+                                                        with_this_ptr)
+            nochange = nochange and new_arg is arg
+            new_args.append(new_arg)
+
+        if nochange and replace_this_ptr is not None:
+            return self
+        else:
+            return OverloadNode(self.overload, self.cache, new_args)
+
+    def children(self):
+        return list(self.args)
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return 'OVERLOAD %s %r' % (self.overload.name, self.args)
+
+    def dot(self, already_seen=None):
+        """
+        NOT_RPYTHON:
+        """
+        if already_seen is None:
+            already_seen = set()
+
+        if self not in already_seen:
+            already_seen.add(self)
+            yield dot_node(self.nodeid(), shape='octagon', color='green',
+                           label=self.overload.name)
+            for arg in self.args:
+                yield dot_link(self.nodeid(), arg.nodeid(),
+                               color='blue', style='dotted')
+                for dot in arg.dot(already_seen):
+                    yield dot
+            for dot in self.dot_types(already_seen):
+                yield dot
+
+
+class OverloadRegistry(object):
+    """
+    Keeps track of the overloaded names, so the hit rates of their caches can
+    be reported.
+    """
+    def __init__(self):
+        self.overloads = []
+        self.measure = False
+
+    def reset(self):
+        self.measure = False
+        for overload in self.overloads:
+            overload.reset()
+
+    def report(self):
+        lines = ['overloads:']
+        for overload in self.overloads:
+            lines.append('    ' + overload.to_string())
+        return '\n'.join(lines) + '\n'
+
+overload_registry = OverloadRegistry()
+
+
 class OpTable(object):
     """
     NOT_RPYTHON:
@@ -164,6 +558,7 @@ class OpTable(object):
     # refactoring as well, to make more of its functionality reuseable.
     def __init__(self):
         self._db = {}
+        self.overloads = {}
 
 
     def op(self, name=None, arg_types=None, ret_type=None,
@@ -208,22 +603,17 @@ class OpTable(object):
             else:
                 _name = name
 
+            messages = [bad_argument(_name, _type_info.get_type_name(t))
+                        for t in _arg_types]
+
             if num_params == 1:
                 argcheck = _type_info.get_typecheck_func(_arg_types[0])
                 extract = _type_info.get_extract_func(_arg_types[0])
-
-                def wrapper(x):
-                    x.reduce_WHNF_inplace()
-                    if argcheck(x):
-                        raw_ret = func(extract(x))
-                        ret = box(raw_ret)
-                        return ret
-                    else:
-                        raise TypeError     # TODO: proper exception here
-                # end def wrapper
-
-                wrapper.func_name = _name
-                ptr = NodePtr(UnaryBuiltinNode(wrapper))
+                variants = [NodePtr(UnaryBuiltinNode(
+                                make_unary_wrapper(func, _name, box, argcheck,
+                                                   extract, mask & 1,
+                                                   messages[0])))
+                            for mask in range(2)]
                 if fixity is None:
                     _fixity = FIXITY.PREFIX
 
@@ -232,26 +622,28 @@ class OpTable(object):
                                            _arg_types)
                 extract1, extract2 = map(_type_info.get_extract_func,
                                          _arg_types)
-
-                def wrapper(arg1, arg2):
-                    arg1.reduce_WHNF_inplace()
-                    arg2.reduce_WHNF_inplace()
-                    if argcheck1(arg1) and argcheck2(arg2):
-                        raw_ret = func(extract1(arg1), extract2(arg2))
-                        ret = box(raw_ret)
-                        return ret
-                    else:
-                        raise TypeError     # TODO: proper exception here
-                # end def wrapper
-
-                wrapper.func_name = _name
-                ptr = NodePtr(BinaryBuiltinNode(wrapper))
+                variants = [NodePtr(BinaryBuiltinNode(
+                                make_binary_wrapper(func, _name, box,
+                                                    argcheck1, argcheck2,
+                                                    extract1, extract2,
+                                                    mask & 1, mask & 2,
+                                                    messages[0],
+                                                    messages[1])))
+                            for mask in range(4)]
                 if fixity is None:
                     _fixity = FIXITY.INFIX
 
             else:
                 raise NotImplementedError
 
+            # The fully checked variant is the one that gets bound to the
+            # name; the others are only substituted in by optimisation passes
+            # that have proven the unchecked arguments have the right types.
+            ptr = variants[-1]
+            signatures[ptr] = Signature(
+                    [_type_info.get_type_name(t) for t in _arg_types],
+                    _type_info.get_type_name(ret_type), variants)
+
             if assoc is None:
                 _assoc = ASSOC.LEFT
             else:
@@ -282,23 +674,38 @@ class OpTable(object):
     def register_func(self, name, graph):
         record = SimpleRecord(graph)
         if not name in self._db:
-            self._db[name] = set()
-        self._db[name].add(record)
+            self._db[name] = []
+        self._db[name].append(record)
 
     def register_op(self, name, graph, assoc, prec, fixity):
         record = OperatorRecord(graph, assoc, prec, fixity)
         if not name in self._db:
-            self._db[name] = set()
-        self._db[name].add(record)
+            self._db[name] = []
+        self._db[name].append(record)
 
     def make_context(self):
+        """
+        NOT_RPYTHON: Bind everything registered in a new context. A name
+        registered more than once is overloaded; the definitions are tried
+        in the order they were registered.
+        """
         c = Context()
-        for name, recordset in self._db.items():
-            for r in recordset:
-                if hasattr(r, 'fixity'):
-                    c.bind_operator(name, r.graph, r.assoc, r.prec, r.fixity)
-                else:
-                    c.bind(name, r.graph)
+        for name, records in self._db.items():
+            r = records[0]
+            if len(records) == 1:
+                graph = r.graph
+            else:
+                overload = Overload(name, [rec.graph for rec in records])
+                overload_registry.overloads.append(overload)
+                self.overloads[name] = overload
+                graph = overload.ptr
+            if hasattr(r, 'fixity'):
+                for rec in records:
+                    assert (rec.assoc, rec.prec, rec.fixity) == \
+                           (r.assoc, r.prec, r.fixity)
+                c.bind_operator(name, graph, r.assoc, r.prec, r.fixity)
+            else:
+                c.bind(name, graph)
         return c
 
 
@@ -320,6 +727,10 @@ def mul(x, y):
 def div(x, y):
     return x // y
 
+@ops.op(name='+', arg_types='string', prec=1000)
+def concat(x, y):
+    return x + y
+
 @ops.op(arg_types='int', prec=3000)
 def neg(x):
     return -1 * x
@@ -355,6 +766,17 @@ def eq(left, right):
         return left.node.eq(right.node)
     elif isinstance(left.node, ConsNode):
         return eq(left.node.a, right.node.a) and eq(left.node.b, right.node.b)
+    elif isinstance(left.node, ConstructorNode):
+        lnode = left.node
+        rnode = right.node
+        assert isinstance(lnode, ConstructorNode)
+        assert isinstance(rnode, ConstructorNode)
+        if lnode.tag is not rnode.tag or lnode.length() != rnode.length():
+            return False
+        for i in range(lnode.length()):
+            if not eq(lnode.get_field(i), rnode.get_field(i)):
+                return False
+        return True
     else:
         raise TypeError("Can't compare non-value types for equality")
 
@@ -369,11 +791,214 @@ pyops_context.bind_operator('==', eq_ptr, ASSOC.LEFT, 250, FIXITY.INFIX)
 
 def if_then_else(cond, then_part, else_part):
     if eq(cond, bool_true):
-        return then_part.node
+        return then_part.share()
     else:
-        return else_part.node
+        return else_part.share()
 
 if_then_else.func_name = 'if'
 
 if_ptr = NodePtr(TernaryBuiltinNode(if_then_else))
 pyops_context.bind('if', if_ptr)
+
+
+# The projections out of tuples and constructor values are defined in graph,
+# as the reducer needs to treat them specially.
+pyops_context.bind('fst', first)
+pyops_context.bind('snd', second)
+
+
+# Memoisation. A memoised function keeps a table of the results of previous
+# calls, keyed on the values of the arguments, so that calling it again with
+# the same arguments does not need to do the work again. It is only sensible
+# for functions whose arguments are plain values: primitives (ints, chars,
+# strings, bools, unit) and cons structures of them.
+
+def memo_key(ptr, parts):
+    """
+    Append a string representation of the value under ptr to the list parts,
+    returning False if it is not the kind of value that can be used as a key.
+
+    This forces the value completely (not just to weak head normal form), so
+    memoised functions are strict in their arguments.
+    """
+    ptr.reduce_WHNF_inplace()
+    node = ptr.node
+    if isinstance(node, PrimitiveNode):
+        # primitives of different types can have the same string form (e.g.
+        # the char 'a' and the string "a"), so qualify it with the type; the
+        # length keeps strings containing the separators unambiguous
+        s = node.to_string()
+        parts.append('%s:%d:' % (node.types.any().node.to_string(), len(s)))
+        parts.append(s)
+        return True
+    elif isinstance(node, ConsNode):
+        parts.append('(')
+        if not memo_key(node.a, parts):
+            return False
+        parts.append(' . ')
+        if not memo_key(node.b, parts):
+            return False
+        parts.append(')')
+        return True
+    elif isinstance(node, ConstructorNode):
+        parts.append('(%s' % node.tag.name)
+        for i in range(node.length()):
+            field = node.get_field(i)
+            parts.append(' ')
+            if not memo_key(field, parts):
+                return False
+        parts.append(')')
+        return True
+    else:
+        return False
+
+
+class MemoTable(LRUCache):
+    def __init__(self, name, capacity):
+        LRUCache.__init__(self, capacity)
+        self.name = name
+        # calls that are still being reduced; kept out of the LRU cache so
+        # they can't push out finished results
+        self.pending = {}
+
+    def to_string(self):
+        return '%s: %d/%d entries, %d hits, %d misses, %d evictions' % (
+                    self.name, self.length(), self.capacity,
+                    self.hits, self.misses, self.evictions)
+
+
+class MemoRegistry(object):
+    """
+    Makes memo tables, all with the same capacity, and keeps track of them so
+    their statistics can be reported.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, capacity=1024):
+        self.capacity = capacity
+        self.measure = False
+        self.tables = []
+
+    def new_table(self, name):
+        table = MemoTable(name, self.capacity)
+        self.tables.append(table)
+        return table
+
+    def report(self):
+        lines = ['memo tables:']
+        for table in self.tables:
+            lines.append('    ' + table.to_string())
+        return '\n'.join(lines) + '\n'
+
+memo_registry = MemoRegistry()
+
+
+class MemoNode(Node):
+    """
+    A memoised function of arity arguments. args holds the arguments it has
+    been applied to so far; once it has all of them it looks them up in table,
+    only calling func if they're not there.
+
+    func is never instantiated. The memo builtin only makes MemoNodes at run
+    time, by which point func has already been instantiated, and the @memo
+    pragma only allows closed definitions, whose func refers back to the
+    MemoNode itself (so could not be copied anyway).
+    """
+    def __init__(self, func, table, arity, args):
+        Node.__init__(self)
+        self.func = func
+        self.table = table
+        self.arity = arity
+        self.args = args
+
+    def apply(self, argument):
+        args = self.args + [argument]
+        if len(args) < self.arity:
+            return MemoNode(self.func, self.table, self.arity, args)
+
+        parts = []
+        for arg in args:
+            if not memo_key(arg, parts):
+                # can't remember this call, so just make it
+                return self.call(args)
+
+        key = ''.join(parts)
+        result = self.table.pending.get(key, None)
+        if result is not None:
+            # This call needs its own result; reducing the black-holed
+            # pointer raises LoopError instead of recursing forever.
+            result.reduce_WHNF_inplace()
+
+        result = self.table.get(key)
+        if result is None:
+            result = NodePtr(self.call(args))
+            self.table.pending[key] = result
+            try:
+                result.reduce_WHNF_inplace()
+            finally:
+                del self.table.pending[key]
+            self.table.put(key, result)
+        return result.node
+
+    def call(self, args):
+        app = self.func
+        for arg in args:
+            app = Application(app, arg)
+        node = app.node
+        assert isinstance(node, ApplicationNode)
+        return node
+
+    def instantiate(self, replace_this_ptr, with_this_ptr):
+        nochange = True
+        new_args = []
+        for arg in self.args:
+            if arg is replace_this_ptr:
+                new_arg = with_this_ptr
+            else:
+                new_arg = arg.get_instantiated_node_ptr(replace_this_ptr,
+                                                        with_this_ptr)
+            nochange = nochange and new_arg is arg
+            new_args.append(new_arg)
+
+        if nochange and replace_this_ptr is not None:
+            return self
+        else:
+            return MemoNode(self.func, self.table, self.arity, new_args)
+
+    def children(self):
+        # func is left out, as it is never instantiated (and the graph under
+        # it usually leads straight back here)
+        return list(self.args)
+
+    def __repr__(self, toplevel=True):
+        """
+        NOT_RPYTHON:
+        """
+        return 'MEMO %s %r' % (self.table.name, self.args)
+
+    def dot(self, already_seen=None):
+        """
+        NOT_RPYTHON:
+        """
+        if already_seen is None:
+            already_seen = set()
+
+        if self not in already_seen:
+            already_seen.add(self)
+            yield dot_node(self.nodeid(), shape='octagon', color='green',
+                           label='memo %s' % self.table.name)
+            for arg in self.args:
+                yield dot_link(self.nodeid(), arg.nodeid(),
+                               color='blue', style='dotted')
+                for dot in arg.dot(already_seen):
+                    yield dot
+            for dot in self.dot_types(already_seen):
+                yield dot
+
+
+def memo(func):
+    return MemoNode(func, memo_registry.new_table('<memo>'), 1, [])
+
+memo_ptr = NodePtr(UnaryBuiltinNode(memo))
+pyops_context.bind('memo', memo_ptr)
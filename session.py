@@ -0,0 +1,208 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module keeps track of the top level bindings made at the interactive
+console, so that redefining a name can remake the bindings that depend on it.
+
+Each binding remembers the statement that made it, and which of the other
+bindings' names it mentions. When a name is redefined, the bindings that
+depend on it, directly or through other bindings, are made again from their
+statements (in the order they were first made), so that they use the new
+definition.
+
+Bindings that don't depend on the redefined name keep their graphs, and so
+keep whatever printing them has already reduced them to. For a constant
+applicative form (CAF: a definition without parameters) that is its value, so
+the graphs of the CAFs are a cache of their values, which is only invalidated
+by redefining something they depend on.
+"""
+
+from rpython.rlib.parsing.tree import Symbol, Nonterminal
+
+from graph import is_evaluated
+
+
+class Binding(object):
+    """
+    The names bound by a top level statement, numbered in the order the
+    statements were run. deps are the names of other bindings it mentions.
+    """
+    def __init__(self, number, statement, names, deps, caf):
+        self.number = number
+        self.statement = statement
+        self.names = names
+        self.deps = deps
+        self.caf = caf
+
+
+class Session(object):
+    def __init__(self):
+        self.bindings = {}      # the binding each name was last bound by
+        self.order = []         # every binding made, in order
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+        self.remade = 0
+
+    def run(self, eval, tree):
+        """
+        Run the statements of the program tree with eval, keeping track of
+        the bindings they make.
+        """
+        for statement in tree.children:
+            names = bound_names(statement)
+            if names:
+                self.bind(eval, statement, names)
+            else:
+                self.count_cafs(eval, statement)
+                eval.dispatch(statement)
+
+    def bind(self, eval, statement, names):
+        # find what depends on the names before the new binding replaces them
+        dependents = self.dependents(names)
+
+        eval.dispatch(statement)
+        self.record(statement, names)
+
+        for binding in dependents:
+            eval.dispatch(binding.statement)
+            self.remade += 1
+
+    def record(self, statement, names):
+        deps = []
+        for name in mentioned_names(statement):
+            if name in self.bindings and name not in names:
+                deps.append(name)
+        caf = (statement.symbol == 'assign_statement' and
+               len(statement.children) == 2)
+        self.count += 1
+        binding = Binding(self.count, statement, names, deps, caf)
+        for name in names:
+            self.bindings[name] = binding
+        self.order.append(binding)
+
+    def dependents(self, names):
+        """
+        Return the bindings that depend on any of names, directly or through
+        each other, in the order they were made. Bindings of names themselves
+        are being replaced, and aren't included.
+        """
+        live = self.live_bindings()
+        found = {}
+        work = list(names)
+        while work:
+            name = work.pop()
+            for binding in live:
+                if binding.number in found or name not in binding.deps:
+                    continue
+                if _overlaps(binding.names, names):
+                    continue
+                found[binding.number] = binding
+                work.extend(binding.names)
+
+        result = []
+        for binding in live:
+            if binding.number in found:
+                result.append(binding)
+        return result
+
+    def live_bindings(self):
+        """
+        Return the bindings that some name is still bound by, in the order
+        they were made, dropping the others.
+        """
+        live = []
+        for binding in self.order:
+            for name in binding.names:
+                if self.bindings[name] is binding:
+                    live.append(binding)
+                    break
+        self.order = live
+        return live
+
+    def count_cafs(self, eval, statement):
+        """
+        Count, for each CAF the statement mentions, whether its value has
+        already been worked out (a hit) or not (a miss).
+        """
+        for name in mentioned_names(statement):
+            binding = self.bindings.get(name, None)
+            if binding is None or not binding.caf:
+                continue
+            if is_evaluated(eval.context.lookup(name)):
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def report(self):
+        return ('%d top level bindings, %d remade after redefinitions\n'
+                'CAF cache: %d hits, %d misses\n'
+                % (len(self.live_bindings()), self.remade, self.hits,
+                   self.misses))
+
+
+def bound_names(statement):
+    """
+    Return the names a top level statement binds (if any).
+    """
+    if statement.symbol == 'pragma_statement':
+        assert isinstance(statement, Nonterminal)
+        return bound_names(statement.children[-1])
+    if statement.symbol == 'assign_statement':
+        assert isinstance(statement, Nonterminal)
+        return [_ident(statement.children[0])]
+    if statement.symbol == 'type_statement':
+        assert isinstance(statement, Nonterminal)
+        names = [_ident(statement.children[0])]
+        for i in range(1, len(statement.children)):
+            constructor = statement.children[i]
+            assert isinstance(constructor, Nonterminal)
+            names.append(_ident(constructor.children[0]))
+        return names
+    return []
+
+def mentioned_names(node):
+    """
+    Return the names mentioned anywhere in the tree under node, once each.
+    """
+    found = {}
+    result = []
+    _collect_names(node, found, result)
+    return result
+
+def _collect_names(node, found, result):
+    if isinstance(node, Symbol):
+        if node.symbol == 'IDENT' and node.additional_info not in found:
+            found[node.additional_info] = True
+            result.append(node.additional_info)
+        return
+    assert isinstance(node, Nonterminal)
+    for child in node.children:
+        _collect_names(child, found, result)
+
+def _ident(node):
+    assert isinstance(node, Symbol)
+    return node.additional_info
+
+def _overlaps(xs, ys):
+    for x in xs:
+        if x in ys:
+            return True
+    return False
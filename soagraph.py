@@ -0,0 +1,611 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module defines an alternative representation of graphs, where instead of
+one object per node and per pointer (see graph.py), the nodes of a graph are
+stored in a few parallel arrays of integers: a tag saying what kind of node it
+is, two fields that are the indices of other nodes (an application's functor
+and argument, a cons' a and b), and an integer value (an int's value, a
+builtin's operation, a compiled function's number). Reducing a node overwrites
+its entries in the arrays, so an index plays the part of a NodePtr.
+
+Eval still builds its graphs out of objects; a GraphStore loads the graph of
+an expression to be printed and reduces that. Only the core of the language
+can be loaded (lambdas, applications, Y, cons, ints and other primitive values,
+and the builtin operations below); anything else raises Unsupported before
+any reduction has been done, so the caller can fall back to the object graph.
+The lambdas are compiled to bytecode as they're loaded (see bytecode.py).
+
+The reduction loop is annotated for the RPython JIT, so that (when translated
+with -Ojit) loops made of tail calls are traced and compiled to machine code.
+
+A GraphStore is never garbage collected; it only grows while the expression
+it holds is reduced, so a new one should be used for each expression.
+"""
+
+from rpython.rlib import jit
+from rpython.rlib.objectmodel import resizelist_hint, specialize
+
+from graph import (NodePtr, ApplicationNode, LambdaNode, ParameterNode,
+                   FixfindNode, IndirectionNode, BlackholeNode, SelectorNode,
+                   ConsNode, ConstructorFunctionNode, PrimitiveNode,
+                   LoopError)
+from builtin import IntNode, StringNode, StrPtr, bool_true, bool_false
+from pyops import (UnaryBuiltinNode, BinaryBuiltinNode, TernaryBuiltinNode,
+                   OverloadNode, ops, signatures, plus, minus, mul, div, neg,
+                   bool_and, bool_or, boxed_eq, if_then_else, eq,
+                   bad_argument, no_definition)
+from bytecode import (Unsupported, compile_lambda, I_APP, I_CONS, I_FUNC, ARG,
+                      REG, operand_kind, operand_index)
+
+
+# node tags
+APP = 0         # a = functor, b = argument
+PARAM = 2
+CONS = 3        # a, b = components
+INT = 4         # value = the int
+VALUE = 5       # value = index into GraphStore.objects
+FIX = 6         # the Y combinator
+PRIM = 7        # value = operation
+PARTIAL = 8     # builtin applied to some arguments; a = the builtin (or a
+                # shorter PARTIAL), b = the last argument, value = number of
+                # arguments so far
+HOLE = 9        # being reduced
+FUNC = 10       # a compiled function; value = the number of its Code in
+                # GraphStore.codes
+
+# builtin operations, and how many arguments each takes
+OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_NEG, OP_AND, OP_OR, OP_EQ, OP_IF, \
+    OP_FST, OP_SND, OP_ID = range(12)
+ARITY = [2, 2, 2, 2, 1, 2, 2, 2, 3, 1, 1, 1]
+# (the names of the builtins, for the messages of their TypeErrors)
+OP_NAMES = ['+', '-', '*', '/', 'neg', 'and', 'or', '==', 'if',
+            'fst', 'snd', 'id']
+
+
+def _wrappers(ptr):
+    """
+    NOT_RPYTHON: Return the Python functions of all the variants of the
+    builtin ptr (see pyops.Signature).
+    """
+    return [variant.node.func for variant in signatures[ptr].variants]
+
+_unary_ops = [(func, OP_NEG) for func in _wrappers(neg)]
+_binary_ops = []
+for _ptr, _op in [(plus, OP_ADD), (minus, OP_SUB), (mul, OP_MUL),
+                  (div, OP_DIV), (bool_and, OP_AND), (bool_or, OP_OR)]:
+    _binary_ops.extend([(func, _op) for func in _wrappers(_ptr)])
+_binary_ops.append((boxed_eq, OP_EQ))
+_ternary_ops = [(if_then_else, OP_IF)]
+# (+ is overloaded for strings; see apply_builtin)
+_overload_ops = [(ops.overloads['+'], OP_ADD)]
+
+
+def _lower(ptr):
+    # the store keeps constructor values as trees of cons cells
+    node = ptr.node
+    if isinstance(node, ConstructorFunctionNode) and not node.args:
+        return node.tag.lowered()
+    return ptr
+
+
+@specialize.argtype(2)
+def _grow_list(lst, size, fill):
+    # extending with [fill] * n would allocate another list as big as the
+    # extra space, just to copy it
+    resizelist_hint(lst, size)
+    while len(lst) < size:
+        lst.append(fill)
+
+
+jitdriver = jit.JitDriver(greens=['code'],
+                          reds=['index', 'tag', 'a', 'b', 'value', 'self',
+                                'others'])
+
+
+class GraphStore(object):
+    """
+    Holds nodes in parallel arrays. Nodes are referred to by their index.
+
+    The methods application, param, cons and integer make new nodes,
+    like the helper functions in graph.py do. load copies a graph made of
+    objects into the store.
+    """
+    def __init__(self, capacity=1024):
+        # The arrays are grown by doubling them when they're full, rather than
+        # by appending to them; a list that grows one element at a time is
+        # copied much more often, and leaves a lot of garbage behind.
+        self.top = 0
+        self.tags = [0] * capacity
+        self.field_a = [0] * capacity
+        self.field_b = [0] * capacity
+        self.values = [0] * capacity
+
+        # primitive values that aren't ints are kept as objects
+        self.objects = []
+        # the compiled functions loaded into the store
+        self.codes = []
+        # the node loaded for each NodePtr
+        self.indices = {}
+        self.false_index = self.value(bool_false)
+        self.true_index = self.value(bool_true)
+
+        # see apply_builtin
+        self.int_result = 0
+
+    def size(self):
+        """
+        Return the number of nodes in the store.
+        """
+        return self.top
+
+    def new(self, tag, a, b, value):
+        index = self.top
+        if index == len(self.tags):
+            self.grow()
+        self.tags[index] = tag
+        self.field_a[index] = a
+        self.field_b[index] = b
+        self.values[index] = value
+        self.top = index + 1
+        return index
+
+    def grow(self):
+        size = 2 * len(self.tags)
+        _grow_list(self.tags, size, 0)
+        _grow_list(self.field_a, size, 0)
+        _grow_list(self.field_b, size, 0)
+        _grow_list(self.values, size, 0)
+
+    def application(self, functor, argument):
+        return self.new(APP, functor, argument, 0)
+
+    def param(self):
+        return self.new(PARAM, -1, -1, 0)
+
+    def cons(self, a, b):
+        return self.new(CONS, a, b, 0)
+
+    def integer(self, i):
+        return self.new(INT, -1, -1, i)
+
+    def value(self, ptr):
+        self.objects.append(ptr)
+        return self.new(VALUE, -1, -1, len(self.objects) - 1)
+
+    def func(self, code):
+        assert code.store is self
+        return self.new(FUNC, -1, -1, code.store_number)
+
+    def add_code(self, code):
+        """
+        Keep code for the FUNC nodes of the store to refer to, returning its
+        number.
+        """
+        self.codes.append(code)
+        return len(self.codes) - 1
+
+    def load(self, root):
+        """
+        Copy the graph under the NodePtr root into the store, returning the
+        index of its root node. Pointers shared in the original graph are
+        shared in the copy, and with anything loaded before.
+        """
+        todo = []
+        result = self._load_ptr(root, todo)
+        while todo:
+            ptr = todo.pop()
+            index = self.indices[ptr]
+            node = ptr.node
+            if isinstance(node, ApplicationNode):
+                self.field_a[index] = self._load_ptr(node.functor, todo)
+                self.field_b[index] = self._load_ptr(node.argument, todo)
+            elif isinstance(node, ConsNode):
+                self.field_a[index] = self._load_ptr(node.a, todo)
+                self.field_b[index] = self._load_ptr(node.b, todo)
+        return result
+
+    def _load_ptr(self, ptr, todo):
+        # Return the index of the node for ptr, making it if necessary. Nodes
+        # with children are put in todo to have their fields filled in.
+        if isinstance(ptr.node, IndirectionNode):
+            ptr = ptr.follow()
+        ptr = _lower(ptr)
+        index = self.indices.get(ptr, -1)
+        if index >= 0:
+            return index
+
+        node = ptr.node
+        if isinstance(node, ApplicationNode):
+            index = self.application(-1, -1)
+            todo.append(ptr)
+        elif isinstance(node, LambdaNode):
+            code = compile_lambda(ptr)
+            if code.free_vars:
+                # a parameter of a lambda that isn't in the graph
+                raise Unsupported
+            code.bind(self)
+            # (loading the code's constants may have loaded the lambda
+            # already, if it's recursive)
+            index = self.indices.get(ptr, -1)
+            if index < 0:
+                index = self.func(code)
+        elif isinstance(node, ConsNode):
+            index = self.cons(-1, -1)
+            todo.append(ptr)
+        elif isinstance(node, ParameterNode):
+            index = self.param()
+        elif isinstance(node, IntNode):
+            index = self.integer(node.intval)
+        elif isinstance(node, PrimitiveNode):
+            index = self.value(ptr)
+        elif isinstance(node, FixfindNode):
+            index = self.new(FIX, -1, -1, 0)
+        elif isinstance(node, BlackholeNode):
+            index = self.new(HOLE, -1, -1, 0)
+        else:
+            index = self.new(PRIM, -1, -1, self._builtin_op(node))
+        self.indices[ptr] = index
+        return index
+
+    def _builtin_op(self, node):
+        if isinstance(node, SelectorNode):
+            if node.field == 0:
+                return OP_FST
+            elif node.field == 1:
+                return OP_SND
+            else:
+                return OP_ID
+        elif isinstance(node, UnaryBuiltinNode):
+            if node.arg0 is None:
+                for func, op in _unary_ops:
+                    if node.func is func:
+                        return op
+        elif isinstance(node, BinaryBuiltinNode):
+            if node.arg0 is None and node.arg1 is None:
+                for func, op in _binary_ops:
+                    if node.func is func:
+                        return op
+        elif isinstance(node, TernaryBuiltinNode):
+            if node.arg0 is None and node.arg1 is None and node.arg2 is None:
+                for func, op in _ternary_ops:
+                    if node.func is func:
+                        return op
+        elif isinstance(node, OverloadNode):
+            if not node.args:
+                for overload, op in _overload_ops:
+                    if node.overload is overload:
+                        return op
+        raise Unsupported
+
+    def reduce(self, index):
+        """
+        Reduce the node at index to weak head normal form, in place.
+        """
+        tag = self.tags[index]
+        if tag == APP:
+            self.reduce_application(index)
+        elif tag == HOLE:
+            raise LoopError
+
+    def reduce_application(self, index):
+        # This works like NodePtr.reduce_application: the node being reduced
+        # is black-holed, and the reduction goes one step at a time in a loop.
+        # The current state of the node is kept in locals until it's done.
+        tag = APP
+        a = self.field_a[index]
+        b = self.field_b[index]
+        value = 0
+        self.tags[index] = HOLE
+
+        # nodes whose reduction has been taken over by this one; see below
+        others = None
+
+        # The compiled function that the next step will call, if any. Loops
+        # in Fundy programs are tail calls back to the same function, so this
+        # is what the JIT looks at to find them.
+        code = self.next_code(a)
+
+        try:
+            while tag == APP:
+                jitdriver.jit_merge_point(code=code, self=self, index=index,
+                                          tag=tag, a=a, b=b, value=value,
+                                          others=others)
+                functor = a
+                argument = b
+                self.reduce(functor)
+                ftag = self.tags[functor]
+                result = -1
+
+                if ftag == FIX:
+                    # Y f = f (Y f), and this node is Y f. This ties the knot
+                    # instead of copying f the way FixfindNode does.
+                    a = argument
+                    b = index
+                elif ftag == PRIM or ftag == FUNC or ftag == PARTIAL:
+                    count = 1
+                    head = functor
+                    while self.tags[head] == PARTIAL:
+                        count += 1
+                        head = self.field_a[head]
+                    op = self.values[head]
+                    if self.tags[head] == FUNC:
+                        arity = self.codes[op].arity
+                    else:
+                        arity = ARITY[op]
+
+                    if count < arity:
+                        tag = PARTIAL
+                        a = functor
+                        b = argument
+                        value = count
+                    else:
+                        args = [0] * count
+                        args[count - 1] = argument
+                        p = functor
+                        for i in range(count - 2, -1, -1):
+                            args[i] = self.field_b[p]
+                            p = self.field_a[p]
+                        if self.tags[head] == FUNC:
+                            result = self.run(self.codes[op], args)
+                        else:
+                            result = self.apply_builtin(op, args)
+                            if result < 0:
+                                # the result was an int, left in
+                                # self.int_result
+                                tag = INT
+                                value = self.int_result
+                else:
+                    raise TypeError   # only lambdas and builtins can be applied
+
+                if result >= 0:
+                    # The value of this node is the value of the node at
+                    # result. If that's already been reduced, just copy it.
+                    # Otherwise, reduce it here (so the reduction doesn't need
+                    # more stack, for tail calls), black-holing it as well,
+                    # and give it the same value at the end.
+                    rtag = self.tags[result]
+                    if rtag == HOLE:
+                        raise LoopError
+                    if rtag == APP:
+                        self.tags[result] = HOLE
+                        if others is None:
+                            others = [result]
+                        else:
+                            others.append(result)
+                    tag = rtag
+                    a = self.field_a[result]
+                    b = self.field_b[result]
+                    value = self.values[result]
+
+                if tag == APP:
+                    code = self.next_code(a)
+                    jitdriver.can_enter_jit(code=code, self=self, index=index,
+                                            tag=tag, a=a, b=b, value=value,
+                                            others=others)
+        finally:
+            self.set(index, tag, a, b, value)
+            if others is not None:
+                for i in others:
+                    self.set(i, tag, a, b, value)
+
+    def next_code(self, functor):
+        """
+        Return the Code of the function at the head of the application spine
+        under functor, or None if it isn't a compiled function.
+        """
+        while True:
+            tag = self.tags[functor]
+            if tag == APP or tag == PARTIAL:
+                functor = self.field_a[functor]
+            elif tag == FUNC:
+                return jit.promote(self.codes[self.values[functor]])
+            else:
+                return None
+
+    @jit.unroll_safe
+    def run(self, code, args):
+        """
+        Run code with the arguments args, returning the index of the node
+        with the result.
+        """
+        code = jit.promote(code)
+        regs = [0] * code.nregs
+        for i in range(code.nregs):
+            opcode = code.ops[3 * i]
+            if opcode == I_FUNC:
+                regs[i] = self.func(code.inner[code.ops[3 * i + 1]])
+            else:
+                x = self.fetch(code, code.ops[3 * i + 1], args, regs)
+                y = self.fetch(code, code.ops[3 * i + 2], args, regs)
+                if opcode == I_APP:
+                    tag = APP
+                elif opcode == I_CONS:
+                    tag = CONS
+                else:
+                    tag = PARTIAL
+                regs[i] = self.new(tag, x, y, 0)
+        return self.fetch(code, code.result, args, regs)
+
+    def fetch(self, code, op, args, regs):
+        kind = operand_kind(op)
+        if kind == ARG:
+            return args[operand_index(op)]
+        elif kind == REG:
+            return regs[operand_index(op)]
+        else:
+            return code.const_indices[operand_index(op)]
+
+    def set(self, index, tag, a, b, value):
+        self.tags[index] = tag
+        self.field_a[index] = a
+        self.field_b[index] = b
+        self.values[index] = value
+
+    def apply_builtin(self, op, args):
+        """
+        Do the operation op, returning the index of the node with the result;
+        or -1 if the result is an int, putting it in self.int_result instead.
+        """
+        if op == OP_IF:
+            if self.eq(args[0], self.true_index):
+                return args[1]
+            return args[2]
+        elif op == OP_EQ:
+            return self.boolean(self.eq(args[0], args[1]))
+        elif op == OP_ID:
+            return args[0]
+        elif op == OP_FST or op == OP_SND:
+            record = args[0]
+            self.reduce(record)
+            if self.tags[record] != CONS:
+                raise TypeError("projection can only be applied to a cons")
+            if op == OP_FST:
+                return self.field_a[record]
+            return self.field_b[record]
+        elif op == OP_AND or op == OP_OR:
+            # both operands are checked, as the builtins check them
+            x = self.get_bool(args[0], op)
+            y = self.get_bool(args[1], op)
+            if op == OP_AND:
+                return self.boolean(x and y)
+            return self.boolean(x or y)
+        elif op == OP_NEG:
+            self.int_result = -1 * self.get_int(args[0], op)
+        elif op == OP_ADD and not (self.is_int(args[0]) and
+                                   self.is_int(args[1])):
+            # + is overloaded, so operands fitting neither definition are
+            # reported as the object graph's overloads report them
+            if not (self.is_string(args[0]) and self.is_string(args[1])):
+                raise TypeError(no_definition(OP_NAMES[op]))
+            s = self.get_string(args[0], op) + self.get_string(args[1], op)
+            return self.value(StrPtr(s))
+        else:
+            x = self.get_int(args[0], op)
+            y = self.get_int(args[1], op)
+            if op == OP_ADD:
+                self.int_result = x + y
+            elif op == OP_SUB:
+                self.int_result = x - y
+            elif op == OP_MUL:
+                self.int_result = x * y
+            else:
+                self.int_result = x // y
+        return -1
+
+    def is_int(self, index):
+        self.reduce(index)
+        return self.tags[index] == INT
+
+    def get_int(self, index, op):
+        if not self.is_int(index):
+            raise TypeError(bad_argument(OP_NAMES[op], 'int'))
+        return self.values[index]
+
+    def is_string(self, index):
+        self.reduce(index)
+        return self.tags[index] == VALUE and \
+               isinstance(self.objects[self.values[index]].node, StringNode)
+
+    def get_string(self, index, op):
+        if not self.is_string(index):
+            raise TypeError(bad_argument(OP_NAMES[op], 'string'))
+        node = self.objects[self.values[index]].node
+        assert isinstance(node, StringNode)
+        return node.strval
+
+    def get_bool(self, index, op):
+        self.reduce(index)
+        if self.tags[index] == VALUE:
+            node = self.objects[self.values[index]].node
+            if node is bool_true.node:
+                return True
+            elif node is bool_false.node:
+                return False
+        raise TypeError(bad_argument(OP_NAMES[op], 'bool'))
+
+    def boolean(self, b):
+        if b:
+            return self.true_index
+        return self.false_index
+
+    def eq(self, left, right):
+        """
+        Compare the values at two indices, like pyops.eq.
+        """
+        if left == right:
+            return True
+
+        self.reduce(left)
+        self.reduce(right)
+        tag = self.tags[left]
+        if self.tags[right] != tag:
+            raise TypeError("cannot compare values of different types for "
+                            "equality")
+
+        if tag == INT:
+            return self.values[left] == self.values[right]
+        elif tag == VALUE:
+            return eq(self.objects[self.values[left]],
+                      self.objects[self.values[right]])
+        elif tag == CONS:
+            return self.eq(self.field_a[left], self.field_a[right]) and \
+                   self.eq(self.field_b[left], self.field_b[right])
+        else:
+            raise TypeError("Can't compare non-value types for equality")
+
+    def to_string(self, index):
+        tag = self.tags[index]
+        if tag == INT:
+            return str(self.values[index])
+        elif tag == VALUE:
+            return self.objects[self.values[index]].node.to_string()
+        elif tag == CONS:
+            return self.to_string(self.field_a[index]) + " . " + \
+                   self.to_string(self.field_b[index])
+        else:
+            raise NotImplementedError
+
+
+class SoAOptions(object):
+    """
+    Whether print statements should evaluate their expressions in a
+    GraphStore rather than in the object graph.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, enabled=False):
+        self.enabled = enabled
+
+    def evaluate(self, graph):
+        """
+        Evaluate graph in a new GraphStore, returning the string form of its
+        value, or None if it can't be loaded into a GraphStore.
+        """
+        store = GraphStore()
+        try:
+            index = store.load(graph)
+        except Unsupported:
+            return None
+        store.reduce(index)
+        return store.to_string(index)
+
+soa_options = SoAOptions()
@@ -28,6 +28,13 @@ def target(driver, args):
     from interactive import main
     from utils import preparer
     preparer.prepare(for_translation=True)
-    driver.exe_name = 'fundy-%(backend)s'
+    if driver.config.translation.jit:
+        driver.exe_name = 'fundy-%(backend)s-jit'
+    else:
+        driver.exe_name = 'fundy-%(backend)s'
     print args
     return main, None
+
+def jitpolicy(driver):
+    from rpython.jit.codewriter.policy import JitPolicy
+    return JitPolicy()
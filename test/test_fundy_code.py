@@ -27,13 +27,17 @@ import py
 
 
 class Snippet(object):
-    def __init__(self, code, expect='', err_expect=''):
+    def __init__(self, code, expect='', err_expect='', args=(), raises=None):
         self.code = code
         self.expect = expect
         self.err_expect = err_expect
+        self.args = args
+        # the exception class the snippet should end with, if any (this can't
+        # be checked on the translated interpreter)
+        self.raises = raises
 
     def test(self, interpreter):
-        ret, out, err , exc, tb = interpreter.run_code(self.code)
+        ret, out, err , exc, tb = interpreter.run_code(self.code, self.args)
 
         out = out.strip()
         err = err.strip()
@@ -62,7 +66,9 @@ class Snippet(object):
         # it until here was so that the IO capture could be reset and what
         # output was produced is printed, otherwise any debug prints would be
         # swallowed if an exception occurs.
-        if exc is not None:
+        if self.raises is not None:
+            assert isinstance(exc, self.raises)
+        elif exc is not None:
             raise exc, None, tb
 
         assert out == expect
@@ -109,7 +115,10 @@ class Snippet(object):
 
 
     def __repr__(self):
-        if self.err_expect:
+        if self.args:
+            return 'Snippet(%r, %r, %r, %r)' % \
+                (self.code, self.expect, self.err_expect, self.args)
+        elif self.err_expect:
             return 'Snippet(%r, %r, %r)' % \
                 (self.code, self.expect, self.err_expect)
         elif self.expect:
@@ -170,6 +179,29 @@ print plus2 100
 102
 ''').make_tests()
 
+# Names bound in a local scope hide the outer ones only inside it.
+test_scopes = Snippet('''
+x = 1
+def f y:
+    x = y + 10
+    def g z:
+        return x + z
+    return g x
+print f 1, x
+''', '''
+22
+1
+''').make_tests()
+
+# Check that long chains of operators resolve correctly.
+test_long_expression = Snippet('''
+print %s
+print %s
+''' % (' + '.join(['2 * 3'] * 100), ' - '.join(['1'] * 100)), '''
+600
+-98
+''').make_tests()
+
 # Check that typeswitch works as expected.
 test_typeswitch = Snippet('''
 i = 3
@@ -200,6 +232,30 @@ char
 string
 ''').make_tests()
 
+# Typeswitches look up the case to take in a table built as the cases are
+# needed; the first matching case must still win, and every instantiation of a
+# typeswitch (here one per recursive call) must agree on the answer.
+test_typeswitch_dispatch = Snippet('''
+def kind thing:
+    return typeswitch thing:
+        case string return 1
+        case int return 2
+        case int return 3
+        case bool return 4
+
+def count n:
+    return if (0 == n) 0 ((kind n) + (kind (0 == n)) + (count (n - 1)))
+
+print count 3
+print kind "foo"
+print kind 7
+''',
+'''
+18
+1
+2
+''').make_tests()
+
 # Typeswitches had some odd effects on the parser's ability to keep track of
 # where semicolons should be inserted at one point. This exercises the parser
 # (very slightly) more than the previous test.
@@ -298,3 +354,363 @@ fac n = if (0 == n)
            (n * (fac (n - 1)))
 ''' + '\n'.join(['fac %d' % i for i in fac_args]),
 '\n'.join([str(fac(i)) for i in fac_args])).make_tests()
+
+# The same program must give the same results at every optimisation level.
+fac_code = '''
+fac n = if (0 == n)
+           1
+           (n * (fac (n - 1)))
+print fac 6
+'''
+test_O0 = Snippet(fac_code, '720', args=['-O0']).make_tests()
+test_O1 = Snippet(fac_code, '720', args=['-O1']).make_tests()
+test_O2 = Snippet(fac_code, '720', args=['-O2']).make_tests()
+
+test_bad_opt_level = Snippet('print 1', '',
+                             'Error: unknown optimisation level "-O7"',
+                             args=['-O7']).make_tests()
+
+# Type inference (-O2) must not change results, whether or not it can prove
+# anything about a definition; typeswitch results and parameters are never
+# assumed to have the types inferred for them.
+test_infer_types = Snippet('''
+f x = x + 1
+def h n:
+    return if (0 == n) 10 ((h (n - 1)) + 1)
+def dyn thing:
+    return typeswitch thing:
+        case int return 4
+        case string return "s"
+k = 1 + (dyn 3)
+def bad n:
+    return if (0 == n) "s" ((bad (n - 1)) + 1)
+print f 2, h 5, k, bad 0
+''', '''
+3
+15
+5
+s
+''', args=['-O2']).make_tests()
+
+# Memoised functions; fib 60 would never finish without the memo table, and
+# with a table of only 4 entries the evictions must not change the results.
+memo_code = '''
+@memo
+def fib n:
+    return if (n == 0) 0 (if (n == 1) 1 ((fib (n - 1)) + (fib (n - 2))))
+
+@memo choose n k = if (k == 0) 1 (if (n == k) 1 ((choose (n - 1) (k - 1)) + (choose (n - 1) k)))
+
+square x = x * x
+msquare = memo square
+print fib 60, choose 20 10, msquare 12, msquare 12
+'''
+memo_expect = '''
+1548008755920
+184756
+144
+144
+'''
+test_memo = Snippet(memo_code, memo_expect).make_tests()
+test_memo_small = Snippet(memo_code, memo_expect,
+                          args=['--memo-size=4']).make_tests()
+
+test_memo_lazy = Snippet(memo_code, memo_expect,
+                         args=['--lazy-defs']).make_tests()
+
+test_memo_stats = Snippet('''
+@memo
+def fib n:
+    return if (n == 0) 0 (if (n == 1) 1 ((fib (n - 1)) + (fib (n - 2))))
+print fib 10
+''', '55', '''
+memo tables:
+    fib: 11/1024 entries, 8 hits, 11 misses, 0 evictions
+''', args=['--memo-stats']).make_tests()
+
+# With a budget for the values of top level constants, big gets reverted after
+# each print and worked out again, without changing any results.
+caf_code = '''
+data List = Nil | Cons x xs
+def upto n:
+    return if (n == 0) Nil (Cons n (upto (n - 1)))
+def nth n l:
+    return if (n == 0) (fst l) (nth (n - 1) (snd l))
+big = upto 50
+small = 3 * 7
+print nth 40 big, small
+print nth 45 big, small
+'''
+caf_expect = '''
+10
+21
+5
+21
+'''
+test_caf_budget = Snippet(caf_code, caf_expect, '''
+CAFs (budget 100 nodes): 2 reversions
+    big: 0 nodes now, reverted 2 times
+''', args=['--caf-budget=100', '--caf-stats']).make_tests()
+test_caf_no_budget = Snippet(caf_code, caf_expect).make_tests()
+
+# A CAF whose name has been rebound no longer counts against the budget, so
+# it can't get the live ones reverted.
+test_caf_budget_rebound = Snippet('''
+data List = Nil | Cons x xs
+def upto n:
+    return if (n == 0) Nil (Cons n (upto (n - 1)))
+def nth n l:
+    return if (n == 0) (fst l) (nth (n - 1) (snd l))
+xs = upto 30
+print nth 25 xs
+xs = upto 20
+ys = upto 30
+print nth 25 ys
+print nth 15 xs, nth 25 ys
+''', '''
+5
+5
+5
+5
+''', '''
+CAFs (budget 150 nodes): 0 reversions
+''', args=['--caf-budget=150', '--caf-stats']).make_tests()
+
+test_bad_pragma = Snippet('''
+@memo
+x = 1
+''', '', 'Error: @memo can only be used on functions, not "x"').make_tests()
+
+# + is overloaded for ints and strings. Each use of it remembers the
+# definitions it has chosen, so the recursive calls in sum only search once.
+test_overloads = Snippet('''
+def twice x:
+    return x + x
+def sum n:
+    return if (n == 0) 0 (n + (sum (n - 1)))
+print 1 + 2, "ab" + "cd", twice 4, twice "ha", sum 10
+''', '''
+3
+abcd
+8
+haha
+55
+''', '''
+overloads:
+    +: 14 calls at 4 uses (3 monomorphic, 1 polymorphic, 0 megamorphic), \
+9 inline cache hits (64%), 5 table lookups, 2 searches
+''', args=['--dispatch-stats']).make_tests()
+
+# With lazy definitions, a definition that is never used is never built (so
+# its unbound name goes unnoticed), and the ones that are used still see what
+# their names meant when they were defined.
+test_lazy_defs = Snippet('''
+x = 1
+y = x + 1
+unused = no_such_name
+x = 10
+def f n:
+    return n + y
+data T = A | B
+A = 3
+print f x, y, A
+''', '''
+12
+2
+3
+''', args=['--lazy-defs']).make_tests()
+
+# Building a pending definition when something it mentions is rebound doesn't
+# undo a later binding of its own name.
+test_lazy_defs_rebound = Snippet('''
+a = 5
+x = a
+x = 7
+a = 6
+print x
+''', '''
+7
+''', args=['--lazy-defs']).make_tests()
+
+# Constructor values carry their constructor, which typeswitch can match as
+# well as the data type. fst and snd split the fields in the middle, and both
+# halves of a value with one field are that field.
+test_constructors = Snippet('''
+data Shape = Circle r | Rect w h | Dot
+data Box = Box x
+def area s:
+    return typeswitch s:
+        case Circle return 3 * (fst s) * (fst s)
+        case Rect return (fst s) * (snd s)
+        case Dot return 0
+def kind s:
+    return typeswitch s:
+        case int return "int"
+        case Shape return "shape"
+print area (Circle 2), area (Rect 3 4), area Dot
+print kind Dot, kind (Rect 1 2), kind 5
+print Rect 1 2, Dot, (Rect 1 2) == (Rect 1 2), (Rect 1 2) == (Rect 2 1)
+print fst (Box (Rect 5 6))
+''', '''
+12
+12
+0
+shape
+shape
+int
+1 . 2
+Dot
+true
+false
+5 . 6
+''').make_tests()
+
+# A value that depends on itself can never be evaluated; that must be reported
+# as soon as it is detected instead of running forever (or until the stack
+# runs out). Later statements still run in the interactive interpreter, but in
+# a script the error ends the program.
+test_loop = Snippet('''
+print 1
+x = x + 1
+print x
+print 2
+''', '1', 'Error: <<loop>>').make_tests()
+
+test_indirection_loop = Snippet('''
+x = if (1 == 1) x 0
+print 1
+print x
+''', '1', 'Error: <<loop>>').make_tests()
+
+test_memo_loop = Snippet('''
+@memo f n = f n
+print f 3
+''', '', 'Error: <<loop>>').make_tests()
+
+# fst and snd project the components out of constructor values (which are
+# trees of cons cells). Projections whose record is evaluated by something
+# else before they are forced are done early, by the reducer; that must give
+# the same results as doing them when they're forced.
+test_projection = Snippet('''
+data Pair = Pair a b
+data Rec = Rec a b c d
+data Five = Five a b c d e
+p = Pair 1 "two"
+r = Rec 1 2 3 4
+v = Five 5 6 7 8 9
+print fst p, snd p
+print fst (fst r), snd (fst r), fst (snd r), snd (snd r)
+print fst (snd v), fst (snd (snd v)), snd (snd (snd v)), snd (snd v)
+def early q:
+    t = Pair (fst (fst q)) (q == (Rec 1 2 3 4))
+    return if (snd t) (fst t) 0
+print early r
+''', '''
+1
+two
+1
+2
+3
+4
+7
+8
+9
+8 . 9
+1
+''').make_tests()
+
+# Evaluating in the array graph store must give the same results as the
+# object graph, including for things it can't load (the typeswitch).
+test_soa_graph = Snippet('''
+data Pair = Pair a b
+fac n = if (0 == n)
+           1
+           (n * (fac (n - 1)))
+def sum n acc:
+    return if (0 == n) acc (sum (n - 1) (acc + n))
+def swap p:
+    return Pair (snd p) (fst p)
+print fac 6, sum 100 0
+print fst (swap (Pair 1 'c'))
+print (Pair 1 2) == (swap (Pair 2 1)), neg 3, 7 / 2
+print typeswitch 1:
+    case int return "int"
+x = x + 1
+print x
+''', '''
+720
+5050
+c
+true
+-3
+3
+int
+''', 'Error: <<loop>>', args=['--graph=soa']).make_tests()
+
+# Likewise for compiling to Python code, which can only be done on top of
+# CPython, including closures over the parameters of enclosing functions.
+test_closure_graph = Snippet('''
+data Pair = Pair a b
+fac n = if (0 == n)
+           1
+           (n * (fac (n - 1)))
+def sum n acc:
+    return if (0 == n) acc (sum (n - 1) (acc + n))
+def adder n:
+    def add m:
+        return n + m
+    return add
+def twice f x:
+    return f (f x)
+add3 = adder 3
+print fac 6, sum 100 0
+print twice add3 1, twice (adder 10) 1, twice (* 2) 5
+print fst (Pair 1 'c'), (Pair 1 2) == (Pair 1 2), neg 3, 7 / 2
+print if (1 == 1) "yes" "no"
+print typeswitch 1:
+    case int return "int"
+x = x + 1
+print x
+''', '''
+720
+5050
+7
+21
+20
+1
+true
+-3
+3
+yes
+int
+''', 'Error: <<loop>>', args=['--graph=closures']).make_tests(
+        no_rpython=True, no_translated=True)
+
+# and and or check that both their operands are bools, whichever graph runs
+# them, even when the first operand decides the answer.
+test_and_checks_types = Snippet('print false and 1', raises=TypeError
+        ).make_tests(no_translated=True)
+test_and_checks_types_soa = Snippet('print false and 1', raises=TypeError,
+        args=['--graph=soa']).make_tests(no_translated=True)
+test_and_checks_types_closures = Snippet('print false and 1',
+        raises=TypeError, args=['--graph=closures']).make_tests(
+        no_rpython=True, no_translated=True)
+test_or_checks_types = Snippet('print true or 1', raises=TypeError
+        ).make_tests(no_translated=True)
+test_or_checks_types_soa = Snippet('print true or 1', raises=TypeError,
+        args=['--graph=soa']).make_tests(no_translated=True)
+test_or_checks_types_closures = Snippet('print true or 1', raises=TypeError,
+        args=['--graph=closures']).make_tests(no_rpython=True,
+                                              no_translated=True)
+
+test_add_checks_types = Snippet('print 1 + "a"', raises=TypeError
+        ).make_tests(no_translated=True)
+test_add_checks_types_soa = Snippet('print 1 + "a"', raises=TypeError,
+        args=['--graph=soa']).make_tests(no_translated=True)
+test_add_checks_types_closures = Snippet('print 1 + "a"', raises=TypeError,
+        args=['--graph=closures']).make_tests(no_rpython=True,
+                                              no_translated=True)
+
+test_closure_graph_translated = Snippet('print 1', '',
+        'Error: --graph=closures is not available in the translated '
+        'interpreter', args=['--graph=closures']).make_tests(no_cpython=True)
@@ -0,0 +1,176 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests of the on-disk cache of the tables built from the grammar, and of the
+deterministic parser in llparse.py against the PackratParser generated from
+the grammar.
+"""
+
+import imp
+
+import py
+
+from rpython.rlib.parsing.parsing import ParseError
+
+
+sample = '''
+data Shape = Circle r | Rect w h
+def area s:
+    return typeswitch s:
+        case Circle return 3 * (fst s) * (fst s)
+        case Rect return (fst s) * (snd s)
+print area (Rect 3 4), "done", ['a', 'b']
+'''
+
+def test_cached_tables_parse_the_same():
+    from fundyparse import (get_grammar, make_lexer, write_parser_tables,
+                            make_messy_parse_function, process_indentation)
+
+    regexes, rules, ToAST = get_grammar(False)
+    lexer = make_lexer(regexes, rules)
+    cachefile = py.test.ensuretemp('grammar-cache').join('grammar_test.py')
+    write_parser_tables(cachefile, lexer, rules, ToAST)
+    cached = imp.load_source('fundy_grammar_test', str(cachefile))
+
+    trees = []
+    for lexer, rules, ToAST in [(lexer, rules, ToAST),
+                                (cached.lexer, cached.rules, cached.ToAST)]:
+        parse = make_messy_parse_function(lexer, rules, eof=True,
+                                          post_lexer=process_indentation)
+        trees.append(repr(ToAST().transform(parse(sample))))
+    assert trees[0] == trees[1]
+    assert cached.rules == rules
+
+
+everything = sample + '''
+print 1, "a", 'c', [1, 2 : xs], [], {}, {1,}, {1, 2, 3}, ?x, (f x) y
+@memo
+@ other
+f x y = x + y
+def g a:
+    h = a
+    @memo
+    k b = b
+    data T = A x | B
+    return h
+z = typeswitch x:
+    case Nothing return 0
+    case Just return 1
+;; print x; y
+'''
+
+def test_deterministic_parser_matches_packrat():
+    from fundyparse import parse, make_packrat_parse_function
+
+    packrat_parse = make_packrat_parse_function(False)
+    assert repr(parse(everything)) == repr(packrat_parse(everything))
+
+    for bad in ['f x = \n', '(1\n', 'data = 1\n', '{1 2}\n', 'x = 1 ,\n',
+                '[1 : 2, 3]\n', 'f 1 = 2\n']:
+        errors = []
+        for p in [parse, packrat_parse]:
+            e = py.test.raises(ParseError, p, bad).value
+            errors.append((e.source_pos.i, e.nice_error_message(source=bad)))
+        assert errors[0] == errors[1]
+
+
+def test_statement_reader_cuts_between_statements():
+    from StringIO import StringIO
+    from fundyparse import parse, StatementReader
+
+    reader = StatementReader(StringIO(everything))
+    chunks = []
+    while True:
+        chunk = reader.read_chunk()
+        if chunk is None:
+            break
+        chunks.append(chunk)
+    assert ''.join(chunks) == everything
+    assert len(chunks) == 8
+    assert chunks[0].startswith('\ndata Shape')
+    assert chunks[2].startswith('print area')
+    # the pragmas go with the definition after them
+    assert chunks[4].startswith('@memo\n@ other\nf x y')
+
+    statements = []
+    for chunk in chunks:
+        statements.extend(parse(chunk).children)
+    assert repr(statements) == repr(parse(everything).children)
+
+def test_script_runs_until_parse_error():
+    from interactive import main
+
+    script = py.test.ensuretemp('scripts').join('bad.fy')
+    script.write('print 1\ndef f x:\n    return x + 1\n\nprint f 2\n'
+                 'print (f 3\nprint 4\n')
+    result, out, err = py.io.StdCaptureFD.call(main, ['fundy', script.strpath])
+    assert out.split() == ['1', '3']
+    assert 'line 6\nprint (f 3\n' in err
+
+def test_indentation_filter():
+    from fundyparse import load_parser_tables
+    from lexing import process_indentation, indent_level
+
+    assert indent_level('\n') == 0
+    assert indent_level('\n  \n\t  ') == 6
+    lexer, rules, ToAST = load_parser_tables(False)
+    tokens = process_indentation(lexer.tokenize(
+        'def f x:\n    def g y:\n        return y\n    return g x\nf 1\n',
+        eof=True))
+    tokens = [t for t in tokens if not t.name.startswith('__')]
+    assert [t.name for t in tokens] == [
+        'IDENT', 'IDENT', 'BEGIN', 'IDENT', 'IDENT', 'BEGIN', 'IDENT', 'TERM',
+        'TERM', 'IDENT', 'IDENT', 'TERM', 'TERM', 'IDENT', 'NUMBER', 'TERM',
+        'TERM', 'EOF']
+    # the TERMs for one line break are the same token
+    assert tokens[7] is tokens[8]
+
+tricky = '''x = "a \\" \\\\ \\n 'q' #{}" ++ 'c' '\\'' '"' ?a+b?c 12ab a.b \\
+    !== @@ | || = @ ,(a)[b]{c} ;: # comment \\
+\tprint printx data_ return1 _x\t \n\n  \t\n\t y
+'''
+
+def test_lexer_matches_grammar_lexer():
+    from fundyparse import load_parser_tables, grammar_keywords
+    from lexing import Lexer, LexerTokens
+    from llparse import kind_of
+    from rpython.rlib.parsing.deterministic import LexerError
+
+    lexer, rules, ToAST = load_parser_tables(False)
+    keywords = grammar_keywords(lexer)
+    for text in [everything, tricky]:
+        tokens = []
+        for source in [Lexer(text, keywords), LexerTokens(lexer, text)]:
+            tokens.append([])
+            while True:
+                token = source.next_token()
+                pos = source.source_pos(token)
+                tokens[-1].append((kind_of(token), token.source, pos.i))
+                if token.name == 'EOF':
+                    break
+        assert tokens[0] == tokens[1]
+
+    def lex_all(source):
+        while source.next_token().name != 'EOF':
+            pass
+
+    for bad in ['"abc', "''", "'ab'", '"\\q"', '?', 'a < b', 'x \\ y', '\r']:
+        py.test.raises(LexerError, lex_all, Lexer(bad, keywords))
+        py.test.raises(LexerError, lex_all, LexerTokens(lexer, bad))
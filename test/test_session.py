@@ -0,0 +1,113 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests of keeping track of top level bindings at the interactive console.
+"""
+
+import py
+
+from rpython.rlib.streamio import open_file_as_stream
+
+
+def interact(lines):
+    """
+    Return the stdout and stderr of typing lines into a new console (without
+    the prompts).
+    """
+    from interactive import FundyConsole
+
+    infile = py.test.ensuretemp('session').join('input')
+    infile.write('\n'.join(lines) + '\n')
+
+    def run():
+        console = FundyConsole()
+        console.stdin = open_file_as_stream(infile.strpath, mode='rU')
+        console.interact(banner='')
+
+    result, out, err = py.io.StdCaptureFD.call(run)
+    return out.replace('|> ', '').replace('.. ', '').split(), err
+
+def test_redefinition_remakes_dependents():
+    out, err = interact([
+        'x = 1',
+        'y = x + 1',
+        'z = y * 10',
+        'w = 5',
+        'print z, w',
+        'x = 2',
+        'print z, w',
+        ':stats',
+    ])
+    assert out == ['20', '5', '30', '5']
+    assert '4 top level bindings, 2 remade after redefinitions' in err
+    # z and w miss the first time; after x changes, z misses again but w's
+    # value is still there
+    assert 'CAF cache: 1 hits, 3 misses' in err
+
+def test_script_definitions_unchanged():
+    from interactive import FundyConsole
+    def run():
+        console = FundyConsole()
+        console.runsource('x = 1\ny = x\nx = 2\nprint y\n')
+    result, out, err = py.io.StdCaptureFD.call(run)
+    assert out.strip() == '1'
+
+def test_multiline_input():
+    out, err = interact([
+        'def f x:',
+        '    y = x + 1',
+        '    return y * 2',
+        '',
+        'def g x:',
+        '    return typeswitch x:',
+        '        case int return 1',
+        '        case char return 2',
+        '',
+        'z = (f',
+        '     3)',
+        'print z, \\',
+        '    g 5, g \'c\'',
+        'print f 1',
+    ])
+    assert out == ['8', '1', '2', '4']
+    assert err.strip() == ''
+
+def test_rebinding_frees_inferred_definitions():
+    # type inference (at -O2) mustn't keep rebound definitions alive
+    import gc
+    import weakref
+    from interactive import FundyConsole
+    from passes import pass_manager
+
+    refs = []
+    def run():
+        console = FundyConsole()
+        console.runsource('def upto n:\n'
+                          '    return if (n == 0) 0 (upto (n - 1))\n')
+        for i in range(5):
+            console.runsource('xs = upto 40\nprint xs\n')
+            refs.append(weakref.ref(console.asteval.context.lookup('xs')))
+    pass_manager.reset(2)
+    try:
+        py.io.StdCaptureFD.call(run)
+    finally:
+        pass_manager.reset()
+    gc.collect()
+    assert [ref() is None for ref in refs] == [True] * 5
@@ -0,0 +1,553 @@
+#
+#   Copyright 2009 Benjamin Mellor
+#
+#   This file is part of Fundy.
+#
+#   Fundy is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Static type inference over the graphs of Fundy definitions, used to replace
+calls of typechecking builtins with unchecked versions where that is safe.
+
+Inference is ordinary Hindley-Milner: each definition is inferred as it is
+bound, and closed definitions are generalised so later definitions can use
+them polymorphically. Fundy is dynamically typed though, so two extra things
+are needed:
+
+- typeswitch is an escape hatch; its result is given a fresh unconstrained
+  type variable, so anything at all can be done with it.
+
+- A call of an overloaded name is inferred as a call of the first of its
+  definitions that the argument types inferred so far allow. That is only the
+  definition that will be called if the arguments are trusted (see below), so
+  only then is the call rewritten to call it directly.
+
+- A function's parameters are not proven to have the types inferred for them,
+  since a caller that doesn't typecheck can still call it. So an argument's
+  typecheck is only removed when the argument is "trusted": its value can only
+  come from literals, builtin results, trusted returns of (possibly recursive)
+  definitions, or ifs choosing between trusted values. The types of trusted
+  values are determined entirely by things inference can see, so if inference
+  of the whole definition succeeds they really have the inferred types.
+"""
+
+from rpython.rlib.rweakref import RWeakKeyDictionary
+
+from graph import (NodePtr, ApplicationNode, LambdaNode, ParameterNode, ConsNode,
+                   PrimitiveNode, TypeswitchNode, Y)
+from pyops import OverloadNode, signatures, if_ptr, eq_ptr
+from passes import Pass, pass_manager
+
+
+class TypeClash(Exception):
+    pass
+
+
+class Type(object):
+    def prune(self):
+        """
+        Return the type this type currently stands for, following (and
+        shortening) the chain of bound type variables.
+        """
+        return self
+
+    def occurs(self, var):
+        raise NotImplementedError
+
+    def copy(self, mapping):
+        raise NotImplementedError
+
+    def free_vars(self, acc):
+        raise NotImplementedError
+
+    def __repr__(self):
+        """
+        NOT_RPYTHON:
+        """
+        return 'TYPE'
+
+
+class TypeVar(Type):
+    def __init__(self):
+        self.instance = None
+
+    def prune(self):
+        if self.instance is None:
+            return self
+        self.instance = self.instance.prune()
+        return self.instance
+
+    def occurs(self, var):
+        return self is var
+
+    def copy(self, mapping):
+        if self in mapping:
+            return mapping[self]
+        return self
+
+    def free_vars(self, acc):
+        if self not in acc:
+            acc.append(self)
+
+    def __repr__(self):
+        """
+        NOT_RPYTHON:
+        """
+        if self.instance is not None:
+            return repr(self.prune())
+        return 't%d' % (id(self) % 1000)
+
+
+class TypeCon(Type):
+    """
+    A type constructor applied to argument types. Function types are named
+    '->', cons types '.', and primitive types by their Fundy names.
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def occurs(self, var):
+        for a in self.args:
+            if a.prune().occurs(var):
+                return True
+        return False
+
+    def copy(self, mapping):
+        if not self.args:
+            return self
+        return TypeCon(self.name, [a.prune().copy(mapping) for a in self.args])
+
+    def free_vars(self, acc):
+        for a in self.args:
+            a.prune().free_vars(acc)
+
+    def __repr__(self):
+        """
+        NOT_RPYTHON:
+        """
+        if not self.args:
+            return self.name
+        elif len(self.args) == 2:
+            return '(%r %s %r)' % (self.args[0], self.name, self.args[1])
+        return '%s(%s)' % (self.name, ', '.join(map(repr, self.args)))
+
+
+def Function(arg, ret):
+    return TypeCon('->', [arg, ret])
+
+
+def unify(a, b):
+    a = a.prune()
+    b = b.prune()
+    if a is b:
+        return
+    if isinstance(a, TypeVar):
+        if b.occurs(a):
+            raise TypeClash
+        a.instance = b
+    elif isinstance(b, TypeVar):
+        unify(b, a)
+    else:
+        assert isinstance(a, TypeCon) and isinstance(b, TypeCon)
+        if a.name != b.name or len(a.args) != len(b.args):
+            raise TypeClash
+        for i in range(len(a.args)):
+            unify(a.args[i], b.args[i])
+
+
+class Scheme(object):
+    """
+    A type with some of its type variables universally quantified.
+    """
+    def __init__(self, quantified, type):
+        self.quantified = quantified
+        self.type = type
+
+    def instantiate(self):
+        if not self.quantified:
+            return self.type
+        mapping = {}
+        for v in self.quantified:
+            mapping[v] = TypeVar()
+        return self.type.prune().copy(mapping)
+
+
+def generalise(type):
+    quantified = []
+    type.prune().free_vars(quantified)
+    return Scheme(quantified, type)
+
+
+class DefInfo(object):
+    """
+    What is known about a definition that has already been through inference:
+    its type scheme, how many parameters it has, and whether its result is
+    trusted once it has been given them all.
+    """
+    def __init__(self, scheme, arity, trusted):
+        self.scheme = scheme
+        self.arity = arity
+        self.trusted = trusted
+
+
+class RecInfo(object):
+    """
+    As DefInfo, for the recursion marker of a definition being inferred.
+    """
+    def __init__(self, type, arity, trusted):
+        self.type = type
+        self.arity = arity
+        self.trusted = trusted
+
+
+class Rewrite(object):
+    def __init__(self, app, functor):
+        self.app = app
+        self.functor = functor
+
+    def apply(self):
+        self.app.functor = self.functor
+
+
+# Definitions inferred so far, keyed by their graph pointers. The pointers are
+# only weakly referenced, so that a definition that is no longer bound (and
+# whatever value it has been evaluated to) isn't kept alive by having been
+# inferred.
+_definitions = RWeakKeyDictionary(NodePtr, DefInfo)
+
+# Type variables for parameters that were free in a definition (because it was
+# local to a function), so the function's own inference uses the same ones.
+# Also weakly keyed, for the same reason.
+_free_params = RWeakKeyDictionary(NodePtr, TypeVar)
+
+def _var_for_param(ptr):
+    var = _free_params.get(ptr)
+    if var is None:
+        var = TypeVar()
+    return var
+
+def _builtin_scheme(sig):
+    type = TypeCon(sig.ret_type, [])
+    for i in range(len(sig.arg_types) - 1, -1, -1):
+        type = Function(TypeCon(sig.arg_types[i], []), type)
+    return Scheme([], type)
+
+def _make_special_schemes():
+    """
+    NOT_RPYTHON: Type schemes for the builtins not defined with OpTable.op.
+    """
+    a = TypeVar()
+    b = TypeVar()
+    c = TypeVar()
+    bool_t = TypeCon('bool', [])
+    return {
+        Y: Scheme([a], Function(Function(a, a), a)),
+        if_ptr: Scheme([b], Function(bool_t, Function(b, Function(b, b)))),
+        eq_ptr: Scheme([c], Function(c, Function(c, bool_t))),
+    }
+
+_special_schemes = _make_special_schemes()
+
+
+def strip_lambdas(ptr):
+    """
+    Return the body under the chain of lambdas at ptr, and how many there are.
+    """
+    arity = 0
+    while isinstance(ptr.node, LambdaNode):
+        arity += 1
+        ptr = ptr.node.body
+    return ptr, arity
+
+def get_spine(ptr):
+    """
+    Return the head of the chain of applications at ptr, a list of the
+    arguments it is applied to, and a list of the application nodes (both in
+    order of application). Does not go past the pointers of definitions that
+    have already been inferred.
+    """
+    args = []
+    apps = []
+    while _definitions.get(ptr) is None and \
+          isinstance(ptr.node, ApplicationNode):
+        app = ptr.node
+        assert isinstance(app, ApplicationNode)
+        apps.append(app)
+        args.append(app.argument)
+        ptr = app.functor
+    args.reverse()
+    apps.reverse()
+    return ptr, args, apps
+
+
+def _overload_of(ptr):
+    node = ptr.node
+    assert isinstance(node, OverloadNode)
+    return node.overload
+
+def _allows(sig, arg_types):
+    """
+    Return whether the builtin with Signature sig could take arguments of the
+    types arg_types, as far as they are known.
+    """
+    for i in range(len(arg_types)):
+        type = arg_types[i].prune()
+        if isinstance(type, TypeCon) and \
+           (type.name != sig.arg_types[i] or type.args):
+            return False
+    return True
+
+
+class Inferencer(object):
+    """
+    Infers the type of one definition, collecting the rewrites to make if it
+    turns out to be well typed.
+    """
+    def __init__(self):
+        self.params = {}
+        self.recs = {}
+        self.rewrites = []
+        self.open = False
+
+    def infer(self, ptr):
+        info = _definitions.get(ptr)
+        if info is not None:
+            return info.scheme.instantiate()
+        if ptr in self.params:
+            return self.params[ptr]
+        if ptr in self.recs:
+            return self.recs[ptr].type
+
+        node = ptr.node
+        if isinstance(node, ApplicationNode):
+            return self.infer_application(ptr)
+        elif isinstance(node, LambdaNode):
+            var = _var_for_param(node.parameter)
+            self.params[node.parameter] = var
+            return Function(var, self.infer(node.body))
+        elif isinstance(node, ParameterNode):
+            # A parameter of a function this is local to.
+            self.open = True
+            var = _var_for_param(ptr)
+            _free_params.set(ptr, var)
+            self.params[ptr] = var
+            return var
+        elif isinstance(node, ConsNode):
+            return TypeCon('.', [self.infer(node.a), self.infer(node.b)])
+        elif isinstance(node, PrimitiveNode):
+            return self.value_type(node)
+
+        sig = signatures.get(ptr, None)
+        if sig is not None:
+            return _builtin_scheme(sig).instantiate()
+        scheme = _special_schemes.get(ptr, None)
+        if scheme is not None:
+            return scheme.instantiate()
+
+        # Nothing is known about this node; it could be anything.
+        return TypeVar()
+
+    def value_type(self, node):
+        types = node.types.list()
+        if len(types) == 1:
+            return TypeCon(types[0].node.to_string(), [])
+        return TypeVar()
+
+    def infer_application(self, ptr):
+        head, args, apps = get_spine(ptr)
+
+        if head is Y and isinstance(args[0].node, LambdaNode):
+            type = self.infer_fix(args[0])
+            first = 1
+        elif isinstance(head.node, TypeswitchNode):
+            ts = head.node
+            assert isinstance(ts, TypeswitchNode)
+            for case in ts.cases:
+                self.infer(case)
+            self.infer(args[0])
+            # the escape hatch: the result of a typeswitch can be anything
+            type = TypeVar()
+            first = 1
+        elif isinstance(head.node, OverloadNode) and \
+             len(args) >= _overload_of(head).arity:
+            overload = _overload_of(head)
+            type = self.infer_overload(overload, args, apps[0])
+            first = overload.arity
+        else:
+            type = self.infer(head)
+            first = 0
+            sig = signatures.get(head, None)
+            if sig is not None and len(args) >= len(sig.arg_types):
+                self.check_builtin_call(sig, args, apps[0])
+
+        for i in range(first, len(args)):
+            ret = TypeVar()
+            unify(type, Function(self.infer(args[i]), ret))
+            type = ret
+        return type
+
+    def infer_fix(self, lambda_ptr):
+        lam = lambda_ptr.node
+        assert isinstance(lam, LambdaNode)
+        var = _var_for_param(lam.parameter)
+        body, arity = strip_lambdas(lam.body)
+
+        # Trust is worked out optimistically: if the body is trusted assuming
+        # recursive calls are, then it is (by induction on the number of
+        # recursive calls made).
+        rec = RecInfo(var, arity, True)
+        self.recs[lam.parameter] = rec
+        rec.trusted = self.is_trusted(body)
+
+        unify(var, self.infer(lam.body))
+        return var
+
+    def infer_overload(self, overload, args, app):
+        n = overload.arity
+        arg_types = [self.infer(args[i]) for i in range(n)]
+        for sig in overload.signatures:
+            if _allows(sig, arg_types):
+                type = _builtin_scheme(sig).instantiate()
+                for i in range(n):
+                    ret = TypeVar()
+                    unify(type, Function(arg_types[i], ret))
+                    type = ret
+                if self.all_trusted(args, n):
+                    self.rewrites.append(Rewrite(app, sig.get_variant(0)))
+                return type
+        raise TypeClash
+
+    def all_trusted(self, args, n):
+        for i in range(n):
+            if not self.is_trusted(args[i]):
+                return False
+        return True
+
+    def check_builtin_call(self, sig, args, app):
+        mask = 0
+        for i in range(len(sig.arg_types)):
+            if not self.is_trusted(args[i]):
+                mask |= 1 << i
+        if mask != len(sig.variants) - 1:
+            self.rewrites.append(Rewrite(app, sig.get_variant(mask)))
+
+    def is_trusted(self, ptr):
+        """
+        Return whether the value at ptr can only ever be one whose type is
+        fully determined by inference.
+        """
+        info = _definitions.get(ptr)
+        if info is not None:
+            return info.arity == 0 and info.trusted
+        if ptr in self.params:
+            return False
+        if ptr in self.recs:
+            rec = self.recs[ptr]
+            return rec.arity == 0 and rec.trusted
+
+        node = ptr.node
+        if isinstance(node, PrimitiveNode):
+            return node.types.length() == 1
+        elif isinstance(node, ConsNode):
+            return True
+        elif not isinstance(node, ApplicationNode):
+            return False
+
+        head, args, apps = get_spine(ptr)
+        info = _definitions.get(head)
+        if info is not None:
+            return info.arity == len(args) and info.trusted
+        if head in self.recs:
+            rec = self.recs[head]
+            return rec.arity == len(args) and rec.trusted
+        if head is if_ptr:
+            return (len(args) == 3 and self.is_trusted(args[1]) and
+                    self.is_trusted(args[2]))
+        if head is eq_ptr:
+            return len(args) == 2
+        if isinstance(head.node, OverloadNode):
+            # trusted arguments have the types inference chose the definition
+            # for, so its result has the type inferred for it
+            n = _overload_of(head).arity
+            return len(args) == n and self.all_trusted(args, n)
+        sig = signatures.get(head, None)
+        if sig is not None:
+            return len(args) == len(sig.arg_types)
+        return False
+
+    def infer_definition(self, graph):
+        """
+        Infer the type of the definition graph, and record it (and, if it is
+        well typed, make its rewrites).
+        """
+        head, args, apps = get_spine(graph)
+        if head is Y and len(args) == 1 and isinstance(args[0].node,
+                                                       LambdaNode):
+            lam = args[0].node
+            assert isinstance(lam, LambdaNode)
+            body, arity = strip_lambdas(lam.body)
+            marker = lam.parameter
+        else:
+            arity = 0
+            marker = None
+
+        try:
+            type = self.infer(graph)
+        except TypeClash:
+            # Not well typed, so nothing is proven and no checks can be
+            # removed. Give it the least informative type.
+            var = TypeVar()
+            _definitions.set(graph, DefInfo(Scheme([var], var), arity,
+                                            False))
+            return 0
+
+        if marker is not None:
+            trusted = self.recs[marker].trusted
+        else:
+            trusted = self.is_trusted(graph)
+
+        if self.open:
+            scheme = Scheme([], type)
+        else:
+            scheme = generalise(type)
+        _definitions.set(graph, DefInfo(scheme, arity, trusted))
+
+        removed = 0
+        for r in self.rewrites:
+            r.apply()
+            removed += 1
+        return removed
+
+
+class TypeInferencePass(Pass):
+    name = 'infer-types'
+    level = 2
+
+    def __init__(self):
+        self.rewritten = 0
+
+    def reset(self):
+        self.rewritten = 0
+
+    def run(self, name, graph):
+        self.rewritten += Inferencer().infer_definition(graph)
+        return graph
+
+    def summary(self):
+        return ', %d calls unchecked' % self.rewritten
+
+
+pass_manager.add_pass(TypeInferencePass())
@@ -85,6 +85,17 @@ class rset(object):
     def add(self, elem):
         self._store[elem] = None
 
+    def length(self):
+        return len(self._store)
+
+    def any(self):
+        """
+        Return an arbitrary element. The rset must not be empty.
+        """
+        for k in self._store:
+            return k
+        raise KeyError
+
     def list(self):
         ret = []
         for k in self._store:
@@ -101,6 +112,78 @@ class rset(object):
         return '{' + ', '.join(map(repr, self._store.keys())) + '}'
 
 
+class _LRUEntry(object):
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.prev = self
+        self.next = self
+
+
+class LRUCache(object):
+    """
+    A dictionary from strings to objects holding at most capacity entries.
+    When a new entry would exceed the capacity, the least recently used entry
+    is thrown out to make room.
+
+    The entries are kept in a circular doubly linked list in order of use,
+    most recent first, so that get and put are both constant time. The cache
+    also counts its hits, misses and evictions.
+
+    XXX: As with rset, the program can only make use of a single type of value
+    in LRUCaches.
+    """
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.entries = {}
+        self.head = _LRUEntry('', None)     # sentinel; never evicted
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return the value stored for key, or None if there isn't one.
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._unlink(entry)
+        self._link_first(entry)
+        return entry.value
+
+    def put(self, key, value):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            entry.value = value
+            self._unlink(entry)
+        else:
+            if len(self.entries) >= self.capacity:
+                oldest = self.head.prev
+                self._unlink(oldest)
+                del self.entries[oldest.key]
+                self.evictions += 1
+            entry = _LRUEntry(key, value)
+            self.entries[key] = entry
+        self._link_first(entry)
+
+    def length(self):
+        return len(self.entries)
+
+    def _unlink(self, entry):
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+
+    def _link_first(self, entry):
+        entry.prev = self.head
+        entry.next = self.head.next
+        self.head.next.prev = entry
+        self.head.next = entry
+
+
 # some utility functions used for the dot-viewer capabilities, which cannot
 # be used from the translated interpreter at the moment, so these functions
 # do not have to be RPython